@@ -4,20 +4,33 @@ import datetime
 import functools
 import humanize
 import json
-import math
 import os
-import subprocess
+import threading
 
 import attr
-import boto3
-from flask import Flask, Response, jsonify, render_template, request
-from wellcome_storage_service import StorageServiceClient
-from zipstreamer import ZipFile, ZipStream
-
-from src.database import BagsDatabase
-from src.models import BagIdentifier
-from src.query import QueryContext
-from src.storage_service import StorageService
+from flask import (
+    Flask,
+    Response,
+    abort,
+    jsonify,
+    render_template,
+    request,
+    stream_with_context,
+)
+
+from src.concurrency import NonBlocking
+from src.database import DATE_HISTOGRAM_INTERVALS, query_across_spaces
+from src.export import EXPORT_FORMATS
+from src.metrics import REGISTRY
+from src.models import BagIdentifier, to_timestamp
+from src.query import InvalidQuery, QueryContext
+from src.sharding import open_bags_database
+from src.version import get_git_commit
+
+# Note: the AWS and storage service libraries (boto3, zipstreamer,
+# wellcome_storage_service) are slow to import, and only needed when
+# somebody downloads a bag, so we import them inside the routes that use
+# them.  This keeps worker startup fast.
 
 
 app = Flask(__name__)
@@ -25,7 +38,7 @@ app = Flask(__name__)
 app.jinja_env.filters["intcomma"] = humanize.intcomma
 
 
-GIT_COMMIT = subprocess.check_output(["git", "rev-parse", "HEAD"]).strip().decode("ascii")
+GIT_COMMIT = get_git_commit()
 
 
 @app.context_processor
@@ -33,8 +46,45 @@ def inject_commit():
     return {"git_commit": GIT_COMMIT}
 
 
+# If this is set, we log every request in the format expected by the
+# replay tool in benchmarks/replay.py.
+REQUEST_LOG_PATH = os.environ.get("BAG_BROWSER_REQUEST_LOG")
+_request_log_lock = threading.Lock()
+
+
+@app.after_request
+def log_request(response):
+    if REQUEST_LOG_PATH and request.endpoint not in (None, "static", "metrics"):
+        entry = {
+            "route": request.url_rule.rule,
+            "view_args": request.view_args,
+            "args": request.args.to_dict(),
+        }
+
+        with _request_log_lock, open(REQUEST_LOG_PATH, "a") as outfile:
+            outfile.write(json.dumps(entry) + "\n")
+
+    return response
+
+
+@app.after_request
+def add_worker_header(response):
+    # Each gunicorn worker has its own caches and metrics, so the replay
+    # tool needs to know which process served each request.
+    response.headers["X-Bag-Browser-Worker"] = str(os.getpid())
+    return response
+
+
+@app.errorhandler(InvalidQuery)
+def invalid_query(err):
+    # e.g. a date we can't parse, or a date range that ends before it starts
+    return jsonify({"error": str(err)}), 400
+
+
 @functools.lru_cache()
 def get_storage_client(api_url="https://api.wellcomecollection.org/storage/v1"):
+    from wellcome_storage_service import StorageServiceClient
+
     creds_path = os.path.join(
         os.environ["HOME"], ".wellcome-storage", "oauth-credentials.json"
     )
@@ -48,9 +98,51 @@ def get_storage_client(api_url="https://api.wellcomecollection.org/storage/v1"):
     )
 
 
+# If BAG_BROWSER_DATABASE points to a directory, it's a sharded database
+# with one SQLite file per space.
+BAGS_DATABASE_PATH = os.environ.get("BAG_BROWSER_DATABASE", "bags.db")
+
+# The web app never writes bags to the database -- that's the job of
+# freshen_bag_db.py -- so we open it read-only and skip creating tables.
+bags_database = open_bags_database(BAGS_DATABASE_PATH, read_only=True)
+
+# If the database was created by an older version of the code (e.g. before
+# we had the bag_extensions table), every query would fail until somebody
+# ran freshen_bag_db.py, so we refuse to start instead.
+bags_database.check_schema()
+
+# To capture the query plan of slow statements, set this environment
+# variable to a threshold in seconds, e.g. BAG_BROWSER_SLOW_QUERY_SECONDS=0.5
+if os.environ.get("BAG_BROWSER_SLOW_QUERY_SECONDS"):
+    bags_database.slow_query_threshold = float(
+        os.environ["BAG_BROWSER_SLOW_QUERY_SECONDS"]
+    )
+
+# Under gevent workers, database calls run in a thread pool, so a slow
+# query doesn't stall every other request (and download) in the worker.
+# Without gevent, this makes no difference.  See src/concurrency.py.
+bags_database = NonBlocking(bags_database)
+
+
+def warm_caches():
+    """
+    Run the queries that almost every visitor triggers, so they're already
+    in the cache.
+
+    When we run under gunicorn with --preload, this runs once in the master
+    process, and the cached results are shared copy-on-write with every
+    worker, rather than each worker recomputing them.
+    """
+    # This runs before we fork, so we skip the gevent thread pool.
+    database = bags_database.wrapped
+
+    for space in database.get_spaces():
+        database.query(QueryContext(space=space, external_identifier_prefix=""))
+        database.autocomplete(space, prefix="")
+
+
 @app.route("/")
 def index():
-    bags_database = BagsDatabase.from_path("bags.db")
     spaces = bags_database.get_spaces()
 
     return render_template("index.html", spaces=spaces)
@@ -59,31 +151,76 @@ def index():
 PAGE_SIZE = 250
 
 
-bags_database = BagsDatabase.from_path("bags.db")
-
-
 def query_bags_db(query_context: QueryContext):
-    query_result = bags_database.query(query_context)
+    return serialise_query_result(bags_database.query(query_context))
+
 
-    bags = []
+def serialise_bags(bags):
+    serialised = []
 
-    for bag in query_result.bags:
-        b = attr.asdict(bag)
-        b["id"] = bag.id
-        b["created_date_pretty"] = render_date(b["created_date"])
+    for bag in bags:
+        b = bag.to_dict()
+        b["created_date_pretty"] = render_timestamp(bag.created_timestamp)
         b["file_count_pretty"] = humanize.intcomma(b["file_count"])
         b["file_size_pretty"] = humanize.naturalsize(b["total_file_size"])
-        bags.append(b)
+        serialised.append(b)
+
+    return serialised
 
+
+def serialise_query_result(query_result):
     return {
         "total": query_result.total_count,
         "total_file_size": query_result.total_file_size,
         "total_file_count": query_result.total_file_count,
         "file_ext_tally": query_result.file_ext_tally,
-        "bags": bags,
+        "bags": serialise_bags(query_result.bags),
+    }
+
+
+def pretty_totals(total_count, total_file_count, total_file_size, file_ext_tally):
+    return {
+        # The browser uses the raw count to work out how many pages there are.
+        "total": total_count,
+        "total_bags": humanize.intcomma(total_count),
+        "total_file_count": humanize.intcomma(total_file_count),
+        "total_file_size": humanize.naturalsize(total_file_size),
+        "file_ext_tally": file_ext_tally,
     }
 
 
+def pretty_estimated_totals(estimate):
+    """
+    Like pretty_totals, but for an EstimatedTotals -- each estimate is
+    marked as approximate, with its error bound.
+    """
+    totals = pretty_totals(
+        estimate.total_count,
+        estimate.total_file_count,
+        estimate.total_file_size,
+        estimate.file_ext_tally,
+    )
+
+    if estimate.is_exact:
+        return totals
+
+    def _error(error, render):
+        return "unknown" if error is None else render(error)
+
+    totals["approximate"] = True
+    totals["total_file_count"] = "~" + totals["total_file_count"]
+    totals["total_file_size"] = "~" + totals["total_file_size"]
+    totals["total_file_count_error"] = _error(
+        estimate.total_file_count_error, humanize.intcomma
+    )
+    totals["total_file_size_error"] = _error(
+        estimate.total_file_size_error, humanize.naturalsize
+    )
+    totals["file_ext_tally_error"] = estimate.file_ext_tally_error
+
+    return totals
+
+
 @app.route("/spaces/<space>/get_bags_data")
 def get_bags_data(space):
     query_context = QueryContext(
@@ -98,13 +235,306 @@ def get_bags_data(space):
 
     return jsonify({
         "bags": result["bags"],
-        "total_bags": humanize.intcomma(result["total"]),
-        "total_file_count": humanize.intcomma(result["total_file_count"]),
-        "total_file_size": humanize.naturalsize(result["total_file_size"]),
-        "file_ext_tally": result["file_ext_tally"],
+        **pretty_totals(
+            result["total"],
+            result["total_file_count"],
+            result["total_file_size"],
+            result["file_ext_tally"],
+        ),
+    })
+
+
+@app.route("/spaces/<space>/get_bags_page")
+def get_bags_page(space):
+    """
+    Just the page of bags for a query, without any totals.
+
+    The totals don't depend on the page, so when the browser already has
+    them, it uses this to fetch (or prefetch) another page of results.
+    """
+    query_context = QueryContext(
+        space=space,
+        external_identifier_prefix=request.args.get("prefix", ""),
+        page=int(request.args.get("page", "1")),
+        created_after=request.args.get("created_after"),
+        created_before=request.args.get("created_before"),
+    )
+
+    return jsonify({"bags": serialise_bags(bags_database.query_page(query_context))})
+
+
+@app.route("/spaces/<space>/stream_bags_data")
+def stream_bags_data(space):
+    """
+    A progressive version of get_bags_data, as server-sent events.
+
+    Computing the exact totals and file extension tally can take seconds
+    for a broad query on a big space, so we send two events:
+
+    *   ``page``, with the page of bags and totals estimated from a sample
+        of the matching bags, which is usually quick
+    *   ``totals``, with the exact totals, once we have them
+
+    """
+    query_context = QueryContext(
+        space=space,
+        external_identifier_prefix=request.args.get("prefix", ""),
+        page=int(request.args.get("page", "1")),
+        created_after=request.args.get("created_after"),
+        created_before=request.args.get("created_before"),
+    )
+
+    def _event(name, data):
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+    def generate():
+        yield _event(
+            "page",
+            {
+                "bags": serialise_bags(bags_database.query_page(query_context)),
+                **pretty_estimated_totals(
+                    bags_database.estimate_totals(query_context)
+                ),
+            },
+        )
+
+        result = bags_database.query(query_context)
+        yield _event(
+            "totals",
+            pretty_totals(
+                result.total_count,
+                result.total_file_count,
+                result.total_file_size,
+                result.file_ext_tally,
+            ),
+        )
+
+    resp = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+
+    # Stop nginx (or similar) from buffering the first event until
+    # the second one is ready.
+    resp.headers["X-Accel-Buffering"] = "no"
+
+    return resp
+
+
+@app.route("/search/get_bags_data")
+def search_all_spaces():
+    """
+    Run a query across several spaces (or every space, if ``spaces`` isn't
+    given), e.g. ``/search/get_bags_data?spaces=digitised,born-digital&prefix=b1``
+    """
+    if request.args.get("spaces"):
+        spaces = request.args["spaces"].split(",")
+    else:
+        spaces = None
+
+    query_context = QueryContext(
+        space=None,
+        external_identifier_prefix=request.args.get("prefix", ""),
+        page=int(request.args.get("page", "1")),
+        created_after=request.args.get("created_after"),
+        created_before=request.args.get("created_before"),
+    )
+
+    result = serialise_query_result(
+        query_across_spaces(bags_database, query_context, spaces=spaces)
+    )
+
+    return jsonify({
+        "bags": result["bags"],
+        **pretty_totals(
+            result["total"],
+            result["total_file_count"],
+            result["total_file_size"],
+            result["file_ext_tally"],
+        ),
+    })
+
+
+# The most queries we'll run in a single batch request.
+MAX_BATCH_QUERIES = 100
+
+
+@app.route("/batch/get_bags_data", methods=["POST"])
+def get_bags_data_batch():
+    """
+    Run several queries in one request, e.g. to get the totals for every
+    space for a dashboard.  POST a JSON body like:
+
+        {"queries": [{"space": "digitised", "prefix": "b1", "page_size": 0}, ...]}
+
+    Each query takes the same parameters as get_bags_data, plus a
+    ``page_size`` (up to 250) -- use 0 if you only want the totals.
+    The response has the results in the same order, as ``results``.
+    """
+    body = request.get_json(silent=True)
+
+    try:
+        queries = body["queries"]
+
+        # Everything else gets checked by QueryContext, but a space or
+        # prefix that isn't a string would only fail half-way through
+        # running the query.
+        for query in queries:
+            if not isinstance(query["space"], str) or not isinstance(
+                query.get("prefix", ""), str
+            ):
+                abort(400)
+
+        query_contexts = [
+            QueryContext(
+                space=query["space"],
+                external_identifier_prefix=query.get("prefix", ""),
+                page=int(query.get("page", 1)),
+                page_size=max(
+                    0, min(int(query.get("page_size", PAGE_SIZE)), PAGE_SIZE)
+                ),
+                created_after=query.get("created_after"),
+                created_before=query.get("created_before"),
+            )
+            for query in queries
+        ]
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+
+    if len(query_contexts) > MAX_BATCH_QUERIES:
+        abort(400)
+
+    results = bags_database.query_many(query_contexts)
+
+    return jsonify({
+        "results": [
+            {
+                "bags": serialise_bags(result.bags),
+                **pretty_totals(
+                    result.total_count,
+                    result.total_file_count,
+                    result.total_file_size,
+                    result.file_ext_tally,
+                ),
+            }
+            for result in results
+        ]
     })
 
 
+@app.route("/spaces/<space>/export.<any(csv, ndjson):export_format>")
+def export_bags(space, export_format):
+    """
+    Download every bag that matches a query, as CSV or NDJSON.
+
+    The response is streamed straight from the database, so this uses the
+    same amount of memory whether it returns 10 bags or 2 million.
+    """
+    query_context = QueryContext(
+        space=space,
+        external_identifier_prefix=request.args.get("prefix", ""),
+        created_after=request.args.get("created_after"),
+        created_before=request.args.get("created_before"),
+    )
+
+    serialise, mimetype = EXPORT_FORMATS[export_format]
+
+    resp = Response(
+        stream_with_context(serialise(bags_database.iter_bags(query_context))),
+        mimetype=mimetype,
+    )
+    resp.headers["Content-Disposition"] = f"attachment; filename={space}.{export_format}"
+
+    return resp
+
+
+@app.route("/files/search")
+def search_files():
+    """
+    Search the file index, e.g. ``/files/search?extension=.tif&min_size=1000000000``
+    finds every TIFF over 1 GB.  Results are sorted biggest first.
+    """
+    def _int_arg(name):
+        value = request.args.get(name)
+        return int(value) if value else None
+
+    try:
+        min_size = _int_arg("min_size")
+        max_size = _int_arg("max_size")
+
+        # SQLite treats a negative LIMIT as no limit at all.
+        limit = max(1, min(_int_arg("limit") or 100, 10000))
+    except ValueError:
+        abort(400)
+
+    files = bags_database.find_files(
+        extension=request.args.get("extension") or None,
+        min_size=min_size,
+        max_size=max_size,
+        space=request.args.get("space") or None,
+        limit=limit,
+    )
+
+    return jsonify([attr.asdict(f) for f in files])
+
+
+@app.route("/files/by_checksum/<checksum>")
+def find_files_by_checksum(checksum):
+    try:
+        files = bags_database.find_files_by_checksum(checksum)
+    except ValueError:
+        abort(400)
+
+    return jsonify([attr.asdict(f) for f in files])
+
+
+@app.route("/spaces/<space>/get_date_histogram")
+def get_date_histogram(space):
+    interval = request.args.get("interval", "day")
+    if interval not in DATE_HISTOGRAM_INTERVALS:
+        abort(400)
+
+    query_context = QueryContext(
+        space=space,
+        external_identifier_prefix=request.args.get("prefix", ""),
+        created_after=request.args.get("created_after"),
+        created_before=request.args.get("created_before"),
+    )
+
+    return jsonify({
+        "interval": interval,
+        "periods": bags_database.date_histogram(query_context, interval=interval),
+    })
+
+
+@app.route("/spaces/<space>/get_size_distribution")
+def get_size_distribution(space):
+    query_context = QueryContext(
+        space=space,
+        external_identifier_prefix=request.args.get("prefix", ""),
+        created_after=request.args.get("created_after"),
+        created_before=request.args.get("created_before"),
+    )
+
+    return jsonify(bags_database.size_distribution(query_context))
+
+
+@app.route("/spaces/<space>/autocomplete")
+def autocomplete(space):
+    """
+    Suggest identifiers that start with a prefix, e.g.
+    ``/spaces/digitised/autocomplete?prefix=b12&limit=10``
+    """
+    try:
+        limit = max(1, min(int(request.args.get("limit", "10")), 100))
+    except ValueError:
+        abort(400)
+
+    return jsonify(
+        bags_database.autocomplete(
+            space, prefix=request.args.get("prefix", ""), limit=limit
+        )
+    )
+
+
 @app.route("/spaces/<space>")
 def list_bags_in_space(space):
     query_context = QueryContext(
@@ -115,14 +545,15 @@ def list_bags_in_space(space):
         created_before=request.args.get("created_before", ""),
     )
 
-    result = query_bags_db(query_context)
-    total_pages = int(math.ceil(result["total"] / query_context.page_size))
-
+    # We don't know how many pages there are until the browser gets the
+    # first page of results, so the "next page" link starts hidden, and
+    # QueryContext.pageRendered shows it if there's another page.  Working
+    # it out here would mean waiting for the exact totals before we send
+    # any HTML.
     return render_template(
         "bags_in_space.html",
         space=space,
         page=query_context.page,
-        total_pages=total_pages,
         query_context=query_context,
     )
 
@@ -138,49 +569,130 @@ def get_bag_metadata(space, external_identifier, version):
     )
 
 
+# If this is set, we read storage manifests from the local manifest cache
+# kept by freshen_bag_db.py, and only go to S3 for bags that aren't in it.
+MANIFEST_CACHE_PATH = os.environ.get("BAG_BROWSER_MANIFEST_CACHE")
+
+
+def get_bag_fetcher(s3):
+    """
+    Returns a function that fetches a bag with its storage manifest.  It's
+    safe to call from several threads at once.
+    """
+    from src.aws import AWS_CLIENTS
+    from src.manifest_cache import ManifestCache, load_bag
+    from src.storage_service import StorageService
+
+    ss = StorageService(table_name="vhs-storage-manifests")
+
+    # We may be called from short-lived threads (e.g. when prefetching the
+    # manifests for a multi-bag ZIP), so we get the clients here, and share
+    # them with those threads, rather than creating clients in each one.
+    dynamodb = AWS_CLIENTS.resource("dynamodb").meta.client
+
+    if MANIFEST_CACHE_PATH:
+        manifest_cache = ManifestCache(MANIFEST_CACHE_PATH)
+    else:
+        manifest_cache = None
+
+    def get_bag(bag_identifier):
+        if manifest_cache is not None and bag_identifier in manifest_cache:
+            return load_bag(
+                manifest_cache.path_for(bag_identifier), keep_manifest=True
+            )
+
+        return ss.get_bag(bag_identifier, dynamodb=dynamodb, s3=s3)
+
+    return get_bag
+
+
 @app.route("/bags/<space>/<external_identifier>/v<version>/files")
 def get_bag_files(space, external_identifier, version):
+    from src.aws import AWS_CLIENTS
+    from src.downloads import create_zip_stream
+
     bag_identifier = BagIdentifier(
         space=space, external_identifier=external_identifier, version=version
     )
 
-    ss = StorageService(table_name="vhs-storage-manifests")
-    bag = ss.get_bag(bag_identifier)
+    s3 = AWS_CLIENTS.client("s3")
+    bag = get_bag_fetcher(s3)(bag_identifier)
 
-    s3 = boto3.client("s3")
+    zs = create_zip_stream(bag, s3=s3)
 
-    def files():
-        location = bag.storage_manifest["location"]
-        for bag_file in bag.files():
-            bucket = location["prefix"]["namespace"]
-            key = os.path.join(location["prefix"]["path"], bag_file["path"])
+    resp = Response(zs.generate(), mimetype="application/zip")
+    resp.headers["Content-Disposition"] = "attachment; filename=bag.zip"
+    resp.headers["Content-Length"] = str(zs.size())
 
-            def create_fp(bucket, key):
-                def inner():
-                    return s3.get_object(Bucket=bucket, Key=key)["Body"]
+    return resp
 
-                return inner
 
-            yield ZipFile(
-                filename=bag_file["name"],
-                size=bag_file["size"],
-                create_fp=create_fp(bucket, key),
-                datetime=None,
-                comment=None,
-            )
+@app.route("/spaces/<space>/files.zip")
+def get_query_files(space):
+    """
+    Download the files of every bag that matches a query, as a single ZIP
+    with a directory for each bag.
+
+    We look up each bag's manifest as the ZIP reaches it, so the download
+    starts straight away, however many bags match.
+    """
+    from src.aws import AWS_CLIENTS
+    from src.downloads import create_multi_bag_zip_stream
+
+    query_context = QueryContext(
+        space=space,
+        external_identifier_prefix=request.args.get("prefix", ""),
+        created_after=request.args.get("created_after"),
+        created_before=request.args.get("created_before"),
+    )
 
-    zs = ZipStream(files=list(files()))
+    s3 = AWS_CLIENTS.client("s3")
+    zs = create_multi_bag_zip_stream(
+        bags_database.iter_bags(query_context), get_bag=get_bag_fetcher(s3), s3=s3
+    )
 
     resp = Response(zs.generate(), mimetype="application/zip")
-    resp.headers["Content-Disposition"] = "attachment; filename=bag.zip"
-    resp.headers["Content-Length"] = str(zs.size())
+    resp.headers["Content-Disposition"] = f"attachment; filename={space}.zip"
+
+    # We can only send a Content-Length if we know the size of every bag
+    # in the ZIP; otherwise the response is sent chunked.
+    zip_layout = bags_database.zip_layout(query_context)
+
+    if zip_layout is not None:
+        resp.headers["Content-Length"] = str(zip_layout.archive_size())
 
     return resp
 
 
+@app.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/metrics/aws")
+def aws_stats():
+    """
+    How many AWS clients we have, and how many requests and connections
+    they've made.  See src/aws.py.
+    """
+    from src.aws import AWS_CLIENTS
+
+    return jsonify(AWS_CLIENTS.stats())
+
+
+@app.route("/metrics/slow_queries")
+def slow_queries():
+    return jsonify([attr.asdict(sq) for sq in bags_database.slow_queries])
+
+
 @app.template_filter("render_date")
 def render_date(date_string):
-    date_obj = datetime.datetime.strptime(date_string, "%Y-%m-%dT%H:%M:%S.%fZ")
+    return render_timestamp(to_timestamp(date_string))
+
+
+@app.template_filter("render_timestamp")
+def render_timestamp(timestamp):
+    date_obj = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=timestamp)
 
     if date_obj.date() == datetime.datetime.now().date():
         return humanize.naturaltime(date_obj)
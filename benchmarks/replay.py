@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+Replay a log of HTTP requests against a running copy of the bag browser.
+
+    python -m benchmarks.replay requests.jsonl --concurrency 8
+
+Each line of the log is a JSON object describing one request:
+
+    {"route": "/spaces/<space>/get_bags_data",
+     "view_args": {"space": "digitised"},
+     "args": {"prefix": "b1", "page": "1"}}
+
+The ``route`` is a Flask URL rule, and results are grouped by it.  If
+``view_args`` is omitted, the route is used as a literal path.  The app
+writes logs in this format if you set BAG_BROWSER_REQUEST_LOG.
+
+We report p50/p95/p99 latency per route, and the query cache hit rate
+over the run (scraped from the app's /metrics endpoint).
+
+Each worker process has its own metrics, so the hit rate only makes sense
+if every request went to the same process.  Run the app with a single
+worker that isn't recycled part-way through:
+
+    BAG_BROWSER_WORKERS=1 BAG_BROWSER_MAX_REQUESTS=0 tox -e serve
+
+The app says which process served each response (in the X-Bag-Browser-Worker
+header), and if we see more than one, we don't report a hit rate.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import math
+import re
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+CACHE_METRIC = "bag_browser_query_cache_lookups_total"
+
+WORKER_HEADER = "X-Bag-Browser-Worker"
+
+
+def build_url(base_url, entry):
+    path = entry["route"]
+
+    for name, value in entry.get("view_args", {}).items():
+        path = re.sub(
+            r"<(?:[^:<>]+:)?%s>" % re.escape(name),
+            urllib.parse.quote(str(value), safe=""),
+            path,
+        )
+
+    url = base_url.rstrip("/") + path
+
+    if entry.get("args"):
+        url += "?" + urllib.parse.urlencode(entry["args"])
+
+    return url
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already-sorted list.
+    """
+    if not sorted_values:
+        return None
+
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def read_cache_counts(base_url):
+    """
+    Scrape the query cache hit/miss counters from /metrics, and note which
+    worker process they came from.
+    """
+    counts = {"hit": 0, "miss": 0}
+
+    try:
+        with urllib.request.urlopen(base_url.rstrip("/") + "/metrics") as resp:
+            text = resp.read().decode("utf8")
+            counts["worker"] = resp.headers.get(WORKER_HEADER)
+    except urllib.error.URLError:
+        return None
+
+    for line in text.splitlines():
+        match = re.match(r'^%s\{result="(hit|miss)"\} (\S+)$' % CACHE_METRIC, line)
+        if match:
+            counts[match.group(1)] = float(match.group(2))
+
+    return counts
+
+
+def replay_one(base_url, entry, timeout):
+    url = build_url(base_url, entry)
+
+    worker = None
+
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            # Read the whole body, so we include the time to render and
+            # transfer it, not just the time to first byte.
+            resp.read()
+            status = resp.status
+            worker = resp.headers.get(WORKER_HEADER)
+    except urllib.error.HTTPError as err:
+        status = err.code
+        worker = err.headers.get(WORKER_HEADER)
+    except (urllib.error.URLError, OSError):
+        status = None
+
+    return entry["route"], status, time.perf_counter() - start, worker
+
+
+def replay(base_url, entries, concurrency, timeout):
+    """
+    Replay ``entries`` against the app, and return a dict mapping each
+    route to its list of (status, elapsed, worker) results.
+    """
+    results = collections.defaultdict(list)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(replay_one, base_url, entry, timeout) for entry in entries
+        ]
+
+        for future in concurrent.futures.as_completed(futures):
+            route, status, elapsed, worker = future.result()
+            results[route].append((status, elapsed, worker))
+
+    return results
+
+
+def summarise(results, cache_before, cache_after, wall_time):
+    summary = {"wall_time": wall_time, "routes": {}}
+
+    for route, route_results in sorted(results.items()):
+        timings = sorted(elapsed for _, elapsed, _ in route_results)
+        errors = sum(1 for status, _, _ in route_results if status != 200)
+
+        summary["routes"][route] = {
+            "requests": len(route_results),
+            "errors": errors,
+            "p50": percentile(timings, 50),
+            "p95": percentile(timings, 95),
+            "p99": percentile(timings, 99),
+        }
+
+    if cache_before is None or cache_after is None:
+        return summary
+
+    # If the requests (or the scrapes of /metrics) went to more than one
+    # worker, or the worker was restarted, the counters we scraped don't
+    # cover the run, and the difference between them is meaningless.
+    workers = {
+        worker for route_results in results.values() for _, _, worker in route_results
+    }
+    workers.update([cache_before["worker"], cache_after["worker"]])
+    workers.discard(None)
+
+    if len(workers) > 1:
+        summary["cache"] = {"workers": len(workers)}
+    else:
+        hits = cache_after["hit"] - cache_before["hit"]
+        misses = cache_after["miss"] - cache_before["miss"]
+        summary["cache"] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+        }
+
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'route':48} {'n':>6} {'err':>5} {'p50':>9} {'p95':>9} {'p99':>9}")
+
+    for route, stats in summary["routes"].items():
+        print(
+            f"{route:48} {stats['requests']:6} {stats['errors']:5} "
+            + " ".join(f"{stats[pct] * 1000:7.1f}ms" for pct in ("p50", "p95", "p99"))
+        )
+
+    total = sum(stats["requests"] for stats in summary["routes"].values())
+    print(
+        f"\n{total} requests in {summary['wall_time']:.1f}s "
+        f"({total / summary['wall_time']:.1f} req/s)"
+    )
+
+    cache = summary.get("cache")
+    if cache is None:
+        print("Query cache: unavailable (could not read /metrics)")
+    elif "workers" in cache:
+        print(
+            f"Query cache: unavailable (requests went to {cache['workers']} "
+            "worker processes; run the app with BAG_BROWSER_WORKERS=1 and "
+            "BAG_BROWSER_MAX_REQUESTS=0)"
+        )
+    elif cache["hit_rate"] is None:
+        print("Query cache: no lookups")
+    else:
+        print(
+            f"Query cache: {cache['hits']:.0f} hits, {cache['misses']:.0f} misses "
+            f"({cache['hit_rate']:.1%} hit rate)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("log", help="Path to a JSONL log of requests")
+    parser.add_argument("--base-url", default="http://localhost:3197")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Replay the whole log this many times"
+    )
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    with open(args.log) as infile:
+        entries = [json.loads(line) for line in infile if line.strip()] * args.repeat
+
+    if not entries:
+        sys.exit(f"No requests in {args.log}")
+
+    cache_before = read_cache_counts(args.base_url)
+
+    start = time.perf_counter()
+    results = replay(args.base_url, entries, args.concurrency, args.timeout)
+    wall_time = time.perf_counter() - start
+
+    cache_after = read_cache_counts(args.base_url)
+
+    summary = summarise(results, cache_before, cache_after, wall_time)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
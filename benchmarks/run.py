@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+"""
+Run the bag browser benchmarks against synthetic, production-scale data.
+
+    python -m benchmarks.run --bags 2000000
+
+Every run is appended to benchmarks/results/history.jsonl, and compared
+to the most recent previous run with the same parameters.  Anything that
+got slower by more than --threshold is reported as a regression.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import attr
+import boto3
+from moto import mock_s3
+
+from benchmarks.synthetic import build_database, generate_storage_manifest
+from src.database import BagsDatabase
+from src.downloads import create_zip_stream
+from src.export import export_csv
+from src.models import Bag
+from src.query import QueryContext
+
+
+BENCHMARKS_DIR = pathlib.Path(__file__).parent
+DATA_DIR = BENCHMARKS_DIR / "data"
+RESULTS_PATH = BENCHMARKS_DIR / "results" / "history.jsonl"
+
+
+# The different shapes of query people run in the web app.
+QUERY_SHAPES = {
+    "whole_space": QueryContext(space="digitised", external_identifier_prefix=""),
+    "short_prefix": QueryContext(space="digitised", external_identifier_prefix="b1"),
+    "long_prefix": QueryContext(
+        space="digitised", external_identifier_prefix="b100001"
+    ),
+    "date_range": QueryContext(
+        space="digitised",
+        external_identifier_prefix="",
+        created_after="2021-01-01",
+        created_before="2021-03-31",
+    ),
+    "prefix_and_date": QueryContext(
+        space="digitised",
+        external_identifier_prefix="b10",
+        created_after="2020-06-01",
+        created_before="2022-06-01",
+    ),
+    "small_space": QueryContext(space="miro", external_identifier_prefix=""),
+    "late_page": QueryContext(
+        space="digitised", external_identifier_prefix="", page=100
+    ),
+}
+
+
+def timed(fn, repeat):
+    """
+    Call ``fn`` ``repeat`` times, and return a summary of the timings.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {
+        "unit": "seconds",
+        "min": timings[0],
+        "median": statistics.median(timings),
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+
+
+def get_database(bag_count, seed):
+    """
+    Return a synthetic database with ``bag_count`` bags, reusing a previously
+    generated copy if we have one -- building millions of bags is slow.
+    """
+    DATA_DIR.mkdir(exist_ok=True)
+    path = DATA_DIR / f"bags-{bag_count}-{seed}.db"
+
+    if not path.exists():
+        print(f"Generating {bag_count} bags in {path}...", file=sys.stderr)
+        tmp_path = path.with_suffix(".db.tmp")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        build_database(tmp_path, bag_count=bag_count, seed=seed)
+        os.replace(tmp_path, path)
+
+    return BagsDatabase.from_path(path)
+
+
+def bench_queries(bags_db, repeat):
+    results = {}
+
+    for name, query_context in QUERY_SHAPES.items():
+
+        def run_query():
+            # Clear the cache so we measure the SQL, not the lru_cache.
+            bags_db._make_query.cache_clear()
+            bags_db.query(query_context)
+
+        results[f"query.{name}"] = timed(run_query, repeat=repeat)
+
+        def run_page_and_estimate():
+            bags_db._make_query_page.cache_clear()
+            bags_db._make_estimate.cache_clear()
+            bags_db.query_page(query_context)
+            bags_db.estimate_totals(query_context)
+
+        results[f"page_and_estimate.{name}"] = timed(
+            run_page_and_estimate, repeat=repeat
+        )
+
+        def run_size_distribution():
+            bags_db._make_size_distribution.cache_clear()
+            bags_db.size_distribution(query_context)
+
+        results[f"size_distribution.{name}"] = timed(
+            run_size_distribution, repeat=repeat
+        )
+
+    results["get_spaces"] = timed(bags_db.get_spaces, repeat=repeat)
+
+    return results
+
+
+def bench_listing(bags_db, repeat):
+    """
+    Time the two ways we list bags: a 250-row page of results, turned into
+    dicts for the JSON API, and a CSV export of an entire space.
+    """
+    page_context = QueryContext(
+        space="digitised", external_identifier_prefix="", page=3, page_size=250
+    )
+
+    def run_page():
+        bags_db._make_query_page.cache_clear()
+        [bag.to_dict() for bag in bags_db.query_page(page_context)]
+
+    def run_export():
+        for _ in export_csv(bags_db.iter_bags(QUERY_SHAPES["whole_space"])):
+            pass
+
+    return {
+        "listing.page_250": timed(run_page, repeat=repeat),
+        "listing.export_csv": timed(run_export, repeat=repeat),
+    }
+
+
+def bench_dashboard(bags_db, repeat):
+    """
+    Time getting the totals for every space, with and without a date
+    filter: one query per space (as get_bags_data would), and all of them
+    in one call to query_many (as the batch endpoint does).
+    """
+    spaces = sorted(bags_db.get_spaces())
+    results = {}
+
+    for name, dates in [
+        ("every_space", {}),
+        (
+            "every_space_date_range",
+            {"created_after": "2020-01-01", "created_before": "2021-12-31"},
+        ),
+    ]:
+        query_contexts = [
+            QueryContext(space=space, external_identifier_prefix="", **dates)
+            for space in spaces
+        ]
+
+        def run_one_by_one():
+            bags_db._make_query.cache_clear()
+            for query_context in query_contexts:
+                bags_db.query(query_context)
+
+        def run_batch():
+            bags_db._make_query_many.cache_clear()
+            bags_db.query_many(
+                [
+                    attr.evolve(query_context, page_size=0)
+                    for query_context in query_contexts
+                ]
+            )
+
+        results[f"dashboard.{name}.one_by_one"] = timed(run_one_by_one, repeat=repeat)
+        results[f"dashboard.{name}.batch"] = timed(run_batch, repeat=repeat)
+
+    return results
+
+
+def bench_ingest(bag_count, seed):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        build_database(pathlib.Path(tmp_dir) / "bags.db", bag_count, seed=seed)
+        elapsed = time.perf_counter() - start
+
+    return {"ingest": {"unit": "bags/second", "rate": bag_count / elapsed}}
+
+
+def bench_manifest_parsing(file_count, repeat):
+    storage_manifest = generate_storage_manifest(file_count=file_count)
+
+    return {
+        "from_storage_manifest": timed(
+            lambda: Bag.from_storage_manifest(storage_manifest), repeat=repeat
+        )
+    }
+
+
+@mock_s3
+def bench_zip_streaming(file_count, file_size):
+    s3 = boto3.client("s3", region_name="us-east-1")
+
+    storage_manifest = generate_storage_manifest(file_count=file_count, seed=1)
+    bucket = storage_manifest["location"]["prefix"]["namespace"]
+    prefix = storage_manifest["location"]["prefix"]["path"]
+    s3.create_bucket(Bucket=bucket)
+
+    body = b"x" * file_size
+    for bag_file in storage_manifest["manifest"]["files"] + storage_manifest[
+        "tagManifest"
+    ]["files"]:
+        bag_file["size"] = file_size
+        s3.put_object(Bucket=bucket, Key=f"{prefix}/{bag_file['path']}", Body=body)
+
+    bag = Bag.from_storage_manifest(storage_manifest)
+    zs = create_zip_stream(bag, s3=s3)
+    expected_size = zs.size()
+
+    start = time.perf_counter()
+    streamed = sum(len(chunk) for chunk in zs.generate())
+    elapsed = time.perf_counter() - start
+
+    assert streamed == expected_size, (streamed, expected_size)
+
+    return {"zip_streaming": {"unit": "bytes/second", "rate": streamed / elapsed}}
+
+
+def previous_run(params):
+    try:
+        with open(RESULTS_PATH) as infile:
+            runs = [json.loads(line) for line in infile if line.strip()]
+    except FileNotFoundError:
+        return None
+
+    matching = [run for run in runs if run["params"] == params]
+    return matching[-1] if matching else None
+
+
+def find_regressions(previous, current, threshold):
+    """
+    Compare two sets of results, and return a description of anything
+    that got worse by more than ``threshold`` (a fraction).
+    """
+    regressions = []
+
+    for name, result in sorted(current.items()):
+        try:
+            old_result = previous[name]
+        except KeyError:
+            continue
+
+        if result["unit"] == "seconds":
+            old, new = old_result["median"], result["median"]
+            change = (new - old) / old if old else 0
+        else:
+            old, new = old_result["rate"], result["rate"]
+            change = (old - new) / old if old else 0
+
+        if change > threshold:
+            regressions.append(
+                f"{name}: {old:.4g} -> {new:.4g} {result['unit']} "
+                f"({change:.0%} worse)"
+            )
+
+    return regressions
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BENCHMARKS_DIR)
+            .strip()
+            .decode("ascii")
+        )
+    except (OSError, subprocess.CalledProcessError):  # pragma: no cover
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bags", type=int, default=1000000)
+    parser.add_argument("--ingest-bags", type=int, default=20000)
+    parser.add_argument("--manifest-files", type=int, default=100000)
+    parser.add_argument("--zip-files", type=int, default=200)
+    parser.add_argument("--zip-file-size", type=int, default=256 * 1024)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument(
+        "--only",
+        help="Only run benchmarks whose name starts with this, e.g. 'query'",
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="Exit with a non-zero status if anything regressed",
+    )
+    args = parser.parse_args()
+
+    suites = {
+        "query": lambda: bench_queries(get_database(args.bags, args.seed), args.repeat),
+        "listing": lambda: bench_listing(
+            get_database(args.bags, args.seed), args.repeat
+        ),
+        "dashboard": lambda: bench_dashboard(
+            get_database(args.bags, args.seed), args.repeat
+        ),
+        "ingest": lambda: bench_ingest(args.ingest_bags, args.seed),
+        "from_storage_manifest": lambda: bench_manifest_parsing(
+            args.manifest_files, args.repeat
+        ),
+        "zip_streaming": lambda: bench_zip_streaming(
+            args.zip_files, args.zip_file_size
+        ),
+    }
+
+    results = {}
+    for name, suite in suites.items():
+        if args.only and not name.startswith(args.only):
+            continue
+        print(f"Running {name}...", file=sys.stderr)
+        results.update(suite())
+
+    params = {k: v for k, v in vars(args).items() if k not in ("fail_on_regression",)}
+    previous = previous_run(params)
+
+    for name, result in sorted(results.items()):
+        if result["unit"] == "seconds":
+            print(f"{name:32} {result['median'] * 1000:10.2f} ms (median)")
+        else:
+            print(f"{name:32} {result['rate']:14,.0f} {result['unit']}")
+
+    run = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "params": params,
+        "results": results,
+    }
+
+    RESULTS_PATH.parent.mkdir(exist_ok=True)
+    with open(RESULTS_PATH, "a") as outfile:
+        outfile.write(json.dumps(run) + "\n")
+
+    if previous is None:
+        return
+
+    regressions = find_regressions(
+        previous["results"], results, threshold=args.threshold
+    )
+    if regressions:
+        print("\nRegressions since %s:" % previous["git_commit"])
+        for line in regressions:
+            print("  " + line)
+
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
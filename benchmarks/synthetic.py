@@ -0,0 +1,239 @@
+"""
+Deterministic generators for synthetic bags, databases and storage manifests.
+
+The shape of the data is loosely modelled on the real storage service:
+
+*   most bags live in one or two big spaces (digitised, born-digital), with
+    a long tail of small spaces
+*   most bags only have one version, but a few have dozens
+*   there are tens of file extensions, a handful of which are very common,
+    and some of which appear with inconsistent case (.JP2 vs .jp2)
+
+Everything is driven by a seeded ``random.Random``, so the same arguments
+always produce the same data.
+"""
+
+import datetime
+import hashlib
+import random
+
+from src.database import BagsDatabase
+from src.models import Bag, BagIdentifier
+from src.sketch import SizeSketch
+
+
+SPACES = [
+    ("digitised", 0.78),
+    ("born-digital", 0.12),
+    ("born-digital-accessions", 0.05),
+    ("testing", 0.03),
+    ("miro", 0.015),
+    ("archivematica", 0.005),
+]
+
+# Extensions, very roughly in order of how common they are.
+EXTENSIONS = [
+    ".jp2",
+    ".xml",
+    ".tif",
+    ".pdf",
+    ".jpg",
+    ".JP2",
+    ".mp4",
+    ".wav",
+    ".txt",
+    ".doc",
+    ".docx",
+    ".xls",
+    ".xlsx",
+    ".csv",
+    ".json",
+    ".html",
+    ".htm",
+    ".png",
+    ".gif",
+    ".TIF",
+    ".mov",
+    ".mp3",
+    ".ppt",
+    ".pptx",
+    ".eml",
+    ".msg",
+    ".zip",
+    ".psd",
+    ".rtf",
+    ".odt",
+    ".XML",
+    "",
+]
+
+_EXTENSION_WEIGHTS = [1 / (rank + 1) ** 1.2 for rank in range(len(EXTENSIONS))]
+
+_EPOCH = datetime.datetime(2019, 1, 1)
+_DATE_RANGE_SECONDS = 7 * 365 * 24 * 60 * 60
+
+
+def _choose_space(rng):
+    return rng.choices(
+        [name for name, _ in SPACES], weights=[weight for _, weight in SPACES]
+    )[0]
+
+
+def _external_identifier(rng, space, number):
+    if space == "digitised":
+        return "b%08d" % (10000000 + number)
+    elif space.startswith("born-digital"):
+        return "PP/%s/%d/%d" % (
+            rng.choice(["CRI", "MON", "FHA", "SAF", "ABC"]),
+            number // 100,
+            number % 100,
+        )
+    else:
+        return "%s-%d" % (space, number)
+
+
+def _version_count(rng):
+    # Most bags have a single version, but a few have been re-ingested
+    # many times.
+    count = 1
+    while rng.random() < 0.15 and count < 50:
+        count += 1
+    return count
+
+
+def _created_date(rng):
+    offset = rng.randrange(_DATE_RANGE_SECONDS)
+    created = _EPOCH + datetime.timedelta(
+        seconds=offset, microseconds=rng.randrange(1000000)
+    )
+    return created.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _file_size(rng):
+    # File sizes are roughly log-normal: lots of small XML/JP2 files,
+    # and a few very large video files.
+    return int(rng.lognormvariate(mu=13, sigma=2.5))
+
+
+def generate_bags(count, seed=0):
+    """
+    Generate ``count`` synthetic bags.
+    """
+    rng = random.Random(seed)
+
+    number = 0
+    generated = 0
+
+    while generated < count:
+        space = _choose_space(rng)
+        external_identifier = _external_identifier(rng, space, number)
+        number += 1
+
+        for version in range(1, _version_count(rng) + 1):
+            if generated == count:
+                break
+
+            file_count = max(1, int(rng.lognormvariate(mu=3.5, sigma=1.3)))
+            extensions = rng.choices(
+                EXTENSIONS, weights=_EXTENSION_WEIGHTS, k=min(file_count, 8)
+            )
+
+            file_ext_tally = {}
+            for i in range(file_count):
+                ext = extensions[i % len(extensions)]
+                file_ext_tally[ext] = file_ext_tally.get(ext, 0) + 1
+
+            created_date = _created_date(rng)
+
+            # We only sample up to 20 file sizes, and assume the rest of
+            # the bag looks the same.
+            sizes = [_file_size(rng) for _ in range(min(file_count, 20))]
+            sizes *= max(1, file_count // 20)
+
+            yield Bag(
+                identifier=BagIdentifier(
+                    space=space,
+                    external_identifier=external_identifier,
+                    version=version,
+                ),
+                created_date=created_date,
+                file_count=file_count,
+                total_file_size=sum(sizes),
+                file_ext_tally=file_ext_tally,
+                size_sketch=SizeSketch.from_sizes(sizes),
+            )
+
+            generated += 1
+
+
+def build_database(path, bag_count, seed=0, commit_every=1000):
+    """
+    Create a bags database at ``path`` holding ``bag_count`` synthetic bags.
+
+    Like rebuild_database, we commit in batches -- committing after every
+    bag makes building a database with millions of bags impractically slow.
+    """
+    bags_db = BagsDatabase.from_path(path)
+
+    with bags_db.bulk_store_bags(commit_every=commit_every) as bulk_helper:
+        for bag in generate_bags(bag_count, seed=seed):
+            bulk_helper.store_bag(bag)
+
+    return bags_db
+
+
+def generate_storage_manifest(
+    file_count, seed=0, space="digitised", bucket="wellcomecollection-storage"
+):
+    """
+    Generate a storage manifest with ``file_count`` files, in the same
+    shape as the manifests the storage service writes to S3.
+    """
+    rng = random.Random(seed)
+
+    external_identifier = "b%08d" % rng.randrange(10000000, 20000000)
+    version = rng.randrange(1, 5)
+
+    files = []
+    for i in range(file_count):
+        extension = rng.choices(EXTENSIONS, weights=_EXTENSION_WEIGHTS)[0]
+        name = "data/objects/%s_%06d%s" % (external_identifier, i, extension)
+        files.append(
+            {
+                "checksum": hashlib.sha256(name.encode("utf8")).hexdigest(),
+                "name": name,
+                "path": "v%d/%s" % (version, name),
+                "size": _file_size(rng),
+            }
+        )
+
+    tag_files = [
+        {
+            "checksum": hashlib.sha256(name.encode("utf8")).hexdigest(),
+            "name": name,
+            "path": "v%d/%s" % (version, name),
+            "size": rng.randrange(100, 10000),
+        }
+        for name in [
+            "bagit.txt",
+            "bag-info.txt",
+            "manifest-sha256.txt",
+            "tagmanifest-sha256.txt",
+        ]
+    ]
+
+    return {
+        "space": space,
+        "info": {"externalIdentifier": external_identifier},
+        "version": version,
+        "createdDate": _created_date(rng),
+        "manifest": {"checksumAlgorithm": "SHA-256", "files": files},
+        "tagManifest": {"checksumAlgorithm": "SHA-256", "files": tag_files},
+        "location": {
+            "provider": {"type": "amazon-s3"},
+            "prefix": {
+                "namespace": bucket,
+                "path": "%s/%s" % (space, external_identifier),
+            },
+        },
+    }
@@ -1,24 +1,140 @@
 #!/usr/bin/env python
 
-from src.database import BagsDatabase
+import argparse
+import os
+import sys
+
+from src.manifest_cache import ManifestCache
+from src.sharding import ShardedBagsDatabase, open_bags_database
+from src.snapshot import snapshot
 from src.storage_service import StorageService
+from src.telemetry import IngestTelemetry
 
 import tqdm
 
 
-if __name__ == "__main__":
-    bags_database = BagsDatabase.from_path("bags.db")
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fetch any new bags from the storage service into the bags database."
+    )
+    parser.add_argument(
+        "database",
+        nargs="?",
+        default=os.environ.get("BAG_BROWSER_DATABASE", "bags.db"),
+        help="Path to the bags database (default: bags.db)",
+    )
+    parser.add_argument(
+        "--sharded",
+        action="store_true",
+        help="Store each space in a separate SQLite file, in a directory at DATABASE",
+    )
+    parser.add_argument(
+        "--index-files",
+        action="store_true",
+        help="Record every file in each new bag in the file index",
+    )
+    parser.add_argument(
+        "--manifest-cache",
+        default=os.environ.get("BAG_BROWSER_MANIFEST_CACHE"),
+        help="Save a copy of each new storage manifest in this directory, so the database can be rebuilt offline with rebuild_bag_db.py",
+    )
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Write the new bags to a copy of the database, and swap it into place when we're done, so the web app isn't disturbed",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of manifests to fetch at once (default: 1)",
+    )
+    parser.add_argument(
+        "--telemetry",
+        default=os.environ.get("BAG_BROWSER_FRESHEN_TELEMETRY"),
+        help="Append per-stage timings and counters to this file as JSON lines, so you can see where a slow run spends its time",
+    )
+    parser.add_argument(
+        "--telemetry-interval",
+        type=float,
+        default=10,
+        help="Seconds between lines of telemetry (default: 10)",
+    )
+    return parser.parse_args()
+
+
+def open_database(path, args):
+    if args.sharded:
+        return ShardedBagsDatabase.from_path(path, index_files=args.index_files)
+    else:
+        return open_bags_database(path, index_files=args.index_files)
 
+
+def freshen(bags_database, manifest_cache, commit_every, workers, telemetry):
     known_bag_ids = bags_database.get_known_ids()
 
-    ss = StorageService(table_name="vhs-storage-manifests")
+    ss = StorageService(table_name="vhs-storage-manifests", telemetry=telemetry)
     total_bags = ss.total_bags()
 
-    for bag_identifier in tqdm.tqdm(ss.get_bag_identifiers(), total=total_bags):
-        if bag_identifier.id in known_bag_ids:
-            continue
+    def _bags_to_fetch():
+        for bag_identifier in tqdm.tqdm(ss.get_bag_identifiers(), total=total_bags):
+            telemetry.maybe_report()
+
+            # If we're keeping a manifest cache, we also fetch any bags that
+            # we stored before we started caching, so the cache is complete.
+            if bag_identifier.id in known_bag_ids and (
+                manifest_cache is None or bag_identifier in manifest_cache
+            ):
+                continue
+
+            yield bag_identifier
+
+    # We fetch manifests in worker threads, but only write to SQLite from
+    # this thread, one bag at a time.
+    with bags_database.bulk_store_bags(commit_every=commit_every) as bulk_helper:
+        for bag in ss.get_bags(_bags_to_fetch(), workers=workers):
+            if manifest_cache is not None:
+                with telemetry.stage("cache_write"):
+                    manifest_cache.save(bag)
+
+            if bag.id not in known_bag_ids:
+                with telemetry.stage("sqlite_write"):
+                    bulk_helper.store_bag(bag)
+
+            telemetry.maybe_report()
+
+    print(telemetry.finish(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.manifest_cache:
+        manifest_cache = ManifestCache(args.manifest_cache)
+    else:
+        manifest_cache = None
 
-        bag = ss.get_bag(bag_identifier)
+    telemetry = IngestTelemetry(
+        output=open(args.telemetry, "a") if args.telemetry else None,
+        interval=args.telemetry_interval,
+    )
 
-        with bags_database.bulk_store_bags() as bulk_helper:
-            bulk_helper.store_bag(bag)
+    if args.snapshot:
+        # Nobody else is reading the copy, so we can commit in big batches.
+        with snapshot(args.database) as snapshot_path:
+            freshen(
+                open_database(snapshot_path, args),
+                manifest_cache=manifest_cache,
+                commit_every=1000,
+                workers=args.workers,
+                telemetry=telemetry,
+            )
+    else:
+        # Commit after every bag, so an interrupted run keeps its progress.
+        freshen(
+            open_database(args.database, args),
+            manifest_cache=manifest_cache,
+            commit_every=1,
+            workers=args.workers,
+            telemetry=telemetry,
+        )
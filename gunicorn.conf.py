@@ -0,0 +1,66 @@
+"""
+Settings for serving the bag browser with gunicorn.
+
+We load the app once in the master process (``preload_app``) and warm the
+query caches there, then fork the workers.  The workers share those warmed
+structures copy-on-write, so starting or recycling a worker is cheap.
+
+To stop the garbage collector from touching (and so copying) every shared
+object in every worker, we follow the recipe in the docs for gc.freeze():
+disable the collector in the master, freeze everything just before we fork,
+and re-enable it in each worker.
+See https://docs.python.org/3/library/gc.html#gc.freeze
+"""
+
+import gc
+import os
+
+
+# By default we use sync workers, which handle one request at a time.  A ZIP
+# download holds its worker for the whole transfer, which can take hours,
+# so a few downloads can leave no workers free for queries.
+#
+# Set BAG_BROWSER_WORKER_CLASS=gevent to serve each request in a greenlet
+# instead: a worker can then stream many downloads at once, and database
+# queries run in a thread pool so they don't stall the downloads (see
+# src/concurrency.py).
+worker_class = os.environ.get("BAG_BROWSER_WORKER_CLASS", "sync")
+
+if worker_class == "gevent":
+    # We preload the app in the master process, so we have to patch the
+    # standard library before the app (or anything it imports) is loaded,
+    # not in the worker after the fork.
+    from gevent import monkey
+
+    monkey.patch_all()
+
+    # How many requests each worker serves at once.
+    worker_connections = int(os.environ.get("BAG_BROWSER_WORKER_CONNECTIONS", "1000"))
+
+
+bind = os.environ.get("BAG_BROWSER_BIND", "localhost:3197")
+workers = int(os.environ.get("BAG_BROWSER_WORKERS", "4"))
+
+preload_app = True
+
+# Recycle workers now and again, in case anything leaks.  This is cheap
+# because workers don't have to import or warm anything.  Set
+# BAG_BROWSER_MAX_REQUESTS=0 to turn this off, e.g. when replaying traffic
+# with benchmarks/replay.py, which needs the same worker for the whole run.
+max_requests = int(os.environ.get("BAG_BROWSER_MAX_REQUESTS", "1000"))
+max_requests_jitter = 100
+
+gc.disable()
+
+
+def when_ready(server):
+    # With preload_app, the app module is imported before this hook runs,
+    # so this import is free.
+    import app
+
+    app.warm_caches()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
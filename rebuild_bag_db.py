@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import pathlib
+import shutil
+import sys
+
+from src.database import BagsDatabase
+from src.manifest_cache import ManifestCache, rebuild_database
+from src.sharding import ShardedBagsDatabase
+from src.snapshot import publish_snapshot
+
+import tqdm
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the bags database from a local cache of storage manifests, without talking to AWS."
+    )
+    parser.add_argument(
+        "database",
+        nargs="?",
+        default=os.environ.get("BAG_BROWSER_DATABASE", "bags.db"),
+        help="Path to write the new bags database (default: bags.db)",
+    )
+    parser.add_argument(
+        "--manifest-cache",
+        default=os.environ.get("BAG_BROWSER_MANIFEST_CACHE", "manifests"),
+        help="Directory of cached manifests, as saved by freshen_bag_db.py (default: manifests)",
+    )
+    parser.add_argument(
+        "--sharded",
+        action="store_true",
+        help="Store each space in a separate SQLite file, in a directory at DATABASE",
+    )
+    parser.add_argument(
+        "--index-files",
+        action="store_true",
+        help="Record every file in each bag in the file index",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Number of worker processes for parsing manifests (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Replace DATABASE if it already exists",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    manifest_cache = ManifestCache(args.manifest_cache)
+    paths = manifest_cache.paths()
+    if not paths:
+        sys.exit(f"No cached manifests in {args.manifest_cache}")
+
+    database = pathlib.Path(args.database)
+    if database.exists() and not args.force:
+        sys.exit(f"{database} already exists; use --force to replace it")
+
+    # We build the new database alongside the old one, and only swap it
+    # into place once it's complete -- so the app can keep serving the
+    # old database while we rebuild, and a failed rebuild loses nothing.
+    tmp_database = database.with_name(database.name + ".rebuild")
+    if tmp_database.is_dir():
+        shutil.rmtree(tmp_database)
+    elif tmp_database.exists():
+        tmp_database.unlink()
+
+    if args.sharded:
+        bags_database = ShardedBagsDatabase.from_path(
+            tmp_database, index_files=args.index_files
+        )
+    else:
+        bags_database = BagsDatabase.from_path(
+            tmp_database, index_files=args.index_files
+        )
+
+    for _ in tqdm.tqdm(
+        rebuild_database(manifest_cache, bags_database, processes=args.processes),
+        total=len(paths),
+    ):
+        pass
+
+    publish_snapshot(tmp_database, database)
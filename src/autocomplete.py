@@ -0,0 +1,80 @@
+import bisect
+import sys
+
+import attr
+
+
+def prefix_upper_bound(prefix):
+    """
+    Returns the smallest string that sorts after every string starting
+    with ``prefix``, e.g. "b12" -> "b13", or None if there isn't one
+    (e.g. if the prefix is empty).
+    """
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+
+    if not prefix:
+        return None
+
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+@attr.s(eq=False)
+class IdentifierIndex:
+    """
+    A sorted array of the distinct external identifiers in a space, for
+    answering autocomplete queries.
+
+    Everything we need is a binary search away: the identifiers starting
+    with a prefix are a contiguous slice of the array, and we can count
+    them without looking at them.
+    """
+
+    identifiers = attr.ib(converter=sorted)
+
+    def _end_of_prefix(self, prefix, lo=0, hi=None):
+        """
+        Returns the index just after the last identifier (in the slice
+        lo:hi) that starts with ``prefix``.
+        """
+        if hi is None:
+            hi = len(self.identifiers)
+
+        upper_bound = prefix_upper_bound(prefix)
+
+        if upper_bound is None:
+            return hi
+
+        return bisect.bisect_left(self.identifiers, upper_bound, lo, hi)
+
+    def complete(self, prefix, limit=10):
+        """
+        Returns the first ``limit`` identifiers that start with ``prefix``,
+        how many identifiers start with it, and how many of those continue
+        with each possible next character.
+        """
+        lo = bisect.bisect_left(self.identifiers, prefix)
+        hi = self._end_of_prefix(prefix, lo)
+
+        # Rather than looking at every matching identifier, we look at the
+        # first identifier with each next character, and jump over the rest
+        # with a binary search.  That's one search per distinct character.
+        next_characters = {}
+        i = lo
+        while i < hi:
+            identifier = self.identifiers[i]
+
+            if len(identifier) == len(prefix):
+                i += 1
+                continue
+
+            char = identifier[len(prefix)]
+            j = self._end_of_prefix(prefix + char, i, hi)
+            next_characters[char] = j - i
+            i = j
+
+        return {
+            "prefix": prefix,
+            "total": hi - lo,
+            "identifiers": self.identifiers[lo : min(hi, lo + limit)],
+            "next_characters": next_characters,
+        }
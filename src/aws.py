@@ -0,0 +1,193 @@
+"""
+Shared boto3 clients, with connection pooling and retries tuned for us.
+
+Creating a boto3 client is slow -- it resolves credentials and loads the
+service model -- and every client has its own pool of connections, so
+creating one per request means a new TLS connection to AWS every time.
+
+Instead, AwsClients creates each client once per thread, and hands out the
+same one after that.  boto3 sessions aren't thread-safe, so each thread
+creates its clients from its own session.  Under gevent, every greenlet in
+a thread shares the same clients (clients are safe to share), otherwise
+we'd create a client for every request.
+"""
+
+import os
+import threading
+import weakref
+
+import attr
+import boto3
+import botocore.config
+
+from src.concurrency import gevent_is_active
+from src.metrics import REGISTRY
+
+
+def _thread_local():
+    if gevent_is_active():
+        from gevent import monkey
+
+        # gevent replaces threading.local with a greenlet-local; we want the
+        # original, which is shared by every greenlet in an OS thread.
+        return monkey.get_original("threading", "local")()
+
+    return threading.local()
+
+
+def _pool_stats(client):
+    """
+    Returns the (requests, connections) made through the connection pools
+    of a client.  These are urllib3 internals, which botocore doesn't expose.
+    """
+    http_session = client._endpoint.http_session
+    managers = [http_session._manager] + list(http_session._proxy_managers.values())
+
+    requests = connections = 0
+
+    for manager in managers:
+        # A pool may be evicted between listing the keys and getting it.
+        pools = [manager.pools.get(key) for key in manager.pools.keys()]
+
+        for pool in filter(None, pools):
+            requests += pool.num_requests
+            connections += pool.num_connections
+
+    return requests, connections
+
+
+@attr.s(eq=False)
+class AwsClients:
+    """
+    Hands out boto3 clients and resources, creating them at most once per
+    thread (and per process, because gunicorn forks after loading the app).
+
+    ``max_attempts`` includes the first attempt, so 1 means no retries.
+
+    ``max_pool_connections`` is the number of connections each client keeps
+    open.  Under gevent, every download in a worker shares one client, so
+    it should be at least the number of downloads you expect at once.
+    """
+
+    max_pool_connections = attr.ib(default=10)
+    retry_mode = attr.ib(default="adaptive")
+    max_attempts = attr.ib(default=10)
+    connect_timeout = attr.ib(default=5)
+    read_timeout = attr.ib(default=60)
+    metrics = attr.ib(default=REGISTRY)
+
+    def __attrs_post_init__(self):
+        self._local = _thread_local()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+        # Every client we've created that's still in use, so we can report
+        # on their connection pools.
+        self._clients = weakref.WeakSet()
+
+        self._clients_created = self.metrics.counter(
+            "bag_browser_aws_clients_created_total",
+            "boto3 clients (and resources) created, by service",
+        )
+        self._client_reuses = self.metrics.counter(
+            "bag_browser_aws_client_reuses_total",
+            "Times we reused an existing boto3 client, by service",
+        )
+        self._requests = self.metrics.counter(
+            "bag_browser_aws_requests_total",
+            "HTTP requests sent to AWS (including retries), by service",
+        )
+
+    @property
+    def config(self):
+        return botocore.config.Config(
+            max_pool_connections=self.max_pool_connections,
+            retries={"mode": self.retry_mode, "total_max_attempts": self.max_attempts},
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+        )
+
+    def _cache(self):
+        # A child process can't share its parent's connections, so if we've
+        # been forked, we start again.
+        if os.getpid() != self._pid:
+            self._local = _thread_local()
+            self._pid = os.getpid()
+
+        try:
+            return self._local.session, self._local.cache
+        except AttributeError:
+            self._local.session = boto3.session.Session()
+            self._local.cache = {}
+            return self._local.session, self._local.cache
+
+    def _get(self, kind, service_name, **kwargs):
+        session, cache = self._cache()
+        key = (kind, service_name, tuple(sorted(kwargs.items())))
+
+        try:
+            value = cache[key]
+        except KeyError:
+            pass
+        else:
+            self._client_reuses.inc(service=service_name)
+            return value
+
+        create = session.client if kind == "client" else session.resource
+        value = cache[key] = create(service_name, config=self.config, **kwargs)
+        self._clients_created.inc(service=service_name)
+
+        client = value if kind == "client" else value.meta.client
+
+        def count_request(**_):
+            self._requests.inc(service=service_name)
+
+        client.meta.events.register("request-created", count_request)
+
+        with self._lock:
+            self._clients.add(client)
+
+        return value
+
+    def client(self, service_name, **kwargs):
+        return self._get("client", service_name, **kwargs)
+
+    def resource(self, service_name, **kwargs):
+        """
+        Returns a boto3 resource.  Unlike clients, resources aren't safe to
+        share between threads, so don't pass them to another thread (their
+        ``meta.client`` is fine).
+        """
+        return self._get("resource", service_name, **kwargs)
+
+    def stats(self):
+        """
+        For each service, the number of clients in use, and the requests and
+        connections they've made.  If connections are being reused, there
+        should be far fewer connections than requests.
+        """
+        with self._lock:
+            clients = list(self._clients)
+
+        stats = {}
+
+        for client in clients:
+            service_name = client.meta.service_model.service_name
+            requests, connections = _pool_stats(client)
+
+            service_stats = stats.setdefault(
+                service_name, {"clients": 0, "requests": 0, "connections": 0}
+            )
+            service_stats["clients"] += 1
+            service_stats["requests"] += requests
+            service_stats["connections"] += connections
+
+        return stats
+
+
+# The clients used by the app and scripts, unless they're given their own.
+AWS_CLIENTS = AwsClients(
+    max_pool_connections=int(
+        os.environ.get("BAG_BROWSER_AWS_MAX_POOL_CONNECTIONS", "10")
+    )
+)
@@ -0,0 +1,66 @@
+"""
+Helpers for running the app under gevent workers.
+
+Under gevent, everything that does network I/O (like streaming a ZIP from
+S3 to a slow client) yields to other requests while it waits, so one
+worker can serve many downloads at once.  But SQLite queries run in C and
+never yield: a slow query would freeze every other request in the worker.
+
+So when gevent is active, we run blocking calls in gevent's pool of real
+OS threads, and the worker keeps serving other requests while the query
+runs.  SQLite releases the GIL while it works, so this costs very little.
+Without gevent, these helpers just call the function directly.
+"""
+
+import attr
+
+
+def gevent_is_active():
+    """
+    Returns True if the standard library has been monkey-patched by gevent,
+    e.g. because we're running in a gunicorn gevent worker.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+
+    return monkey.is_module_patched("socket")
+
+
+def run_blocking(fn, *args, **kwargs):
+    """
+    Call ``fn(*args, **kwargs)``, without blocking other greenlets if
+    we're running under gevent.
+    """
+    if gevent_is_active():
+        import gevent
+
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+
+    return fn(*args, **kwargs)
+
+
+@attr.s(eq=False)
+class NonBlocking:
+    """
+    Wraps an object, so that calling any of its methods goes through
+    run_blocking.  Other attributes are passed through unchanged.
+
+    Note: generators (e.g. BagsDatabase.iter_bags) are created in the thread
+    pool, but iterated in the calling greenlet.
+    """
+
+    wrapped = attr.ib()
+
+    def __getattr__(self, name):
+        value = getattr(self.wrapped, name)
+
+        if callable(value):
+
+            def call_in_thread(*args, **kwargs):
+                return run_blocking(value, *args, **kwargs)
+
+            return call_in_thread
+
+        return value
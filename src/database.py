@@ -1,13 +1,86 @@
+import collections
+import concurrent.futures
 import contextlib
 import functools
+import logging
 import os
 import pathlib
 import sqlite3
+import time
+import urllib.parse
 
 import attr
 
-from src.models import Bag, BagIdentifier
-from src.query import QueryContext, QueryResult
+from src.autocomplete import IdentifierIndex, prefix_upper_bound
+from src.metrics import DEFAULT_SIZE_BUCKETS, REGISTRY
+from src.models import BagFile, BagSummary
+from src.query import (
+    EstimatedTotals,
+    InvalidQuery,
+    QueryContext,
+    QueryResult,
+    merge_query_results,
+)
+from src.reconcile import IdDigest
+from src.sampling import estimate_total
+from src.sketch import SizeSketch
+from src.zip_layout import ZipLayout
+
+
+logger = logging.getLogger(__name__)
+
+
+# By default we keep totals for prefixes up to 4 characters long, e.g. "b123".
+# For b-numbers that's about a thousand prefixes per space.
+DEFAULT_PREFIX_BUCKET_DEPTH = 4
+
+
+# Maps the intervals supported by BagsDatabase.date_histogram to the
+# strftime() format that labels each period.
+DATE_HISTOGRAM_INTERVALS = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+
+
+# To get page N of a query across spaces, every space has to return its
+# first N pages, so we only let you page through this many results.
+MAX_RESULTS_ACROSS_SPACES = 10000
+
+
+# Bump this whenever _create_tables changes the tables of an existing
+# database, so the web app (which opens the database read-only, and can't
+# change it) can tell the database needs migrating.
+SCHEMA_VERSION = 2
+
+
+# Every other table refers to a bag by its bag_key.  It's an alias for the
+# rowid, but because we declare it as the INTEGER PRIMARY KEY, VACUUM can't
+# renumber it.
+BAGS_TABLE_COLUMNS = """(
+    bag_key INTEGER PRIMARY KEY,
+    id TEXT UNIQUE,
+    space TEXT,
+    external_identifier TEXT,
+    version INTEGER,
+    created_date TEXT,
+    file_count INTEGER,
+    total_file_size INTEGER,
+    created_timestamp INTEGER,
+    max_file_size INTEGER
+)"""
+
+
+class OutdatedDatabase(Exception):
+    """
+    Raised if we open a database read-only, but its tables need migrating
+    (or it doesn't exist yet).
+    """
+
+
+def check_date_histogram_interval(interval):
+    if interval not in DATE_HISTOGRAM_INTERVALS:
+        raise ValueError(
+            f"Unrecognised interval {interval!r}; expected one of "
+            f"{', '.join(sorted(DATE_HISTOGRAM_INTERVALS))}"
+        )
 
 
 @attr.s
@@ -15,6 +88,10 @@ class SqliteDatabase:
     """
     A thin wrapper around a sqlite database that provides a connection, cursor
     and read-only cursor.
+
+    The connection is closed when you leave the ``with`` block, however you
+    leave it -- including when a generator holding a cursor is closed part-way
+    through, e.g. because a client disconnected during an export.
     """
 
     path = attr.ib(converter=pathlib.Path)
@@ -22,9 +99,11 @@ class SqliteDatabase:
     @contextlib.contextmanager
     def conn_cursor(self):
         conn = sqlite3.connect(self.path)
-        yield conn, conn.cursor()
-        conn.commit()
-        conn.close()
+        try:
+            yield conn, conn.cursor()
+            conn.commit()
+        finally:
+            conn.close()
 
     @contextlib.contextmanager
     def cursor(self):
@@ -33,23 +112,98 @@ class SqliteDatabase:
 
     @contextlib.contextmanager
     def read_only_cursor(self):
-        conn = sqlite3.connect(f"file://{self.path.resolve()}?mode=ro", uri=True)
-        yield conn.cursor()
-        conn.commit()
-        conn.close()
+        # Quote the path, so filenames containing URI syntax (e.g. % or ?)
+        # aren't misinterpreted.
+        uri_path = urllib.parse.quote(str(self.path.resolve()))
+        conn = sqlite3.connect(f"file://{uri_path}?mode=ro", uri=True)
+        try:
+            yield conn.cursor()
+            conn.commit()
+        finally:
+            conn.close()
+
+
+@attr.s
+class SlowQuery:
+    statement = attr.ib()
+    sql = attr.ib()
+    parameters = attr.ib()
+    elapsed = attr.ib()
+    query_plan = attr.ib()
 
 
 @attr.s(eq=False)
 class BagsDatabase:
     """
     A wrapper around SqliteDatabase with operations for handling bags.
+
+    If ``slow_query_threshold`` is set (in seconds), we capture the output
+    of ``EXPLAIN QUERY PLAN`` for any statement that takes longer than that,
+    and keep the most recent ones in ``slow_queries``.
+
+    If ``read_only`` is set, we assume the tables already exist and don't
+    try to create them.
+
+    If ``index_files`` is set, we also record every file in a bag (its path,
+    size, extension and checksum) in the ``files`` table, so we can search
+    for files without downloading manifests again.
+
+    We keep running totals for every identifier prefix up to
+    ``prefix_bucket_depth`` characters long, so queries for a short prefix
+    (the most common sort) don't have to add up every matching bag.
+    Set it to None to turn this off.
     """
 
     database = attr.ib()
-    _db_last_modified = attr.ib(default=None)
+    _db_generation = attr.ib(default=None)
+    metrics = attr.ib(default=REGISTRY)
+    slow_query_threshold = attr.ib(default=None)
+    slow_queries = attr.ib(factory=lambda: collections.deque(maxlen=100))
+    read_only = attr.ib(default=False)
+    index_files = attr.ib(default=False)
+    prefix_bucket_depth = attr.ib(default=DEFAULT_PREFIX_BUCKET_DEPTH)
 
     def __attrs_post_init__(self):
-        self._create_tables()
+        if not self.read_only:
+            self._create_tables()
+
+        # Each instance gets its own caches, so clearing the cache of one
+        # database (e.g. one shard of a ShardedBagsDatabase) doesn't clear
+        # the cache of the others.
+        self._make_query = functools.lru_cache()(self._make_query)
+        self._make_date_histogram = functools.lru_cache()(self._make_date_histogram)
+        self._make_size_distribution = functools.lru_cache()(
+            self._make_size_distribution
+        )
+        self._make_query_page = functools.lru_cache()(self._make_query_page)
+        self._make_query_many = functools.lru_cache()(self._make_query_many)
+        self._make_estimate = functools.lru_cache()(self._make_estimate)
+        self._get_identifier_index = functools.lru_cache()(self._get_identifier_index)
+        self._make_zip_layout = functools.lru_cache()(self._make_zip_layout)
+        self._get_spaces = functools.lru_cache()(self._get_spaces)
+
+        self._statement_seconds = self.metrics.histogram(
+            "bag_browser_query_statement_seconds",
+            "Time spent running each SQL statement in a bags query",
+        )
+        self._cache_lookups = self.metrics.counter(
+            "bag_browser_query_cache_lookups_total",
+            "Lookups in the bags query cache, by result (hit or miss)",
+        )
+        self._rows_scanned = self.metrics.histogram(
+            "bag_browser_query_rows_scanned",
+            "Number of bag rows aggregated by a bags query",
+            buckets=DEFAULT_SIZE_BUCKETS,
+        )
+        self._result_size = self.metrics.histogram(
+            "bag_browser_query_result_bags",
+            "Number of bags returned in a page of query results",
+            buckets=DEFAULT_SIZE_BUCKETS,
+        )
+        self._slow_query_count = self.metrics.counter(
+            "bag_browser_slow_queries_total",
+            "SQL statements that took longer than the slow query threshold",
+        )
 
     @database.validator
     def _check_database(self, attribute, value):
@@ -59,57 +213,456 @@ class BagsDatabase:
     def _create_tables(self):
         with self.database.cursor() as cursor:
             try:
-                cursor.execute(
-                    """CREATE TABLE bags
-                    (
-                        id TEXT PRIMARY KEY,
-                        space TEXT,
-                        external_identifier TEXT,
-                        version INTEGER,
-                        created_date TEXT,
-                        file_count INTEGER,
-                        total_file_size INTEGER
-                    )"""
-                )
+                cursor.execute(f"CREATE TABLE bags {BAGS_TABLE_COLUMNS}")
             except sqlite3.OperationalError as err:
                 if str(err) == "table bags already exists":
                     pass
                 else:
                     raise
 
-            try:
-                cursor.execute(
-                    """CREATE TABLE file_extensions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        bag_id TEXT,
-                        extension TEXT,
-                        count INTEGER,
-                        CONSTRAINT fk_storage_key
-                            FOREIGN KEY (bag_id)
-                            REFERENCES bags(id),
-                        UNIQUE (bag_id, extension)
-                    )"""
-                )
-            except sqlite3.OperationalError as err:
-                if str(err) == "table file_extensions already exists":
-                    pass
+            # Extensions are stored once, and referred to by their id here
+            # and in the file index.
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS extensions (
+                    id INTEGER PRIMARY KEY,
+                    extension TEXT UNIQUE
+                )"""
+            )
 
-                # I can't think of a way to trigger an unexpected error here
-                # that wouldn't have thrown when creating the bags table.
-                else:  # pragma: no cover
-                    raise
+            # The file extension tally of each bag.  This is the biggest
+            # table after the file index, so like the file index, it refers
+            # to bags by their bag_key and to extensions by their id, and it's
+            # WITHOUT ROWID, so the rows for a bag are stored together and
+            # there's no separate index on (bag_key, ext_id).
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS bag_extensions (
+                    bag_key INTEGER,
+                    ext_id INTEGER,
+                    count INTEGER,
+                    PRIMARY KEY (bag_key, ext_id)
+                ) WITHOUT ROWID"""
+            )
+
+            self._migrate_created_timestamp(cursor)
+            self._migrate_max_file_size(cursor)
+            self._migrate_bag_key(cursor)
+            self._migrate_file_extensions(cursor)
+
+            # This index covers the date histogram, so we can compute it
+            # without reading the bags table.
+            cursor.execute(
+                """CREATE INDEX IF NOT EXISTS bags_by_created_timestamp
+                ON bags(space, created_timestamp, external_identifier, total_file_size)"""
+            )
+
+            # This index lets us read the bags in a space in identifier order
+            # without sorting them, which matters when we're exporting
+            # millions of rows.
+            cursor.execute(
+                """CREATE INDEX IF NOT EXISTS bags_by_identifier
+                ON bags(space, external_identifier, version)"""
+            )
+
+            self._create_file_index_tables(cursor)
+
+            # The approximate distribution of file sizes in each bag, as
+            # the non-empty buckets of a SizeSketch.  Storing the buckets
+            # as rows (rather than a blob) means we can merge the sketches
+            # for millions of bags with a GROUP BY, without leaving SQLite.
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS file_sizes (
+                    bag_key INTEGER,
+                    bucket INTEGER,
+                    count INTEGER,
+                    PRIMARY KEY (bag_key, bucket)
+                ) WITHOUT ROWID"""
+            )
+
+            # How big each bag is in a multi-bag ZIP, so we can work out the
+            # size of a ZIP of every bag in a query.  See src/zip_layout.py.
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS zip_layouts (
+                    bag_key INTEGER PRIMARY KEY,
+                    entry_count INTEGER,
+                    data_size INTEGER,
+                    directory_size INTEGER
+                )"""
+            )
+
+            self._create_prefix_bucket_tables(cursor)
+            self._create_space_digests_table(cursor)
+
+            cursor.execute(
+                """INSERT OR REPLACE INTO metadata(key, value)
+                VALUES ('schema_version', ?)""",
+                (SCHEMA_VERSION,),
+            )
+
+    def _create_file_index_tables(self, cursor):
+        # There are hundreds of millions of files, so we keep the schema
+        # compact: extensions are stored once in a lookup table, bags are
+        # referred to by their bag_key, and the checksum is stored as raw
+        # bytes rather than a hex string.
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                bag_key INTEGER,
+                path TEXT,
+                size INTEGER,
+                ext_id INTEGER,
+                checksum BLOB,
+                PRIMARY KEY (bag_key, path)
+            ) WITHOUT ROWID"""
+        )
+
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS files_by_extension ON files(ext_id, size)"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS files_by_size ON files(size)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS files_by_checksum ON files(checksum)"
+        )
+
+    def _create_prefix_bucket_tables(self, cursor):
+        # The totals and file extension tally for the bags whose identifiers
+        # start with each prefix, up to prefix_bucket_depth characters long.
+        # The empty prefix holds the totals for the whole space.
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS prefix_totals (
+                space TEXT,
+                prefix TEXT,
+                bag_count INTEGER,
+                file_count INTEGER,
+                total_file_size INTEGER,
+                PRIMARY KEY (space, prefix)
+            ) WITHOUT ROWID"""
+        )
+
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS prefix_extensions (
+                space TEXT,
+                prefix TEXT,
+                extension TEXT,
+                count INTEGER,
+                PRIMARY KEY (space, prefix, extension)
+            ) WITHOUT ROWID"""
+        )
+
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                value
+            )"""
+        )
+
+        # If the database was created before we had prefix buckets, or with
+        # a different depth, fill them in from the bags we already have.
+        if self._get_prefix_bucket_depth(cursor) != self.prefix_bucket_depth:
+            self._rebuild_prefix_buckets(cursor)
+
+    @staticmethod
+    def _get_metadata(cursor, key):
+        """
+        Returns the value stored under ``key`` in the metadata table, or
+        None if there isn't one.
+        """
+        try:
+            cursor.execute("SELECT value FROM metadata WHERE key=?", (key,))
+        except sqlite3.OperationalError as err:
+            # We open the database read-only in the web app, so it might
+            # not have been upgraded yet.
+            if str(err) == "no such table: metadata":
+                return None
+            else:  # pragma: no cover
+                raise
+
+        row = cursor.fetchone()
+        return row[0] if row is not None else None
 
     @classmethod
-    def from_path(cls, path):
-        return cls(database=SqliteDatabase(path=path))
+    def _get_prefix_bucket_depth(cls, cursor):
+        """
+        Returns the depth of the prefix buckets stored in the database, or
+        None if it doesn't have any.
+        """
+        return cls._get_metadata(cursor, "prefix_bucket_depth")
+
+    def check_schema(self):
+        """
+        Raises OutdatedDatabase if the tables in the database are out of
+        date, e.g. because it was created by an older version of the code.
+
+        A read-only database can't be migrated, so call this when you open
+        one, rather than finding out when the first query fails.
+        """
+        if not self.database.path.exists():
+            raise OutdatedDatabase(
+                f"There is no bags database at {self.database.path}; "
+                "run freshen_bag_db.py to create it"
+            )
+
+        with self.database.read_only_cursor() as cursor:
+            schema_version = self._get_metadata(cursor, "schema_version")
+
+        if schema_version != SCHEMA_VERSION:
+            raise OutdatedDatabase(
+                f"The bags database at {self.database.path} has schema version "
+                f"{schema_version}, but we need version {SCHEMA_VERSION}; "
+                "run freshen_bag_db.py to migrate it"
+            )
+
+    def _rebuild_prefix_buckets(self, cursor):
+        cursor.execute("DELETE FROM prefix_totals")
+        cursor.execute("DELETE FROM prefix_extensions")
+
+        if self.prefix_bucket_depth is None:
+            lengths = []
+        else:
+            lengths = range(self.prefix_bucket_depth + 1)
+
+        # An identifier shorter than the prefix length is already counted
+        # in the bucket for the whole identifier, so we skip it.
+        for length in lengths:
+            cursor.execute(
+                """INSERT INTO prefix_totals(space, prefix, bag_count, file_count, total_file_size)
+                SELECT space, substr(external_identifier, 1, ?), COUNT(*), SUM(file_count), SUM(total_file_size)
+                FROM bags
+                WHERE length(external_identifier) >= ?
+                GROUP BY 1, 2""",
+                (length, length),
+            )
+            cursor.execute(
+                """INSERT INTO prefix_extensions(space, prefix, extension, count)
+                SELECT bags.space, substr(bags.external_identifier, 1, ?), extensions.extension, SUM(bag_extensions.count)
+                FROM bag_extensions
+                JOIN bags ON bags.bag_key = bag_extensions.bag_key
+                JOIN extensions ON extensions.id = bag_extensions.ext_id
+                WHERE length(bags.external_identifier) >= ?
+                GROUP BY 1, 2, 3""",
+                (length, length),
+            )
+
+        cursor.execute(
+            """INSERT OR REPLACE INTO metadata(key, value)
+            VALUES ('prefix_bucket_depth', ?)""",
+            (self.prefix_bucket_depth,),
+        )
+
+    def _add_to_prefix_buckets(self, cursor, bag):
+        if self.prefix_bucket_depth is None:
+            return
+
+        prefixes = [
+            bag.external_identifier[:length]
+            for length in range(
+                min(self.prefix_bucket_depth, len(bag.external_identifier)) + 1
+            )
+        ]
+
+        cursor.executemany(
+            """INSERT INTO prefix_totals(space, prefix, bag_count, file_count, total_file_size)
+            VALUES (?,?,1,?,?)
+            ON CONFLICT (space, prefix) DO UPDATE SET
+                bag_count = bag_count + 1,
+                file_count = file_count + excluded.file_count,
+                total_file_size = total_file_size + excluded.total_file_size""",
+            [
+                (bag.space, prefix, bag.file_count, bag.total_file_size)
+                for prefix in prefixes
+            ],
+        )
+
+        cursor.executemany(
+            """INSERT INTO prefix_extensions(space, prefix, extension, count)
+            VALUES (?,?,?,?)
+            ON CONFLICT (space, prefix, extension) DO UPDATE SET
+                count = count + excluded.count""",
+            [
+                (bag.space, prefix, extension, count)
+                for prefix in prefixes
+                for extension, count in bag.file_ext_tally.items()
+            ],
+        )
+
+    def _create_space_digests_table(self, cursor):
+        # The digest of the IDs of every bag in each space, so we can check
+        # we have the same bags as the storage service.  See src/reconcile.py.
+        try:
+            cursor.execute(
+                """CREATE TABLE space_digests (
+                    space TEXT PRIMARY KEY,
+                    bag_count INTEGER,
+                    checksum INTEGER
+                )"""
+            )
+        except sqlite3.OperationalError as err:
+            if str(err) == "table space_digests already exists":
+                return
+            else:  # pragma: no cover
+                raise
+
+        # If the database was created before we kept digests, fill them in
+        # from the bags we already have.
+        digests = collections.defaultdict(IdDigest)
+
+        cursor.execute("SELECT space, id FROM bags")
+        for space, bag_id in cursor.fetchall():
+            digests[space] += IdDigest.from_id(bag_id)
+
+        cursor.executemany(
+            "INSERT INTO space_digests(space, bag_count, checksum) VALUES (?,?,?)",
+            [
+                (space, digest.count, digest.checksum)
+                for space, digest in digests.items()
+            ],
+        )
+
+    @staticmethod
+    def _add_to_space_digests(cursor, bag):
+        digest = IdDigest.from_id(bag.id)
+
+        cursor.execute(
+            """INSERT INTO space_digests(space, bag_count, checksum)
+            VALUES (?,?,?)
+            ON CONFLICT (space) DO UPDATE SET
+                bag_count = bag_count + excluded.bag_count,
+                checksum = checksum + excluded.checksum""",
+            (bag.space, digest.count, digest.checksum),
+        )
+
+    def _migrate_created_timestamp(self, cursor):
+        """
+        Databases created before we stored the created date as an integer
+        don't have the created_timestamp column, so add it and fill it in
+        from created_date.
+        """
+        cursor.execute("PRAGMA table_info(bags)")
+        columns = {row[1] for row in cursor.fetchall()}
+
+        if "created_timestamp" in columns:
+            return
+
+        cursor.execute("ALTER TABLE bags ADD COLUMN created_timestamp INTEGER")
+        cursor.execute(
+            """UPDATE bags
+            SET created_timestamp = CAST(strftime('%s', substr(created_date, 1, 19)) AS INTEGER)"""
+        )
+
+    def _migrate_max_file_size(self, cursor):
+        """
+        Databases created before we stored file size sketches don't have
+        the max_file_size column.  We leave it empty for existing bags;
+        they're counted as bags without sizes until they're re-ingested.
+        """
+        cursor.execute("PRAGMA table_info(bags)")
+        columns = {row[1] for row in cursor.fetchall()}
+
+        if "max_file_size" not in columns:
+            cursor.execute("ALTER TABLE bags ADD COLUMN max_file_size INTEGER")
+
+    def _migrate_bag_key(self, cursor):
+        """
+        Databases created before we had the bag_key column refer to bags by
+        their implicit rowid, which VACUUM may renumber.  Rebuild the bags
+        table with an explicit INTEGER PRIMARY KEY, keeping every bag's
+        rowid as its bag_key, so the other tables still point at the
+        right bags.
+
+        This drops the indexes on bags; _create_tables creates them again.
+        """
+        cursor.execute("PRAGMA table_info(bags)")
+        columns = {row[1] for row in cursor.fetchall()}
+
+        if "bag_key" in columns:
+            return
+
+        cursor.execute(f"CREATE TABLE bags_with_bag_key {BAGS_TABLE_COLUMNS}")
+        cursor.execute(
+            """INSERT INTO bags_with_bag_key(bag_key, id, space, external_identifier, version, created_date, file_count, total_file_size, created_timestamp, max_file_size)
+            SELECT rowid, id, space, external_identifier, version, created_date, file_count, total_file_size, created_timestamp, max_file_size
+            FROM bags
+            ORDER BY rowid"""
+        )
+        cursor.execute("DROP TABLE bags")
+        cursor.execute("ALTER TABLE bags_with_bag_key RENAME TO bags")
+
+    def _migrate_file_extensions(self, cursor):
+        """
+        Databases created before we had the bag_extensions table keep their
+        tallies in file_extensions, which repeats the bag ID and extension
+        on every row.  Copy them into bag_extensions and drop the old table.
+
+        This doesn't make the file any smaller -- the freed pages are reused
+        as we store new bags.
+        """
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='file_extensions'"
+        )
+        if cursor.fetchone() is None:
+            return
+
+        cursor.execute(
+            """INSERT OR IGNORE INTO extensions(extension)
+            SELECT DISTINCT extension FROM file_extensions"""
+        )
+
+        # Inserting in primary key order means we append to the table,
+        # rather than splitting pages all over it.
+        cursor.execute(
+            """INSERT INTO bag_extensions(bag_key, ext_id, count)
+            SELECT bags.bag_key, extensions.id, file_extensions.count
+            FROM file_extensions
+            JOIN bags ON bags.id = file_extensions.bag_id
+            JOIN extensions ON extensions.extension = file_extensions.extension
+            ORDER BY 1, 2"""
+        )
+
+        cursor.execute("DROP TABLE file_extensions")
+
+    @classmethod
+    def from_path(cls, path, **kwargs):
+        return cls(database=SqliteDatabase(path=path), **kwargs)
 
     def get_known_ids(self):
         with self.database.read_only_cursor() as cursor:
             cursor.execute("SELECT id FROM bags")
             return {result[0] for result in cursor.fetchall()}
 
+    def get_space_digests(self):
+        """
+        Returns the IdDigest of the bags in every space.
+        """
+        with self.database.read_only_cursor() as cursor:
+            cursor.execute("SELECT space, bag_count, checksum FROM space_digests")
+            return {
+                space: IdDigest(count=bag_count, checksum=checksum)
+                for space, bag_count, checksum in cursor.fetchall()
+            }
+
+    def get_prefix_digests(self, space, depth):
+        """
+        Returns the IdDigest of the bags in a space for every identifier
+        prefix ``depth`` characters long (or the whole identifier, if it's
+        shorter than that).
+
+        This reads every bag in the space, so we only do it for spaces
+        whose digest doesn't match the storage service.
+        """
+        digests = collections.defaultdict(IdDigest)
+
+        with self.database.read_only_cursor() as cursor:
+            cursor.execute(
+                "SELECT external_identifier, version FROM bags WHERE space=?",
+                (space,),
+            )
+
+            for external_identifier, version in cursor:
+                bag_id = f"{space}/{external_identifier}/v{version}"
+                digests[external_identifier[:depth]] += IdDigest.from_id(bag_id)
+
+        return dict(digests)
+
     @contextlib.contextmanager
-    def bulk_store_bags(self):
+    def bulk_store_bags(self, commit_every=1):
         """
         A helper for storing bags that reuses the cursor/connection.
         To use:
@@ -118,24 +671,21 @@ class BagsDatabase:
                 for bag in bags_to_store:
                     bulk_helper.store_bag(bag)
 
+        By default we commit after every bag, so an interrupted run keeps
+        everything it's stored so far.  If you're storing lots of bags in
+        one go, committing less often is much faster.
         """
+        bags_db = self
+
         with self.database.conn_cursor() as (conn, cursor):
+            extension_ids = {}
+            stored_count = 0
 
             class Helper:
                 def store_bag(self, bag):
-                    extension_counts = [
-                        (bag.id, extension, count)
-                        for extension, count in bag.file_ext_tally.items()
-                    ]
-                    cursor.executemany(
-                        """INSERT INTO file_extensions(bag_id, extension, count)
-                        VALUES (?,?,?)""",
-                        extension_counts,
-                    )
-
                     cursor.execute(
-                        """INSERT INTO bags(id, space, external_identifier, version, created_date, file_count, total_file_size)
-                        VALUES (?,?,?,?,?,?,?)""",
+                        """INSERT INTO bags(id, space, external_identifier, version, created_date, file_count, total_file_size, created_timestamp, max_file_size)
+                        VALUES (?,?,?,?,?,?,?,?,?)""",
                         (
                             bag.id,
                             bag.space,
@@ -144,156 +694,898 @@ class BagsDatabase:
                             bag.created_date,
                             bag.file_count,
                             bag.total_file_size,
+                            bag.created_timestamp,
+                            bag.size_sketch.max_size
+                            if bag.size_sketch is not None
+                            else None,
                         ),
                     )
-                    conn.commit()
+                    bag_key = cursor.lastrowid
+
+                    extension_counts = [
+                        (
+                            bag_key,
+                            bags_db._get_extension_id(cursor, extension, extension_ids),
+                            count,
+                        )
+                        for extension, count in bag.file_ext_tally.items()
+                    ]
+                    cursor.executemany(
+                        """INSERT INTO bag_extensions(bag_key, ext_id, count)
+                        VALUES (?,?,?)""",
+                        extension_counts,
+                    )
+
+                    bags_db._add_to_prefix_buckets(cursor, bag)
+                    bags_db._add_to_space_digests(cursor, bag)
+
+                    if bag.size_sketch is not None:
+                        cursor.executemany(
+                            """INSERT INTO file_sizes(bag_key, bucket, count)
+                            VALUES (?,?,?)""",
+                            [
+                                (bag_key, bucket, count)
+                                for bucket, count in bag.size_sketch.buckets.items()
+                            ],
+                        )
+
+                    if bag.zip_layout is not None:
+                        cursor.execute(
+                            """INSERT INTO zip_layouts(bag_key, entry_count, data_size, directory_size)
+                            VALUES (?,?,?,?)""",
+                            (
+                                bag_key,
+                                bag.zip_layout.entry_count,
+                                bag.zip_layout.data_size,
+                                bag.zip_layout.directory_size,
+                            ),
+                        )
+
+                    if bags_db.index_files and bag.storage_manifest is not None:
+                        bags_db._store_files(
+                            cursor,
+                            bag_key=bag_key,
+                            bag=bag,
+                            extension_ids=extension_ids,
+                        )
+
+                    nonlocal stored_count
+                    stored_count += 1
+                    if stored_count % commit_every == 0:
+                        conn.commit()
 
             yield Helper()
 
-    def query(self, query_context: QueryContext) -> QueryResult:
+    @staticmethod
+    def _get_extension_id(cursor, extension, extension_ids):
+        try:
+            return extension_ids[extension]
+        except KeyError:
+            pass
+
+        cursor.execute(
+            "INSERT OR IGNORE INTO extensions(extension) VALUES (?)", (extension,)
+        )
+        cursor.execute("SELECT id FROM extensions WHERE extension=?", (extension,))
+        extension_ids[extension] = cursor.fetchone()[0]
+        return extension_ids[extension]
+
+    def _store_files(self, cursor, bag_key, bag, extension_ids):
+        rows = []
+
+        for bag_file in bag.storage_manifest["manifest"]["files"]:
+            extension = os.path.splitext(bag_file["name"])[1].lower()
+
+            try:
+                checksum = bytes.fromhex(bag_file["checksum"])
+            except (KeyError, ValueError):
+                checksum = None
+
+            rows.append(
+                (
+                    bag_key,
+                    bag_file["name"],
+                    bag_file["size"],
+                    self._get_extension_id(cursor, extension, extension_ids),
+                    checksum,
+                )
+            )
+
+        cursor.executemany(
+            """INSERT INTO files(bag_key, path, size, ext_id, checksum)
+            VALUES (?,?,?,?,?)""",
+            rows,
+        )
+
+    def find_files(
+        self, extension=None, min_size=None, max_size=None, space=None, limit=100
+    ):
+        """
+        Find files in the file index, biggest first.  e.g. to find every TIFF
+        over 1 GB:
+
+            bags_db.find_files(extension=".tif", min_size=1024 ** 3)
+
+        """
+        conditions = []
+        parameters = []
+
+        if extension is not None:
+            conditions.append(
+                "files.ext_id = (SELECT id FROM extensions WHERE extension=?)"
+            )
+            parameters.append(extension.lower())
+
+        if min_size is not None:
+            conditions.append("files.size >= ?")
+            parameters.append(min_size)
+
+        if max_size is not None:
+            conditions.append("files.size <= ?")
+            parameters.append(max_size)
+
+        if space is not None:
+            conditions.append("bags.space = ?")
+            parameters.append(space)
+
+        if conditions:
+            where_clause = "WHERE " + " AND ".join(conditions)
+        else:
+            where_clause = ""
+
+        with self.database.read_only_cursor() as cursor:
+            rows = self._execute(
+                cursor,
+                "find_files",
+                f"""SELECT bags.id, files.path, files.size, extensions.extension, files.checksum
+                FROM files
+                JOIN bags ON bags.bag_key = files.bag_key
+                JOIN extensions ON extensions.id = files.ext_id
+                {where_clause}
+                ORDER BY files.size DESC
+                LIMIT ?""",
+                parameters + [limit],
+            )
+
+        return [BagFile.from_row(row) for row in rows]
+
+    def find_files_by_checksum(self, checksum):
+        """
+        Find every file in the file index with the given checksum
+        (as a hex string).
+        """
+        with self.database.read_only_cursor() as cursor:
+            rows = self._execute(
+                cursor,
+                "find_files_by_checksum",
+                """SELECT bags.id, files.path, files.size, extensions.extension, files.checksum
+                FROM files
+                JOIN bags ON bags.bag_key = files.bag_key
+                JOIN extensions ON extensions.id = files.ext_id
+                WHERE files.checksum = ?""",
+                (bytes.fromhex(checksum),),
+            )
+
+        return [BagFile.from_row(row) for row in rows]
+
+    def _check_for_changes(self):
         # Apply some light caching to results, to improve performance.
         # If we get the same query twice, we return a cached result.
         #
         # If the database changes under our feet, clear the cache and
-        # start caching results again.
+        # start caching results again.  We look at the inode as well as the
+        # modification time, so we notice when a snapshot is swapped into
+        # place (see src/snapshot.py).
+        stat = os.stat(self.database.path)
+        db_generation = (stat.st_ino, stat.st_mtime_ns)
+
+        if db_generation != self._db_generation:
+            self._db_generation = db_generation
+            self._make_query.cache_clear()
+            self._get_spaces.cache_clear()
+            self._make_date_histogram.cache_clear()
+            self._make_size_distribution.cache_clear()
+            self._make_query_page.cache_clear()
+            self._make_query_many.cache_clear()
+            self._make_estimate.cache_clear()
+            self._get_identifier_index.cache_clear()
+            self._make_zip_layout.cache_clear()
+
+    def query(self, query_context: QueryContext) -> QueryResult:
+        self._check_for_changes()
+
+        # The cache doesn't tell us whether a particular call was a hit,
+        # so we compare the hit count before and after.  This may
+        # occasionally misattribute a lookup if two threads query at once,
+        # but that's fine for metrics.
+        hits_before = self._make_query.cache_info().hits
+        result = self._make_query(query_context)
+
+        if self._make_query.cache_info().hits > hits_before:
+            self._cache_lookups.inc(result="hit")
+        else:
+            self._cache_lookups.inc(result="miss")
+
+        return result
+
+    def _execute(self, cursor, statement, sql, parameters):
+        """
+        Run a SQL statement and return all the rows, recording how long
+        it took.  If it was slow, capture the query plan.
+        """
+        start = time.perf_counter()
+        cursor.execute(sql, parameters)
+        rows = cursor.fetchall()
+        elapsed = time.perf_counter() - start
+
+        self._statement_seconds.observe(elapsed, statement=statement)
+
         if (
-            self._db_last_modified is None or
-            os.stat(self.database.path).st_mtime > self._db_last_modified
+            self.slow_query_threshold is not None
+            and elapsed >= self.slow_query_threshold
         ):
-            self._db_last_modified = os.stat(self.database.path).st_mtime
-            self._make_query.cache_clear()
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+            query_plan = [row[-1] for row in cursor.fetchall()]
+
+            slow_query = SlowQuery(
+                statement=statement,
+                sql=sql,
+                parameters=parameters,
+                elapsed=elapsed,
+                query_plan=query_plan,
+            )
+            self.slow_queries.append(slow_query)
+            self._slow_query_count.inc(statement=statement)
+
+            logger.warning(
+                "Slow %s statement (%.3fs): %r", statement, elapsed, query_plan
+            )
+
+        return rows
+
+    @staticmethod
+    def _where_clause(query_context):
+        """
+        Returns the WHERE clause (and its parameters) that selects the bags
+        matching a query.
+        """
+        conditions = ["space=?", "external_identifier >= ?"]
+        parameters = [query_context.space, query_context.external_identifier_prefix]
+
+        upper_bound = prefix_upper_bound(query_context.external_identifier_prefix)
+
+        if upper_bound is not None:
+            conditions.append("external_identifier < ?")
+            parameters.append(upper_bound)
+
+        if query_context.created_after_timestamp is not None:
+            conditions.append("created_timestamp >= ?")
+            parameters.append(query_context.created_after_timestamp)
 
-        return self._make_query(query_context)
+        if query_context.created_before_timestamp is not None:
+            conditions.append("created_timestamp < ?")
+            parameters.append(query_context.created_before_timestamp)
+
+        return "WHERE " + " AND ".join(conditions), parameters
 
-    @functools.lru_cache()
     def _make_query(self, query_context: QueryResult) -> QueryResult:
+        where_clause, parameters = self._where_clause(query_context)
+
         with self.database.read_only_cursor() as cursor:
-            import time
+            totals = self._get_prefix_bucket_totals(cursor, query_context)
 
-            t0_start = time.time()
-            cursor.execute(
-                """SELECT SUM(file_count), SUM(total_file_size), COUNT(*)
-                FROM bags
-                WHERE space=?
-                AND external_identifier >= ? AND external_identifier <= ? || 'z'
-                AND created_date >= ? AND created_date <= ? || 'z'""",
-                (
-                    query_context.space,
-                    query_context.external_identifier_prefix,
-                    query_context.external_identifier_prefix,
-                    query_context.created_after or "2000-01-01",
-                    query_context.created_before or "3000-01-01",
-                ),
+            if totals is not None:
+                rows_scanned = 0
+            else:
+                totals = self._sum_totals(cursor, where_clause, parameters)
+                rows_scanned = totals[0]
+
+            total_count, total_file_count, total_file_size, file_ext_tally = totals
+
+            matching_bags = self._fetch_page(
+                cursor, query_context, where_clause, parameters
             )
 
-            (total_file_count, total_file_size, total_count,) = cursor.fetchone()
+        self._rows_scanned.observe(rows_scanned)
+        self._result_size.observe(len(matching_bags))
 
-            # Ensure we return numeric values to the calling code, even
-            # if there were no results.
-            if total_count == 0:
-                total_file_count = 0
-                total_file_size = 0
+        return QueryResult(
+            total_count=total_count,
+            total_file_count=total_file_count,
+            total_file_size=total_file_size,
+            file_ext_tally=file_ext_tally,
+            bags=matching_bags,
+        )
 
-            t0_end = time.time()
+    @staticmethod
+    def _has_prefix_bucket(query_context, depth):
+        """
+        Whether the prefix buckets (of the given depth) have the totals for
+        a query.  They don't if it has a date filter, or its prefix is longer
+        than the buckets go.
+        """
+        return (
+            depth is not None
+            and len(query_context.external_identifier_prefix) <= depth
+            and query_context.created_after_timestamp is None
+            and query_context.created_before_timestamp is None
+        )
 
-            t1_start = time.time()
-            cursor.execute(
-                """SELECT extension, SUM(count)
-                FROM file_extensions
-                WHERE bag_id in (
-                    SELECT id
-                    FROM bags
-                    WHERE space=?
-                    AND external_identifier >= ? AND external_identifier <= ? || 'z'
-                    AND created_date >= ? AND created_date <= ? || 'z'
+    def _get_prefix_bucket_totals(self, cursor, query_context):
+        """
+        Returns the totals for a query from the prefix buckets, or None if
+        the query can't be answered from them (e.g. because it has a date
+        filter, or the prefix is longer than the buckets go).
+        """
+        depth = self._get_prefix_bucket_depth(cursor)
+
+        if not self._has_prefix_bucket(query_context, depth):
+            return None
+
+        prefix = query_context.external_identifier_prefix
+
+        rows = self._execute(
+            cursor,
+            "prefix_totals",
+            """SELECT bag_count, file_count, total_file_size
+            FROM prefix_totals
+            WHERE space=? AND prefix=?""",
+            [query_context.space, prefix],
+        )
+
+        # There's no bucket if there aren't any matching bags.
+        if not rows:
+            return (0, 0, 0, {})
+
+        ((total_count, total_file_count, total_file_size),) = rows
+
+        file_ext_tally = dict(
+            self._execute(
+                cursor,
+                "prefix_tally",
+                """SELECT extension, count
+                FROM prefix_extensions
+                WHERE space=? AND prefix=?""",
+                [query_context.space, prefix],
+            )
+        )
+
+        return (total_count, total_file_count, total_file_size, file_ext_tally)
+
+    def _sum_totals(self, cursor, where_clause, parameters):
+        """
+        Returns the totals for a query by adding up every matching bag.
+        """
+        ((total_file_count, total_file_size, total_count),) = self._execute(
+            cursor,
+            "count",
+            f"""SELECT SUM(file_count), SUM(total_file_size), COUNT(*)
+            FROM bags
+            {where_clause}""",
+            parameters,
+        )
+
+        # Ensure we return numeric values to the calling code, even
+        # if there were no results.
+        if total_count == 0:
+            total_file_count = 0
+            total_file_size = 0
+
+        file_ext_tally = dict(
+            self._execute(
+                cursor,
+                "tally",
+                f"""SELECT extensions.extension, tally.count
+                FROM (
+                    SELECT ext_id, SUM(count) AS count
+                    FROM bag_extensions
+                    WHERE bag_key IN (
+                        SELECT bag_key
+                        FROM bags
+                        {where_clause}
+                    )
+                    GROUP BY ext_id
+                ) AS tally
+                JOIN extensions ON extensions.id = tally.ext_id""",
+                parameters,
+            )
+        )
+
+        return (total_count, total_file_count, total_file_size, file_ext_tally)
+
+    def _fetch_page(self, cursor, query_context, where_clause, parameters):
+        # We sort by identifier and numeric version, which is the order of
+        # the bags_by_identifier index.  That means SQLite can read the
+        # first page straight from the index and stop, rather than sorting
+        # every matching bag -- so a page comes back quickly even when
+        # millions of bags match.
+        #
+        # (We used to sort by id, which is a string of the form
+        # {space}/{external_identifier}/v{version}, so the versions of
+        # a bag would come out in the order v1, v10, v11, v2, ...)
+        rows = self._execute(
+            cursor,
+            "bags",
+            f"""SELECT space, external_identifier, version, created_date, file_count, total_file_size, created_timestamp
+            FROM bags
+            {where_clause}
+            ORDER BY external_identifier, version
+            LIMIT ?,?""",
+            parameters
+            + [
+                (query_context.page - 1) * query_context.page_size,
+                query_context.page_size,
+            ],
+        )
+
+        return [BagSummary(*row) for row in rows]
+
+    def query_many(self, query_contexts):
+        """
+        Run several queries at once -- e.g. the totals for every space, for
+        a dashboard -- and return their results in the same order.
+
+        The queries share a connection, every query the prefix buckets can
+        answer is looked up in a single statement, and we only add up the
+        bags once for queries that differ only by page.  Queries with
+        ``page_size=0`` don't fetch a page of bags.
+        """
+        self._check_for_changes()
+        return list(self._make_query_many(tuple(query_contexts)))
+
+    @staticmethod
+    def _totals_key(query_context):
+        # Everything about a query that affects its totals.
+        return (
+            query_context.space,
+            query_context.external_identifier_prefix,
+            query_context.created_after_timestamp,
+            query_context.created_before_timestamp,
+        )
+
+    def _make_query_many(self, query_contexts):
+        with self.database.read_only_cursor() as cursor:
+            depth = self._get_prefix_bucket_depth(cursor)
+
+            bucket_queries = set()
+            scans = {}
+
+            for query_context in query_contexts:
+                if self._has_prefix_bucket(query_context, depth):
+                    bucket_queries.add(
+                        (query_context.space, query_context.external_identifier_prefix)
+                    )
+                else:
+                    scans[self._totals_key(query_context)] = query_context
+
+            # The totals for every query, keyed by _totals_key.  The queries
+            # the buckets can answer don't have a date filter.
+            totals = {}
+
+            bucket_totals = self._get_many_prefix_bucket_totals(
+                cursor, sorted(bucket_queries)
+            )
+            for (space, prefix), space_totals in bucket_totals.items():
+                totals[(space, prefix, None, None)] = space_totals
+
+            for key, query_context in scans.items():
+                totals[key] = self._sum_totals(
+                    cursor, *self._where_clause(query_context)
                 )
-                GROUP BY extension""",
+                self._rows_scanned.observe(totals[key][0])
+
+            results = []
+
+            for query_context in query_contexts:
                 (
-                    query_context.space,
-                    query_context.external_identifier_prefix,
-                    query_context.external_identifier_prefix,
-                    query_context.created_after or "2000-01-01",
-                    query_context.created_before or "3000-01-01",
-                ),
+                    total_count,
+                    total_file_count,
+                    total_file_size,
+                    file_ext_tally,
+                ) = totals[self._totals_key(query_context)]
+
+                if query_context.page_size == 0:
+                    matching_bags = []
+                else:
+                    matching_bags = self._fetch_page(
+                        cursor, query_context, *self._where_clause(query_context)
+                    )
+                    self._result_size.observe(len(matching_bags))
+
+                results.append(
+                    QueryResult(
+                        total_count=total_count,
+                        total_file_count=total_file_count,
+                        total_file_size=total_file_size,
+                        file_ext_tally=file_ext_tally,
+                        bags=matching_bags,
+                    )
+                )
+
+        return tuple(results)
+
+    def _get_many_prefix_bucket_totals(self, cursor, bucket_queries):
+        """
+        Returns the totals for a list of (space, prefix) from the prefix
+        buckets, looking them all up at once.
+        """
+        if not bucket_queries:
+            return {}
+
+        keys = ",".join("(?,?)" for _ in bucket_queries)
+        parameters = [
+            value for bucket_query in bucket_queries for value in bucket_query
+        ]
+
+        # There's no bucket if there aren't any matching bags.
+        totals = {bucket_query: (0, 0, 0, {}) for bucket_query in bucket_queries}
+
+        for space, prefix, *bucket_totals in self._execute(
+            cursor,
+            "prefix_totals_many",
+            f"""SELECT space, prefix, bag_count, file_count, total_file_size
+            FROM prefix_totals
+            WHERE (space, prefix) IN (VALUES {keys})""",
+            parameters,
+        ):
+            totals[(space, prefix)] = (*bucket_totals, {})
+
+        for space, prefix, extension, count in self._execute(
+            cursor,
+            "prefix_tally_many",
+            f"""SELECT space, prefix, extension, count
+            FROM prefix_extensions
+            WHERE (space, prefix) IN (VALUES {keys})""",
+            parameters,
+        ):
+            totals[(space, prefix)][3][extension] = count
+
+        return totals
+
+    def query_page(self, query_context: QueryContext):
+        """
+        Returns just the page of bags that match a query, without any of
+        the totals.  This is much faster than query() for broad queries.
+        """
+        self._check_for_changes()
+        return list(self._make_query_page(query_context))
+
+    def _make_query_page(self, query_context):
+        where_clause, parameters = self._where_clause(query_context)
+
+        with self.database.read_only_cursor() as cursor:
+            return tuple(
+                self._fetch_page(cursor, query_context, where_clause, parameters)
             )
 
-            file_ext_tally = dict(cursor.fetchall())
-            t1_end = time.time()
+    def estimate_totals(self, query_context: QueryContext, sample_size=1000):
+        """
+        Returns approximate totals for a query, estimated from a random
+        sample of about ``sample_size`` of the matching bags.
+
+        The sample is chosen by hashing each bag's bag_key, which only needs
+        the indexes -- we only read the rows and file extensions of the
+        bags we sample.  The hash is deterministic, so the same query always
+        gets the same estimate.
+        """
+        self._check_for_changes()
+        return self._make_estimate(query_context, sample_size)
 
-            t2_start = time.time()
-            cursor.execute(
-                """SELECT space, external_identifier, version, created_date, file_count, total_file_size
-                FROM bags
-                WHERE space=?
-                AND external_identifier >= ? AND external_identifier <= ? || 'z'
-                AND created_date >= ? AND created_date <= ? || 'z'
-                ORDER BY id
-                LIMIT ?,?""",
-                (
-                    query_context.space,
-                    query_context.external_identifier_prefix,
-                    query_context.external_identifier_prefix,
-                    query_context.created_after or "2000-01-01",
-                    query_context.created_before or "3000-01-01",
-                    (query_context.page - 1) * query_context.page_size,
-                    query_context.page_size,
-                ),
-            )
-
-            matching_bags = [
-                Bag(
-                    identifier=BagIdentifier(
-                        space=bag[0], external_identifier=bag[1], version=bag[2]
-                    ),
-                    created_date=bag[3],
-                    file_count=bag[4],
-                    total_file_size=bag[5],
-                    file_ext_tally={},
+    def _make_estimate(self, query_context, sample_size):
+        where_clause, parameters = self._where_clause(query_context)
+
+        with self.database.read_only_cursor() as cursor:
+            # If the prefix buckets have the exact totals, they're even
+            # quicker than an estimate.
+            totals = self._get_prefix_bucket_totals(cursor, query_context)
+
+            if totals is not None:
+                total_count, total_file_count, total_file_size, file_ext_tally = totals
+
+                return EstimatedTotals(
+                    total_count=total_count,
+                    total_file_count=total_file_count,
+                    total_file_size=total_file_size,
+                    file_ext_tally=file_ext_tally,
+                    total_file_count_error=0,
+                    total_file_size_error=0,
+                    file_ext_tally_error={ext: 0 for ext in file_ext_tally},
+                    sample_size=total_count,
                 )
-                for bag in cursor.fetchall()
-            ]
-
-            # Sort the bags a different time, this time accounting for numeric
-            # version.  SQLite orders the bags by their ID, which is a string:
-            #
-            #       {space}/{external_identifier}/{version}
-            #
-            # e.g.
-            #
-            #       digitised/b12345678/v5
-            #
-            # Because this is a string, the sort order is wrong for bags with
-            # many versions -- e.g. a bag could go v1, v10, v11, v2, ...
-            #
-            # Although sorting in SQL is generally more efficient, in this case
-            # we don't take much of a performance penalty because Python's
-            # sorting algorithm (timsort; https://en.wikipedia.org/wiki/Timsort)
-            # performs very well on data that has "runs of consecutively ordered
-            # elements" -- that is, elements that are already in the right order.
-            #
-            # That will be most of the data, so there's little for it to do.
-            #
-            matching_bags = sorted(
-                matching_bags,
-                key=lambda bag: (bag.space, bag.external_identifier, bag.version),
-            )
-
-            t2_end = time.time()
-
-        print("count: %.2f" % (t0_end - t0_start))
-        print("tally: %.2f" % (t1_end - t1_start))
-        print("bags:  %.2f" % (t2_end - t2_start))
 
-        return QueryResult(
+            # This can be answered from the indexes, without reading
+            # the bags table.
+            ((total_count,),) = self._execute(
+                cursor,
+                "estimate_count",
+                f"SELECT COUNT(*) FROM bags {where_clause}",
+                parameters,
+            )
+
+            if total_count == 0:
+                sample_fraction = 0
+            else:
+                sample_fraction = min(1, sample_size / total_count)
+
+            # A multiplicative hash of the bag_key, which spreads consecutive
+            # keys evenly over 0 <= hash < 2^32.
+            sample_query = f"""SELECT bag_key
+                FROM bags
+                {where_clause} AND (bag_key * 2654435761) % 4294967296 < ?"""
+            sample_parameters = parameters + [int(sample_fraction * 2 ** 32)]
+
+            sampled_bags = self._execute(
+                cursor,
+                "estimate_sample",
+                f"""SELECT bag_key, file_count, total_file_size
+                FROM bags
+                WHERE bag_key IN ({sample_query})""",
+                sample_parameters,
+            )
+
+            extension_rows = self._execute(
+                cursor,
+                "estimate_tally",
+                f"""SELECT bag_extensions.bag_key, extensions.extension, bag_extensions.count
+                FROM bag_extensions
+                JOIN extensions ON extensions.id = bag_extensions.ext_id
+                WHERE bag_extensions.bag_key IN ({sample_query})""",
+                sample_parameters,
+            )
+
+        total_file_count, total_file_count_error = estimate_total(
+            [file_count for _, file_count, _ in sampled_bags], total_count
+        )
+        total_file_size, total_file_size_error = estimate_total(
+            [file_size for _, _, file_size in sampled_bags], total_count
+        )
+
+        extension_counts = collections.defaultdict(dict)
+        for bag_key, extension, count in extension_rows:
+            extension_counts[extension][bag_key] = count
+
+        file_ext_tally = {}
+        file_ext_tally_error = {}
+        for extension, counts in extension_counts.items():
+            (
+                file_ext_tally[extension],
+                file_ext_tally_error[extension],
+            ) = estimate_total(
+                [counts.get(bag_key, 0) for bag_key, _, _ in sampled_bags],
+                total_count,
+            )
+
+        return EstimatedTotals(
             total_count=total_count,
             total_file_count=total_file_count,
             total_file_size=total_file_size,
             file_ext_tally=file_ext_tally,
-            bags=matching_bags,
+            total_file_count_error=total_file_count_error,
+            total_file_size_error=total_file_size_error,
+            file_ext_tally_error=file_ext_tally_error,
+            sample_size=len(sampled_bags),
         )
 
+    def iter_bags(self, query_context: QueryContext, chunk_size=1000):
+        """
+        Generates every bag that matches a query, sorted by identifier and
+        version.  The page/page_size of the query are ignored.
+
+        We read from the database in chunks of ``chunk_size`` rows, so memory
+        use stays constant however many bags match.  The database stays open
+        until the generator is exhausted or closed (e.g. when a client
+        disconnects part-way through an export).
+        """
+        where_clause, parameters = self._where_clause(query_context)
+
+        with self.database.read_only_cursor() as cursor:
+            cursor.execute(
+                f"""SELECT space, external_identifier, version, created_date, file_count, total_file_size, created_timestamp
+                FROM bags
+                {where_clause}
+                ORDER BY external_identifier, version""",
+                parameters,
+            )
+
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield BagSummary(*row)
+
+    def date_histogram(self, query_context: QueryContext, interval="day"):
+        """
+        Returns the number of bags and bytes created in each day or month,
+        for all the bags that match a query.
+
+        Periods with no bags are omitted.  The page/page_size of the query
+        are ignored.
+        """
+        check_date_histogram_interval(interval)
+
+        self._check_for_changes()
+        return [dict(row) for row in self._make_date_histogram(query_context, interval)]
+
+    def _make_date_histogram(self, query_context, interval):
+        where_clause, parameters = self._where_clause(query_context)
+
+        with self.database.read_only_cursor() as cursor:
+            rows = self._execute(
+                cursor,
+                "date_histogram",
+                f"""SELECT
+                    strftime('{DATE_HISTOGRAM_INTERVALS[interval]}', created_timestamp, 'unixepoch') AS period,
+                    COUNT(*),
+                    SUM(total_file_size)
+                FROM bags
+                {where_clause}
+                GROUP BY period
+                ORDER BY period""",
+                parameters,
+            )
+
+        return tuple(
+            {"period": period, "bag_count": bag_count, "total_file_size": total_size}
+            for period, bag_count, total_size in rows
+        )
+
+    def size_distribution(self, query_context: QueryContext):
+        """
+        Returns the approximate distribution of file sizes (the median, p90
+        and p99, and the exact size of the biggest file) across all the
+        bags that match a query.
+
+        Bags stored before we recorded file sizes are left out, and counted
+        in ``bags_without_sizes``.  The page/page_size of the query are ignored.
+        """
+        self._check_for_changes()
+        return dict(self._make_size_distribution(query_context))
+
+    def _make_size_distribution(self, query_context):
+        where_clause, parameters = self._where_clause(query_context)
+
+        with self.database.read_only_cursor() as cursor:
+            ((max_size, bags_without_sizes),) = self._execute(
+                cursor,
+                "size_max",
+                f"""SELECT MAX(max_file_size), COUNT(*) - COUNT(max_file_size)
+                FROM bags
+                {where_clause}""",
+                parameters,
+            )
+
+            buckets = self._execute(
+                cursor,
+                "size_buckets",
+                f"""SELECT bucket, SUM(count)
+                FROM file_sizes
+                WHERE bag_key IN (
+                    SELECT bag_key
+                    FROM bags
+                    {where_clause}
+                )
+                GROUP BY bucket""",
+                parameters,
+            )
+
+        sketch = SizeSketch(buckets=dict(buckets), max_size=max_size)
+
+        return {**sketch.summary(), "bags_without_sizes": bags_without_sizes}
+
+    def zip_layout(self, query_context: QueryContext):
+        """
+        Returns the combined ZipLayout of all the bags that match a query,
+        or None if we don't know the layout of some of them (because they
+        were stored before we recorded layouts).  The page/page_size of the
+        query are ignored.
+        """
+        self._check_for_changes()
+        return self._make_zip_layout(query_context)
+
+    def _make_zip_layout(self, query_context):
+        where_clause, parameters = self._where_clause(query_context)
+
+        with self.database.read_only_cursor() as cursor:
+            (row,) = self._execute(
+                cursor,
+                "zip_layout",
+                f"""SELECT COUNT(*), COUNT(zip_layouts.bag_key), SUM(entry_count), SUM(data_size), SUM(directory_size)
+                FROM bags
+                LEFT JOIN zip_layouts ON zip_layouts.bag_key = bags.bag_key
+                {where_clause}""",
+                parameters,
+            )
+
+        bag_count, layout_count, entry_count, data_size, directory_size = row
+
+        if layout_count < bag_count:
+            return None
+
+        return ZipLayout(
+            entry_count=entry_count or 0,
+            data_size=data_size or 0,
+            directory_size=directory_size or 0,
+        )
+
+    def autocomplete(self, space, prefix, limit=10):
+        """
+        Suggest external identifiers in a space that start with ``prefix``.
+        See IdentifierIndex.complete.
+
+        The first call for each space loads every identifier in that space
+        into memory (about 100MB for a million identifiers), and they're
+        reloaded whenever the database changes.
+        """
+        self._check_for_changes()
+        return self._get_identifier_index(space).complete(prefix, limit=limit)
+
+    def _get_identifier_index(self, space):
+        with self.database.read_only_cursor() as cursor:
+            rows = self._execute(
+                cursor,
+                "identifier_index",
+                """SELECT DISTINCT external_identifier
+                FROM bags
+                WHERE space=?""",
+                [space],
+            )
+
+        return IdentifierIndex(identifiers=[row[0] for row in rows])
+
     def get_spaces(self):
+        self._check_for_changes()
+
+        # Return a copy, so callers can't modify the cached value.
+        return dict(self._get_spaces())
+
+    def _get_spaces(self):
         with self.database.read_only_cursor() as cursor:
             cursor.execute("SELECT space, COUNT(space) FROM bags GROUP BY space")
 
             return dict(cursor.fetchall())
+
+
+def query_across_spaces(bags_db, query_context, spaces=None, max_workers=8):
+    """
+    Run the same query against several spaces in parallel, and merge the
+    results.  The ``space`` of ``query_context`` is ignored; if ``spaces``
+    is None, we query every space.
+
+    This works with a BagsDatabase or a ShardedBagsDatabase.  SQLite
+    releases the GIL while it runs a query, so the queries really do run
+    in parallel, which is a big win when each space is a separate shard.
+    """
+    if query_context.page * query_context.page_size > MAX_RESULTS_ACROSS_SPACES:
+        raise InvalidQuery(
+            f"Can only page through the first {MAX_RESULTS_ACROSS_SPACES} results "
+            "of a query across spaces; try a longer prefix, or fewer spaces"
+        )
+
+    if spaces is None:
+        spaces = sorted(bags_db.get_spaces())
+
+    # To get page N of the merged results, we need the first N pages from
+    # every space -- any of them might sort into the merged page.
+    per_space_contexts = [
+        attr.evolve(
+            query_context,
+            space=space,
+            page=1,
+            page_size=query_context.page * query_context.page_size,
+        )
+        for space in spaces
+    ]
+
+    # We create a pool for each query rather than keeping one around, so
+    # it's safe to use this in a process that will be forked (e.g. when
+    # gunicorn preloads the app); thread pools don't survive a fork.
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(spaces)))
+    ) as executor:
+        results = list(executor.map(bags_db.query, per_space_contexts))
+
+    return merge_query_results(
+        results, page=query_context.page, page_size=query_context.page_size
+    )
@@ -0,0 +1,114 @@
+import collections
+import concurrent.futures
+import os
+
+from zipstreamer import ZipFile, ZipStream
+
+from src.zip_layout import bag_directory
+
+
+def _create_fp(s3, bucket, key):
+    def inner():
+        return s3.get_object(Bucket=bucket, Key=key)["Body"]
+
+    return inner
+
+
+def _s3_location(bag, bag_file):
+    location = bag.storage_manifest["location"]
+    bucket = location["prefix"]["namespace"]
+    key = os.path.join(location["prefix"]["path"], bag_file["path"])
+
+    return bucket, key
+
+
+def create_zip_stream(bag, s3):
+    """
+    Create a ZipStream that downloads every file in a bag from S3.
+
+    Nothing is downloaded until the stream is generated, and each file is
+    only fetched when the stream reaches it.
+    """
+    files = [
+        ZipFile(
+            filename=bag_file["name"],
+            size=bag_file["size"],
+            create_fp=_create_fp(s3, *_s3_location(bag, bag_file)),
+            datetime=None,
+            comment=None,
+        )
+        for bag_file in bag.files()
+    ]
+
+    return ZipStream(files=files)
+
+
+def _map_ahead(executor, fn, iterable, lookahead):
+    """
+    Like ``executor.map(fn, iterable)``, but it only runs ``lookahead`` calls
+    ahead of whatever is reading the results, rather than submitting every
+    call up front.  Results come back in order.
+    """
+    pending = collections.deque()
+
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+
+        if len(pending) > lookahead:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def create_multi_bag_zip_stream(bags, get_bag, s3, prefetch=4):
+    """
+    Create a ZipStream with every file in ``bags``, with each bag in its own
+    ``space/external_identifier/vN/`` directory.
+
+    ``bags`` can be a generator (e.g. from BagsDatabase.iter_bags), and we
+    only look up the storage manifest for each bag (with ``get_bag``) when
+    the stream is ``prefetch`` bags away from it.  That keeps memory
+    bounded however many bags there are, and the next few manifests are
+    already fetched by the time we need them.
+
+    Similarly, we start fetching each file from S3 while the previous file
+    is still streaming, so we don't wait for a round-trip between files.
+    That matters when a bag has thousands of small files.
+
+    Note: calling size() on this stream would use up ``bags``.  To get the
+    size up front, use BagsDatabase.zip_layout instead.
+    """
+
+    def _files_to_fetch():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=prefetch) as executor:
+            for bag in _map_ahead(
+                executor,
+                lambda b: get_bag(b.identifier),
+                bags,
+                lookahead=prefetch,
+            ):
+                directory = bag_directory(bag.identifier)
+
+                for bag_file in bag.files():
+                    filename = directory + bag_file["name"]
+                    yield filename, bag_file["size"], _s3_location(bag, bag_file)
+
+    def _open(file_to_fetch):
+        filename, size, (bucket, key) = file_to_fetch
+        return filename, size, s3.get_object(Bucket=bucket, Key=key)["Body"]
+
+    def _zip_files():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            for filename, size, body in _map_ahead(
+                executor, _open, _files_to_fetch(), lookahead=1
+            ):
+                yield ZipFile(
+                    filename=filename,
+                    size=size,
+                    create_fp=lambda body=body: body,
+                    datetime=None,
+                    comment=None,
+                )
+
+    return ZipStream(files=_zip_files())
@@ -0,0 +1,69 @@
+"""
+Serialise a stream of bags as CSV or newline-delimited JSON.
+
+Both functions take an iterable of bags (e.g. from BagsDatabase.iter_bags)
+and generate strings, so they can be passed straight to a streaming HTTP
+response without holding the whole export in memory.
+"""
+
+import csv
+import io
+import json
+
+
+EXPORT_FIELDS = [
+    "space",
+    "external_identifier",
+    "version",
+    "created_date",
+    "file_count",
+    "total_file_size",
+]
+
+
+def _export_row(bag):
+    return [
+        bag.space,
+        bag.external_identifier,
+        bag.version,
+        bag.created_date,
+        bag.file_count,
+        bag.total_file_size,
+    ]
+
+
+def export_csv(bags, rows_per_chunk=1000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(EXPORT_FIELDS)
+
+    for i, bag in enumerate(bags, start=1):
+        writer.writerow(_export_row(bag))
+
+        if i % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def export_ndjson(bags, rows_per_chunk=1000):
+    lines = []
+
+    for bag in bags:
+        lines.append(json.dumps(dict(zip(EXPORT_FIELDS, _export_row(bag)))) + "\n")
+
+        if len(lines) == rows_per_chunk:
+            yield "".join(lines)
+            lines = []
+
+    if lines:
+        yield "".join(lines)
+
+
+EXPORT_FORMATS = {
+    "csv": (export_csv, "text/csv"),
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+}
@@ -0,0 +1,100 @@
+"""
+A local copy of the raw storage manifests we've fetched from S3.
+
+Fetching manifests from S3 is by far the slowest part of building the
+bags database, and it needs AWS credentials.  If we keep a copy of every
+manifest, we can rebuild the database from scratch (e.g. after adding a
+new derived column) without talking to AWS at all.
+"""
+
+import functools
+import gzip
+import json
+import multiprocessing
+import pathlib
+import urllib.parse
+
+import attr
+
+from src.models import Bag
+
+
+@attr.s
+class ManifestCache:
+    """
+    Stores each manifest as a gzip-compressed JSON file, e.g.
+
+        manifests/
+          digitised/
+            b1234/
+              v1.json.gz
+              v2.json.gz
+
+    Path components are URL-quoted, because external identifiers can
+    contain slashes.
+    """
+
+    root = attr.ib(converter=pathlib.Path)
+
+    def path_for(self, bag_identifier):
+        return (
+            self.root
+            / urllib.parse.quote(bag_identifier.space, safe="")
+            / urllib.parse.quote(bag_identifier.external_identifier, safe="")
+            / f"v{bag_identifier.version}.json.gz"
+        )
+
+    def save(self, bag):
+        """
+        Save the storage manifest for a bag.  We write to a temporary file
+        and rename it, so an interrupted write never leaves a corrupt file.
+        """
+        path = self.path_for(bag.identifier)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf8") as outfile:
+            json.dump(bag.storage_manifest, outfile)
+
+        tmp_path.replace(path)
+
+    def __contains__(self, bag_identifier):
+        return self.path_for(bag_identifier).exists()
+
+    def paths(self):
+        return sorted(self.root.glob("*/*/v*.json.gz"))
+
+
+def load_bag(path, keep_manifest=False):
+    """
+    Read a cached manifest and turn it into a Bag.
+
+    Unless ``keep_manifest`` is set, we drop the storage manifest from
+    the Bag, so it's cheap to send back from a worker process.
+    """
+    with gzip.open(path, "rt", encoding="utf8") as infile:
+        bag = Bag.from_storage_manifest(json.load(infile))
+
+    if not keep_manifest:
+        bag = attr.evolve(bag, storage_manifest=None)
+
+    return bag
+
+
+def rebuild_database(manifest_cache, bags_database, processes=None, commit_every=1000):
+    """
+    Store a bag for every manifest in the cache in ``bags_database``,
+    which should be empty.
+
+    Parsing manifests is CPU-bound, so it's spread across a pool of
+    ``processes`` worker processes; all the writes happen in this process.
+    Yields the id of each bag as it's stored, so callers can show progress.
+    """
+    # We only need the whole manifest if we're recording every file.
+    load = functools.partial(load_bag, keep_manifest=bags_database.index_files)
+
+    with multiprocessing.Pool(processes=processes) as pool:
+        with bags_database.bulk_store_bags(commit_every=commit_every) as bulk_helper:
+            for bag in pool.imap_unordered(load, manifest_cache.paths(), chunksize=16):
+                bulk_helper.store_bag(bag)
+                yield bag.id
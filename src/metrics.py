@@ -0,0 +1,186 @@
+"""
+A small, dependency-free metrics registry.
+
+We record counters and histograms in memory, and render them in the
+Prometheus text exposition format so they can be scraped from /metrics.
+See https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+
+import attr
+
+
+# Latency buckets in seconds.  Most of our queries take a few milliseconds,
+# but a broad query on a big space can take several seconds.
+DEFAULT_LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Buckets for things we count, e.g. rows scanned or bags returned.
+DEFAULT_SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+@attr.s(eq=False)
+class Counter:
+    name = attr.ib()
+    help = attr.ib()
+    _values = attr.ib(factory=dict)
+    _lock = attr.ib(factory=threading.Lock)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+                )
+
+        return lines
+
+
+@attr.s(eq=False)
+class Histogram:
+    name = attr.ib()
+    help = attr.ib()
+    buckets = attr.ib(default=DEFAULT_LATENCY_BUCKETS, converter=tuple)
+
+    # For each label set, we store a list of per-bucket counts (the last
+    # entry is the +Inf bucket), the sum of observations and the count.
+    _values = attr.ib(factory=dict)
+    _lock = attr.ib(factory=threading.Lock)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        idx = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            try:
+                bucket_counts, total, count = self._values[key]
+            except KeyError:
+                bucket_counts, total, count = [0] * (len(self.buckets) + 1), 0, 0
+
+            bucket_counts[idx] += 1
+            self._values[key] = (bucket_counts, total + value, count + 1)
+
+    def count(self, **labels):
+        try:
+            return self._values[tuple(sorted(labels.items()))][2]
+        except KeyError:
+            return 0
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        with self._lock:
+            for labels, (bucket_counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for upper_bound, bucket_count in zip(
+                    self.buckets + (float("inf"),), bucket_counts
+                ):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (("le", _format_value(upper_bound)),)
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                    )
+
+                lines.append(
+                    f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+                )
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+
+        return lines
+
+
+@attr.s(eq=False)
+class MetricsRegistry:
+    """
+    Holds a collection of named metrics.
+
+    Asking for the same metric twice returns the same object, so different
+    bits of code can share a metric without passing it around.
+    """
+
+    _metrics = attr.ib(factory=dict)
+    _lock = attr.ib(factory=threading.Lock)
+
+    def _get_or_create(self, cls, name, **kwargs):
+        with self._lock:
+            try:
+                metric = self._metrics[name]
+            except KeyError:
+                metric = self._metrics[name] = cls(name=name, **kwargs)
+
+        if not isinstance(metric, cls):
+            raise TypeError(f"Metric {name!r} is already registered as {metric!r}")
+
+        return metric
+
+    def counter(self, name, help):
+        return self._get_or_create(Counter, name, help=help)
+
+    def histogram(self, name, help, buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get_or_create(Histogram, name, help=help, buckets=buckets)
+
+    def render(self):
+        lines = []
+        for _, metric in sorted(self._metrics.items()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# The registry used by the app unless a component is given its own.
+REGISTRY = MetricsRegistry()
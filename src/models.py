@@ -1,8 +1,25 @@
+import calendar
 import collections
+import datetime
 import os
 
 import attr
 
+from src.sketch import SizeSketch
+from src.zip_layout import ZipLayout, bag_directory
+
+
+def to_timestamp(date_string):
+    """
+    Convert a date from a storage manifest, e.g. ``2019-09-14T10:12:02.233393Z``,
+    into an integer Unix timestamp.
+
+    We drop the fractional seconds -- we never need them, and it means we
+    can handle dates that don't have them.
+    """
+    date_obj = datetime.datetime.strptime(date_string[:19], "%Y-%m-%dT%H:%M:%S")
+    return calendar.timegm(date_obj.timetuple())
+
 
 def _normalise_file_tally(tally):
     if all(ext.islower() for ext in tally):
@@ -43,6 +60,23 @@ class Bag:
     file_ext_tally = attr.ib(converter=_normalise_file_tally)
     storage_manifest = attr.ib(default=None)
 
+    # This is derived from created_date, but we store it separately so we
+    # don't have to parse the date string every time we read a bag from
+    # the database.
+    created_timestamp = attr.ib()
+
+    @created_timestamp.default
+    def _created_timestamp_default(self):
+        return to_timestamp(self.created_date)
+
+    # An approximate distribution of the file sizes in the bag, if we know
+    # them.  See src/sketch.py.
+    size_sketch = attr.ib(default=None)
+
+    # The sizes that decide how big this bag is in a multi-bag ZIP, if we
+    # know them.  See src/zip_layout.py.
+    zip_layout = attr.ib(default=None)
+
     @property
     def space(self):
         return self.identifier.space
@@ -74,17 +108,29 @@ class Bag:
             collections.Counter(os.path.splitext(f["name"])[1] for f in files)
         )
 
+        identifier = BagIdentifier(
+            space=storage_manifest["space"],
+            external_identifier=storage_manifest["info"]["externalIdentifier"],
+            version=storage_manifest["version"],
+        )
+
+        # Note: the ZIP includes the tag files (bagit.txt and so on), which
+        # aren't counted in the other totals.
+        directory = bag_directory(identifier)
+        zip_layout = ZipLayout.from_files(
+            (directory + f["name"], f["size"])
+            for f in files + storage_manifest["tagManifest"]["files"]
+        )
+
         return cls(
-            identifier=BagIdentifier(
-                space=storage_manifest["space"],
-                external_identifier=storage_manifest["info"]["externalIdentifier"],
-                version=storage_manifest["version"],
-            ),
+            identifier=identifier,
             created_date=storage_manifest["createdDate"],
             file_count=len(files),
             total_file_size=sum(f["size"] for f in files),
             file_ext_tally=file_ext_tally,
             storage_manifest=storage_manifest,
+            size_sketch=SizeSketch.from_sizes(f["size"] for f in files),
+            zip_layout=zip_layout,
         )
 
     def files(self):
@@ -92,3 +138,83 @@ class Bag:
             self.storage_manifest["manifest"]["files"]
             + self.storage_manifest["tagManifest"]["files"]
         )
+
+
+@attr.s(slots=True)
+class BagSummary:
+    """
+    The information about a bag that we show in a list of results, as read
+    from a row of the bags table (in the same order as the columns).
+
+    We create one of these for every row in a page of results or an export,
+    which can be millions of rows, so it's a flat slotted class rather than
+    a Bag: no nested BagIdentifier, and no converters to run.  It has the
+    same attributes as a Bag for the fields it holds.
+    """
+
+    space = attr.ib()
+    external_identifier = attr.ib()
+    version = attr.ib()
+    created_date = attr.ib()
+    file_count = attr.ib()
+    total_file_size = attr.ib()
+    created_timestamp = attr.ib()
+
+    @property
+    def display_version(self):
+        return f"v{self.version}"
+
+    @property
+    def id(self):
+        return f"{self.space}/{self.external_identifier}/v{self.version}"
+
+    @property
+    def identifier(self):
+        return BagIdentifier(
+            space=self.space,
+            external_identifier=self.external_identifier,
+            version=self.version,
+        )
+
+    def to_dict(self):
+        """
+        Returns the bag as a dict for the JSON API.  The identifier is nested,
+        to match the Bag model.
+        """
+        return {
+            "identifier": {
+                "space": self.space,
+                "external_identifier": self.external_identifier,
+                "version": self.version,
+            },
+            "id": self.id,
+            "created_date": self.created_date,
+            "created_timestamp": self.created_timestamp,
+            "file_count": self.file_count,
+            "total_file_size": self.total_file_size,
+        }
+
+
+@attr.s
+class BagFile:
+    """
+    A single file in a bag, as recorded in the file index.
+    """
+
+    bag_id = attr.ib()
+    path = attr.ib()
+    size = attr.ib()
+    extension = attr.ib()
+    checksum = attr.ib()
+
+    @classmethod
+    def from_row(cls, row):
+        bag_id, path, size, extension, checksum = row
+
+        return cls(
+            bag_id=bag_id,
+            path=path,
+            size=size,
+            extension=extension,
+            checksum=checksum.hex() if checksum is not None else None,
+        )
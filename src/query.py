@@ -1,6 +1,21 @@
+import calendar
+import datetime
+
 import attr
 
 
+def _date_to_timestamp(date_string):
+    date_obj = datetime.datetime.strptime(date_string, "%Y-%m-%d")
+    return calendar.timegm(date_obj.timetuple())
+
+
+class InvalidQuery(ValueError):
+    """
+    Raised if a query doesn't make sense -- e.g. it has a date we can't
+    parse -- so the app can tell the user, rather than failing with a 500.
+    """
+
+
 @attr.s(frozen=True)
 class QueryContext:
     """
@@ -18,15 +33,52 @@ class QueryContext:
     page_size = attr.ib(default=250)
 
     def __attrs_post_init__(self):
+        # Check the dates now, rather than when we first need a timestamp,
+        # which may be half-way through running the query.
+        for name in ("created_after", "created_before"):
+            date_string = getattr(self, name)
+
+            if date_string:
+                try:
+                    _date_to_timestamp(date_string)
+                except (TypeError, ValueError):
+                    raise InvalidQuery(
+                        f"{name} should be a date like 2001-02-03, not {date_string!r}"
+                    ) from None
+
+        if self.page < 1:
+            raise InvalidQuery(f"page should be 1 or more, not {self.page!r}")
+
         if (
             self.created_before
             and self.created_after
             and self.created_after > self.created_before
         ):
-            raise ValueError(
+            raise InvalidQuery(
                 f"created_before {self.created_before!r} is after created_after {self.created_after!r}!"
             )
 
+    @property
+    def created_after_timestamp(self):
+        """
+        The earliest timestamp that matches this query, or None if there
+        is no lower bound.
+        """
+        if self.created_after:
+            return _date_to_timestamp(self.created_after)
+
+    @property
+    def created_before_timestamp(self):
+        """
+        The first timestamp *after* the range matched by this query, or None
+        if there is no upper bound.
+
+        The created_before date is inclusive, so this is the start of the
+        following day.
+        """
+        if self.created_before:
+            return _date_to_timestamp(self.created_before) + 24 * 60 * 60
+
 
 @attr.s
 class QueryResult:
@@ -35,3 +87,54 @@ class QueryResult:
     total_file_size = attr.ib()
     file_ext_tally = attr.ib()
     bags = attr.ib()
+
+
+@attr.s
+class EstimatedTotals:
+    """
+    Approximate totals for a query, estimated from a random sample of the
+    matching bags.  The count of bags is always exact.
+
+    Each ``*_error`` is the half-width of a 95% confidence interval on the
+    corresponding estimate, or None if the sample was too small to tell.
+    """
+
+    total_count = attr.ib()
+    total_file_count = attr.ib()
+    total_file_size = attr.ib()
+    file_ext_tally = attr.ib()
+    total_file_count_error = attr.ib()
+    total_file_size_error = attr.ib()
+    file_ext_tally_error = attr.ib()
+    sample_size = attr.ib()
+
+    @property
+    def is_exact(self):
+        return self.sample_size == self.total_count
+
+
+def merge_query_results(results, page, page_size):
+    """
+    Combine the results of querying several spaces into a single result,
+    returning the given page of the combined bags.
+
+    Each result should contain the first ``page * page_size`` bags from
+    its space.
+    """
+    file_ext_tally = {}
+    for result in results:
+        for extension, count in result.file_ext_tally.items():
+            file_ext_tally[extension] = file_ext_tally.get(extension, 0) + count
+
+    all_bags = sorted(
+        (bag for result in results for bag in result.bags),
+        key=lambda bag: (bag.space, bag.external_identifier, bag.version),
+    )
+
+    return QueryResult(
+        total_count=sum(result.total_count for result in results),
+        total_file_count=sum(result.total_file_count for result in results),
+        total_file_size=sum(result.total_file_size for result in results),
+        file_ext_tally=file_ext_tally,
+        bags=all_bags[(page - 1) * page_size : page * page_size],
+    )
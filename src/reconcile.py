@@ -0,0 +1,168 @@
+"""
+Check that the bags database has the same bags as the storage service,
+without fetching every bag ID from both and comparing them.
+
+For each group of bags, we keep a digest: the number of bags, and the sum
+of a hash of each bag's ID.  The sum doesn't depend on the order we see
+the bags in, and digests can be added together, so the digest of a space
+is the sum of the digests of its prefixes.
+
+The bags database keeps a digest for every space, updated as bags are
+stored.  To check it, we scan DynamoDB (in parallel, reading only the
+IDs) and compute the digest of every prefix up to ``depth`` characters.
+Then we compare the spaces, and only for spaces that disagree do we
+compute prefix digests from SQLite and narrow down the prefixes that
+disagree.
+"""
+
+import collections
+import hashlib
+import itertools
+
+import attr
+
+
+# We check prefixes up to 4 characters long, e.g. "b123".  For b-numbers
+# that's about a thousand prefixes per space.
+DEFAULT_DIGEST_DEPTH = 4
+
+
+def id_hash(bag_id):
+    """
+    A 32-bit hash of a bag ID, e.g. "digitised/b1234/v1".
+
+    We sum these in SQLite, which stores 64-bit signed integers, so a 32-bit
+    hash means we can add up two billion of them before we overflow.
+    """
+    return int.from_bytes(
+        hashlib.blake2b(bag_id.encode("utf8"), digest_size=4).digest(), "big"
+    )
+
+
+@attr.s(frozen=True)
+class IdDigest:
+    count = attr.ib(default=0)
+    checksum = attr.ib(default=0)
+
+    @classmethod
+    def from_id(cls, bag_id):
+        return cls(count=1, checksum=id_hash(bag_id))
+
+    def __add__(self, other):
+        return IdDigest(
+            count=self.count + other.count, checksum=self.checksum + other.checksum
+        )
+
+
+def prefix_digests(bag_identifiers, depth=DEFAULT_DIGEST_DEPTH):
+    """
+    Given a collection of BagIdentifiers, return the digest for every
+    (space, prefix) up to ``depth`` characters long.
+    """
+    digests = collections.defaultdict(IdDigest)
+
+    for bag_identifier in bag_identifiers:
+        prefix = bag_identifier.external_identifier[:depth]
+        digests[(bag_identifier.space, prefix)] += IdDigest.from_id(bag_identifier.id)
+
+    return dict(digests)
+
+
+@attr.s(frozen=True)
+class Disagreement:
+    """
+    The bags whose identifiers start with ``prefix`` are different in the
+    storage service and the bags database.
+    """
+
+    space = attr.ib()
+    prefix = attr.ib()
+    storage_service = attr.ib()
+    bags_database = attr.ib()
+
+
+def _total(digests):
+    return sum(digests.values(), IdDigest())
+
+
+def _drill_down(space, prefix, storage_digests, database_digests):
+    storage_total = _total(storage_digests)
+    database_total = _total(database_digests)
+
+    if storage_total == database_total:
+        return []
+
+    children = {
+        key[: len(prefix) + 1]
+        for key in itertools.chain(storage_digests, database_digests)
+        if len(key) > len(prefix)
+    }
+
+    # We stop narrowing it down if:
+    #
+    #   - one side has no bags with this prefix (e.g. a whole space is
+    #     missing), because every prefix underneath will disagree too
+    #   - there's a bag whose identifier is exactly the prefix, and it's
+    #     one of the bags that disagrees
+    #
+    if (
+        not children
+        or storage_total.count == 0
+        or database_total.count == 0
+        or storage_digests.get(prefix) != database_digests.get(prefix)
+    ):
+        return [
+            Disagreement(
+                space=space,
+                prefix=prefix,
+                storage_service=storage_total,
+                bags_database=database_total,
+            )
+        ]
+
+    disagreements = []
+
+    for child in sorted(children):
+        disagreements.extend(
+            _drill_down(
+                space,
+                child,
+                {k: v for k, v in storage_digests.items() if k.startswith(child)},
+                {k: v for k, v in database_digests.items() if k.startswith(child)},
+            )
+        )
+
+    return disagreements
+
+
+def find_disagreements(bags_database, storage_digests, depth=DEFAULT_DIGEST_DEPTH):
+    """
+    Compare the bags database to the storage service, and return the
+    narrowest prefixes (within each space) that disagree.
+
+    ``storage_digests`` is the digest of every (space, prefix), as returned
+    by StorageService.get_prefix_digests with the same ``depth``.
+    """
+    storage_spaces = collections.defaultdict(dict)
+
+    for (space, prefix), digest in storage_digests.items():
+        storage_spaces[space][prefix] = digest
+
+    database_spaces = bags_database.get_space_digests()
+
+    disagreements = []
+
+    for space in sorted(set(storage_spaces) | set(database_spaces)):
+        if _total(storage_spaces[space]) == database_spaces.get(space, IdDigest()):
+            continue
+
+        disagreements.extend(
+            _drill_down(
+                space,
+                "",
+                storage_spaces[space],
+                bags_database.get_prefix_digests(space, depth=depth),
+            )
+        )
+
+    return disagreements
@@ -0,0 +1,47 @@
+"""
+Helpers for estimating totals from a random sample of bags.
+
+If we've sampled ``n`` of the ``N`` bags that match a query, the sum of
+some per-bag value (e.g. file count) over all ``N`` bags is approximately
+``N`` times the sample mean.  The error bound is the half-width of a 95%
+confidence interval, using the finite population correction -- so if we
+sampled every bag, the error is zero.
+"""
+
+import math
+
+
+# The z-score for a 95% confidence interval
+Z_95 = 1.96
+
+
+def estimate_total(values, population_size):
+    """
+    Estimate the total of a value across ``population_size`` bags, given
+    the values for a random sample of them.
+
+    Returns (estimate, error).  The error is None if we can't tell how
+    accurate the estimate is, because the sample is too small.
+    """
+    n = len(values)
+
+    if n == 0:
+        return 0, (0 if population_size == 0 else None)
+
+    mean = sum(values) / n
+    estimate = mean * population_size
+
+    if n >= population_size:
+        return int(round(estimate)), 0
+
+    if n == 1:
+        return int(round(estimate)), None
+
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+    standard_error = (
+        population_size
+        * math.sqrt(variance / n)
+        * math.sqrt(1 - n / population_size)
+    )
+
+    return int(round(estimate)), int(math.ceil(Z_95 * standard_error))
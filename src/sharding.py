@@ -0,0 +1,369 @@
+import collections
+import concurrent.futures
+import contextlib
+import pathlib
+import threading
+import urllib.parse
+
+import attr
+
+from src.database import (
+    DEFAULT_PREFIX_BUCKET_DEPTH,
+    BagsDatabase,
+    SqliteDatabase,
+    check_date_histogram_interval,
+)
+from src.metrics import REGISTRY
+from src.query import EstimatedTotals, QueryContext, QueryResult
+from src.sketch import SizeSketch
+from src.zip_layout import ZipLayout
+
+
+# What _map_shards gets back for a space whose shard has gone away.
+_MISSING_SHARD = object()
+
+
+@attr.s(eq=False)
+class ShardedBagsDatabase:
+    """
+    Stores the bags for each space in a separate SQLite database, inside
+    a single directory, e.g.
+
+        bags.d/
+          born-digital.db
+          digitised.db
+          ...
+
+    This has the same API as BagsDatabase.  Because each space is a separate
+    file, writing to one space doesn't invalidate the query cache of any
+    other, and a huge space doesn't slow down queries on a small one.
+    """
+
+    root = attr.ib(converter=pathlib.Path)
+    read_only = attr.ib(default=False)
+    metrics = attr.ib(default=REGISTRY)
+    slow_query_threshold = attr.ib(default=None)
+    index_files = attr.ib(default=False)
+    prefix_bucket_depth = attr.ib(default=DEFAULT_PREFIX_BUCKET_DEPTH)
+    max_workers = attr.ib(default=8)
+
+    _shards = attr.ib(factory=dict, init=False)
+    _lock = attr.ib(factory=threading.Lock, init=False)
+
+    def __attrs_post_init__(self):
+        if not self.read_only:
+            self.root.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_path(cls, path, **kwargs):
+        return cls(root=path, **kwargs)
+
+    def _shard_path(self, space):
+        return self.root / (urllib.parse.quote(space, safe="") + ".db")
+
+    def spaces(self):
+        """
+        Returns the name of every space that has a shard.
+        """
+        return sorted(
+            urllib.parse.unquote(path.stem) for path in self.root.glob("*.db")
+        )
+
+    def shard(self, space, create=False):
+        """
+        Returns the BagsDatabase for a space, or None if we don't have any
+        bags in that space (and ``create`` is False).
+        """
+        path = self._shard_path(space)
+
+        with self._lock:
+            # If a snapshot without this space was published since we opened
+            # the shard, its file is gone -- forget about it.
+            try:
+                shard = self._shards[space]
+            except KeyError:
+                pass
+            else:
+                if path.exists():
+                    return shard
+                del self._shards[space]
+
+            if not path.exists() and not create:
+                return None
+
+            shard = self._shards[space] = BagsDatabase(
+                database=SqliteDatabase(path=path),
+                metrics=self.metrics,
+                slow_query_threshold=self.slow_query_threshold,
+                read_only=self.read_only,
+                index_files=self.index_files,
+                prefix_bucket_depth=self.prefix_bucket_depth,
+            )
+            return shard
+
+    def _call_shard(self, space, fn, default):
+        """
+        Returns ``fn(shard)`` for the shard for ``space``, or ``default()`` if
+        we don't have any bags in that space.
+
+        If the shard's file is removed while we're using it (e.g. when a
+        snapshot is published), we get a FileNotFoundError -- then we drop
+        the old shard and open it again, if it's still there.
+        """
+        shard = self.shard(space)
+
+        if shard is not None:
+            try:
+                return fn(shard)
+            except FileNotFoundError:
+                with self._lock:
+                    self._shards.pop(space, None)
+
+                shard = self.shard(space)
+
+                if shard is not None:
+                    return fn(shard)
+
+        return default()
+
+    def check_schema(self):
+        """
+        Raises OutdatedDatabase if the tables in any shard are out of date.
+        See BagsDatabase.check_schema.
+        """
+        self._map_shards(lambda shard: shard.check_schema())
+
+    @property
+    def slow_queries(self):
+        return [
+            slow_query
+            for shard in list(self._shards.values())
+            for slow_query in shard.slow_queries
+        ]
+
+    def _map_shards(self, fn, spaces=None):
+        """
+        Call ``fn`` on the shard for every space in parallel, and return
+        a dict {space: result}.
+        """
+        if spaces is None:
+            spaces = self.spaces()
+
+        if not spaces:
+            return {}
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(spaces))
+        ) as executor:
+            futures = {
+                space: executor.submit(
+                    self._call_shard, space, fn, default=lambda: _MISSING_SHARD
+                )
+                for space in spaces
+            }
+            results = {space: future.result() for space, future in futures.items()}
+
+        return {
+            space: result
+            for space, result in results.items()
+            if result is not _MISSING_SHARD
+        }
+
+    def get_known_ids(self):
+        known_ids = set()
+        for shard_ids in self._map_shards(lambda shard: shard.get_known_ids()).values():
+            known_ids.update(shard_ids)
+        return known_ids
+
+    def get_space_digests(self):
+        digests = {}
+        for shard_digests in self._map_shards(
+            lambda shard: shard.get_space_digests()
+        ).values():
+            digests.update(shard_digests)
+        return digests
+
+    def get_prefix_digests(self, space, depth):
+        return self._call_shard(
+            space,
+            lambda shard: shard.get_prefix_digests(space, depth=depth),
+            default=dict,
+        )
+
+    @contextlib.contextmanager
+    def bulk_store_bags(self, commit_every=1):
+        """
+        A helper for storing bags, which sends each bag to the shard for its
+        space.  It has the same interface as BagsDatabase.bulk_store_bags.
+        """
+        sharded_db = self
+
+        with contextlib.ExitStack() as stack:
+            helpers = {}
+
+            class Helper:
+                def store_bag(self, bag):
+                    try:
+                        helper = helpers[bag.space]
+                    except KeyError:
+                        shard = sharded_db.shard(bag.space, create=True)
+                        helper = helpers[bag.space] = stack.enter_context(
+                            shard.bulk_store_bags(commit_every=commit_every)
+                        )
+
+                    helper.store_bag(bag)
+
+            yield Helper()
+
+    def query(self, query_context: QueryContext) -> QueryResult:
+        return self._call_shard(
+            query_context.space,
+            lambda shard: shard.query(query_context),
+            default=lambda: QueryResult(
+                total_count=0,
+                total_file_count=0,
+                total_file_size=0,
+                file_ext_tally={},
+                bags=[],
+            ),
+        )
+
+    def query_many(self, query_contexts):
+        """
+        Each shard holds a single space, so queries in different spaces
+        can't share a connection -- instead we run the queries for each
+        shard in parallel, and each shard batches its own queries.
+        """
+        contexts_by_space = collections.defaultdict(list)
+        for query_context in query_contexts:
+            contexts_by_space[query_context.space].append(query_context)
+
+        results = {}
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers
+        ) as executor:
+            futures = {
+                space: executor.submit(
+                    self._call_shard,
+                    space,
+                    lambda shard, contexts=contexts: shard.query_many(contexts),
+                    default=lambda contexts=contexts: [
+                        self.query(query_context) for query_context in contexts
+                    ],
+                )
+                for space, contexts in contexts_by_space.items()
+            }
+
+            for space, future in futures.items():
+                results.update(zip(contexts_by_space[space], future.result()))
+
+        return [results[query_context] for query_context in query_contexts]
+
+    def query_page(self, query_context: QueryContext):
+        return self._call_shard(
+            query_context.space,
+            lambda shard: shard.query_page(query_context),
+            default=list,
+        )
+
+    def estimate_totals(self, query_context: QueryContext, sample_size=1000):
+        return self._call_shard(
+            query_context.space,
+            lambda shard: shard.estimate_totals(query_context, sample_size=sample_size),
+            default=lambda: EstimatedTotals(
+                total_count=0,
+                total_file_count=0,
+                total_file_size=0,
+                file_ext_tally={},
+                total_file_count_error=0,
+                total_file_size_error=0,
+                file_ext_tally_error={},
+                sample_size=0,
+            ),
+        )
+
+    def iter_bags(self, query_context: QueryContext, chunk_size=1000):
+        shard = self.shard(query_context.space)
+
+        if shard is None:
+            return iter([])
+
+        return shard.iter_bags(query_context, chunk_size=chunk_size)
+
+    def date_histogram(self, query_context: QueryContext, interval="day"):
+        check_date_histogram_interval(interval)
+
+        return self._call_shard(
+            query_context.space,
+            lambda shard: shard.date_histogram(query_context, interval=interval),
+            default=list,
+        )
+
+    def size_distribution(self, query_context: QueryContext):
+        return self._call_shard(
+            query_context.space,
+            lambda shard: shard.size_distribution(query_context),
+            default=lambda: {**SizeSketch().summary(), "bags_without_sizes": 0},
+        )
+
+    def zip_layout(self, query_context: QueryContext):
+        return self._call_shard(
+            query_context.space,
+            lambda shard: shard.zip_layout(query_context),
+            default=ZipLayout,
+        )
+
+    def autocomplete(self, space, prefix, limit=10):
+        return self._call_shard(
+            space,
+            lambda shard: shard.autocomplete(space, prefix, limit=limit),
+            default=lambda: {
+                "prefix": prefix,
+                "total": 0,
+                "identifiers": [],
+                "next_characters": {},
+            },
+        )
+
+    def find_files(
+        self, extension=None, min_size=None, max_size=None, space=None, limit=100
+    ):
+        if space is not None:
+            spaces = [space]
+        else:
+            spaces = None
+
+        results = self._map_shards(
+            lambda shard: shard.find_files(
+                extension=extension, min_size=min_size, max_size=max_size, limit=limit
+            ),
+            spaces=spaces,
+        )
+
+        all_files = [bag_file for files in results.values() for bag_file in files]
+        return sorted(all_files, key=lambda f: f.size, reverse=True)[:limit]
+
+    def find_files_by_checksum(self, checksum):
+        results = self._map_shards(
+            lambda shard: shard.find_files_by_checksum(checksum)
+        )
+
+        return [bag_file for space in sorted(results) for bag_file in results[space]]
+
+    def get_spaces(self):
+        spaces = {}
+        for shard_spaces in self._map_shards(lambda shard: shard.get_spaces()).values():
+            spaces.update(shard_spaces)
+        return spaces
+
+
+def open_bags_database(path, **kwargs):
+    """
+    Open the bags database at ``path``.  If ``path`` is a directory, we
+    assume it's a sharded database.
+    """
+    if pathlib.Path(path).is_dir():
+        return ShardedBagsDatabase.from_path(path, **kwargs)
+    else:
+        return BagsDatabase.from_path(path, **kwargs)
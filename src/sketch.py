@@ -0,0 +1,114 @@
+"""
+Mergeable sketches of file-size distributions.
+
+We can't afford to keep every file size, so we count files in logarithmic
+buckets: each power of two is split into SUB_BUCKETS buckets, and a size
+is reported as the geometric midpoint of its bucket.  That keeps the error
+on any quantile within about 9%, whatever the size, and two sketches can
+be merged by adding up their bucket counts -- which we can do in SQL.
+"""
+
+import bisect
+import itertools
+import math
+
+import attr
+
+
+SUB_BUCKETS = 4
+
+
+def bucket_for_size(size):
+    """
+    Returns the bucket that a file of this size is counted in.  Empty files
+    go in bucket 0; everything else goes in bucket 1 or higher.
+    """
+    if size <= 0:
+        return 0
+
+    return int(math.floor(math.log2(size) * SUB_BUCKETS)) + 1
+
+
+def representative_size(bucket):
+    """
+    Returns the size we report for files in this bucket.
+    """
+    if bucket == 0:
+        return 0
+
+    return int(round(2 ** ((bucket - 0.5) / SUB_BUCKETS)))
+
+
+@attr.s
+class SizeSketch:
+    """
+    An approximate distribution of file sizes: the number of files in each
+    bucket, plus the exact size of the biggest file.
+    """
+
+    buckets = attr.ib(factory=dict)
+    max_size = attr.ib(default=None)
+
+    @classmethod
+    def from_sizes(cls, sizes):
+        sketch = cls()
+
+        for size in sizes:
+            bucket = bucket_for_size(size)
+            sketch.buckets[bucket] = sketch.buckets.get(bucket, 0) + 1
+
+            if sketch.max_size is None or size > sketch.max_size:
+                sketch.max_size = size
+
+        return sketch
+
+    @property
+    def count(self):
+        return sum(self.buckets.values())
+
+    def merge(self, other):
+        """
+        Add the files from another sketch to this one.
+        """
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+        if other.max_size is not None and (
+            self.max_size is None or other.max_size > self.max_size
+        ):
+            self.max_size = other.max_size
+
+    def quantile(self, q):
+        """
+        Returns the approximate size of the file at quantile ``q`` (between
+        0 and 1), or None if the sketch is empty.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError(f"Quantile must be between 0 and 1, got {q!r}")
+
+        total = self.count
+        if total == 0:
+            return None
+
+        # The (1-based) rank of the file we're looking for
+        rank = max(1, int(math.ceil(q * total)))
+
+        buckets = sorted(self.buckets)
+        cumulative = list(itertools.accumulate(self.buckets[b] for b in buckets))
+        size = representative_size(buckets[bisect.bisect_left(cumulative, rank)])
+
+        # The biggest file is known exactly, so we never need to report
+        # anything bigger than it.
+        if self.max_size is not None:
+            size = min(size, self.max_size)
+
+        return size
+
+    def summary(self):
+        return {
+            "file_count": self.count,
+            "median": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max_size,
+        }
@@ -0,0 +1,120 @@
+"""
+Update the bags database without disturbing the web app.
+
+If freshen_bag_db.py writes straight into the database the app is reading,
+every commit changes the file under the app's feet: reads wait on writes,
+and the app throws away its query cache after every bag.
+
+Instead, we can copy the database, write the new bags into the copy, and
+swap it into place with a rename when we're done.  The app keeps reading the
+old file until then, and the swap is atomic: every request sees either the
+old database or the new one, never a half-written one.  The app notices the
+swap (the file has a new inode), and clears its cache once.
+
+For a sharded database, each shard is copied and swapped separately.
+"""
+
+import contextlib
+import os
+import pathlib
+import shutil
+import sqlite3
+
+
+def _copy_database(src, dst):
+    # We use SQLite's backup API rather than copying the file, so we get
+    # a consistent copy even if somebody is writing to it.
+    src_conn = sqlite3.connect(src)
+    dst_conn = sqlite3.connect(dst)
+
+    try:
+        src_conn.backup(dst_conn)
+    finally:
+        dst_conn.close()
+        src_conn.close()
+
+
+def _remove(path):
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+def create_snapshot(path, snapshot_path):
+    """
+    Copy the database at ``path`` (a file, or a directory of shards) to
+    ``snapshot_path``, replacing anything that's already there.  If there's
+    no database at ``path`` yet, there's nothing to copy.
+    """
+    path = pathlib.Path(path)
+    snapshot_path = pathlib.Path(snapshot_path)
+
+    _remove(snapshot_path)
+
+    if path.is_dir():
+        snapshot_path.mkdir()
+
+        for shard_path in path.glob("*.db"):
+            _copy_database(shard_path, snapshot_path / shard_path.name)
+    elif path.exists():
+        _copy_database(path, snapshot_path)
+
+
+def publish_snapshot(snapshot_path, path):
+    """
+    Replace the database at ``path`` with the one at ``snapshot_path``.
+
+    Each file is swapped in with a rename, so readers see the old file or
+    the new one, never a mix.
+    """
+    path = pathlib.Path(path)
+    snapshot_path = pathlib.Path(snapshot_path)
+
+    # If we're switching between a single file and a sharded database,
+    # we can't swap atomically, so we remove the old database first.
+    if path.exists() and path.is_dir() != snapshot_path.is_dir():
+        _remove(path)
+
+    if snapshot_path.is_dir():
+        path.mkdir(exist_ok=True)
+
+        new_shards = {shard_path.name for shard_path in snapshot_path.glob("*.db")}
+
+        for name in new_shards:
+            os.replace(snapshot_path / name, path / name)
+
+        # Remove any shards that aren't in the snapshot.
+        for shard_path in path.glob("*.db"):
+            if shard_path.name not in new_shards:
+                shard_path.unlink()
+
+        shutil.rmtree(snapshot_path)
+    else:
+        os.replace(snapshot_path, path)
+
+
+@contextlib.contextmanager
+def snapshot(path):
+    """
+    Make a copy of the database at ``path``, and yield the path of the copy.
+    If the block finishes without an error, the copy replaces the original;
+    otherwise it's thrown away.
+
+        with snapshot("bags.db") as snapshot_path:
+            bags_db = BagsDatabase.from_path(snapshot_path)
+            ...
+
+    """
+    path = pathlib.Path(path)
+    snapshot_path = path.with_name(path.name + ".snapshot")
+
+    create_snapshot(path, snapshot_path)
+
+    try:
+        yield snapshot_path
+    except BaseException:
+        _remove(snapshot_path)
+        raise
+    else:
+        publish_snapshot(snapshot_path, path)
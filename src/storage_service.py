@@ -1,30 +1,55 @@
+import collections
+import concurrent.futures
 import json
 from typing import Iterable
 
 import attr
-import boto3
 
+from src.aws import AWS_CLIENTS
 from src.models import Bag, BagIdentifier
+from src.reconcile import DEFAULT_DIGEST_DEPTH, IdDigest, prefix_digests
+from src.telemetry import IngestTelemetry
 
 
 @attr.s
 class StorageService:
     table_name = attr.ib()
+    telemetry = attr.ib(factory=IngestTelemetry)
+    aws_clients = attr.ib(default=AWS_CLIENTS)
+
+    def _dynamodb(self):
+        # The client of a DynamoDB resource converts items to and from
+        # Python types, e.g. {"S": "b1234"} becomes "b1234".
+        return self.telemetry.instrument(
+            self.aws_clients.resource("dynamodb").meta.client
+        )
+
+    def _s3(self):
+        return self.telemetry.instrument(self.aws_clients.client("s3"))
 
     def total_bags(self) -> int:
         """
         Get an approximate count for the number of bags in the storage service.
         """
-        dynamodb = boto3.client("dynamodb")
+        dynamodb = self.aws_clients.client("dynamodb")
         resp = dynamodb.describe_table(TableName=self.table_name)
         return resp["Table"]["ItemCount"]
 
     def get_bag_identifiers(self) -> Iterable[BagIdentifier]:
-        dynamodb = boto3.resource("dynamodb").meta.client
+        dynamodb = self._dynamodb()
 
         paginator = dynamodb.get_paginator("scan")
+        pages = iter(paginator.paginate(TableName=self.table_name))
+
+        while True:
+            with self.telemetry.stage("scan"):
+                page = next(pages, None)
+
+            if page is None:
+                break
+
+            self.telemetry.record_response(page)
 
-        for page in paginator.paginate(TableName=self.table_name):
             for item in page["Items"]:
 
                 # The ID is of the form
@@ -40,23 +65,134 @@ class StorageService:
                     version=version,
                 )
 
-    def get_bag(self, bag_identifier: BagIdentifier) -> Bag:
-        dynamodb = boto3.resource("dynamodb").meta.client
-        s3 = boto3.client("s3")
+    def _scan_segment(self, segment, total_segments):
+        # This reads the raw items, so we don't pay to convert every
+        # attribute to a Python type.
+        dynamodb = self.telemetry.instrument(self.aws_clients.client("dynamodb"))
+        paginator = dynamodb.get_paginator("scan")
+
+        # We only need the ID of each bag, so we don't fetch anything else.
+        pages = iter(
+            paginator.paginate(
+                TableName=self.table_name,
+                Segment=segment,
+                TotalSegments=total_segments,
+                ProjectionExpression="#id, #version",
+                ExpressionAttributeNames={"#id": "id", "#version": "version"},
+            )
+        )
+
+        while True:
+            with self.telemetry.stage("scan"):
+                page = next(pages, None)
+
+            if page is None:
+                break
+
+            self.telemetry.record_response(page)
+
+            for item in page["Items"]:
+                # External identifiers can contain slashes, but spaces can't.
+                space, external_identifier = item["id"]["S"].split("/", 1)
+
+                yield BagIdentifier(
+                    space=space,
+                    external_identifier=external_identifier,
+                    version=int(item["version"]["N"]),
+                )
+
+    def get_prefix_digests(self, depth=DEFAULT_DIGEST_DEPTH, segments=8):
+        """
+        Scan the table, and return the IdDigest of the bags for every
+        (space, prefix) up to ``depth`` characters long.
+
+        We scan ``segments`` parts of the table in parallel, so this takes
+        a fraction of the time of get_bag_identifiers.
+        """
+        def _scan_digests(segment):
+            return prefix_digests(self._scan_segment(segment, segments), depth=depth)
+
+        digests = collections.defaultdict(IdDigest)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=segments) as executor:
+            for segment_digests in executor.map(_scan_digests, range(segments)):
+                for key, digest in segment_digests.items():
+                    digests[key] += digest
+
+        return dict(digests)
+
+    def get_bag(self, bag_identifier: BagIdentifier, dynamodb=None, s3=None) -> Bag:
+        """
+        Fetch the storage manifest for a bag.
+
+        By default we use this thread's clients from ``aws_clients``, but
+        you can pass in clients to use instead.
+        """
+        if dynamodb is None:
+            dynamodb = self._dynamodb()
+
+        if s3 is None:
+            s3 = self._s3()
 
         ddb_key = {
             "id": "/".join([bag_identifier.space, bag_identifier.external_identifier]),
             "version": int(bag_identifier.version),
         }
 
-        ddb_resp = dynamodb.get_item(TableName=self.table_name, Key=ddb_key)
+        with self.telemetry.stage("get_item"):
+            ddb_resp = dynamodb.get_item(TableName=self.table_name, Key=ddb_key)
+
+        self.telemetry.record_response(ddb_resp)
 
         item = ddb_resp["Item"]
 
         s3_bucket = item["payload"]["typedStoreId"]["namespace"]
         s3_key = item["payload"]["typedStoreId"]["path"]
 
-        s3_body = s3.get_object(Bucket=s3_bucket, Key=s3_key)["Body"]
-        storage_manifest = json.load(s3_body)
+        with self.telemetry.stage("s3_get"):
+            s3_resp = s3.get_object(Bucket=s3_bucket, Key=s3_key)
+            s3_body = s3_resp["Body"].read()
+
+        self.telemetry.record_response(s3_resp)
+        self.telemetry.add("bytes_downloaded", len(s3_body))
+
+        with self.telemetry.stage("parse"):
+            bag = Bag.from_storage_manifest(json.loads(s3_body))
+
+        self.telemetry.add("manifests")
+
+        return bag
+
+    def get_bags(
+        self, bag_identifiers: Iterable[BagIdentifier], workers=1
+    ) -> Iterable[Bag]:
+        """
+        Fetch the storage manifests for a stream of bags, ``workers`` at
+        a time.  Bags are yielded as soon as they're fetched, which may not
+        be the order they were asked for.
+
+        We only keep a couple of fetches queued up per worker, so if
+        whatever's reading the bags falls behind, we stop fetching.  The
+        telemetry records how many fetched bags are waiting to be read.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+
+            def _fetched():
+                nonlocal pending
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                self.telemetry.observe_queue_depth(len(done))
+
+                for fut in done:
+                    yield fut.result()
+
+            for bag_identifier in bag_identifiers:
+                pending.add(executor.submit(self.get_bag, bag_identifier))
+
+                if len(pending) >= workers * 2:
+                    yield from _fetched()
 
-        return Bag.from_storage_manifest(storage_manifest)
+            while pending:
+                yield from _fetched()
@@ -0,0 +1,187 @@
+"""
+Timings and counters for freshen_bag_db.py.
+
+Fetching a new bag goes through several stages -- scanning DynamoDB for
+its identifier, looking it up with get_item, downloading its manifest from
+S3, parsing the manifest, and writing the bag to SQLite -- and when a run
+is slow, we want to know which stage the time is going to.
+
+IngestTelemetry records how long we spend in each stage, along with a few
+counters (manifests fetched, bytes downloaded, retries and throttles) and
+the number of fetched bags waiting to be written.  Every few seconds it
+writes a snapshot as a line of JSON, and it summarises the run at the end.
+"""
+
+import collections
+import contextlib
+import json
+import threading
+import time
+
+import attr
+import humanize
+
+
+# The error codes AWS services use when they're throttling us.
+THROTTLING_ERROR_CODES = {
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+}
+
+
+@attr.s(eq=False)
+class IngestTelemetry:
+    """
+    Stages are timed in whichever thread runs them, so if we're fetching
+    with several workers, the total time in a stage can be longer than
+    the run itself.
+    """
+
+    output = attr.ib(default=None)
+    interval = attr.ib(default=10)
+    clock = attr.ib(default=time.monotonic)
+
+    _stage_seconds = attr.ib(factory=collections.Counter)
+    _stage_calls = attr.ib(factory=collections.Counter)
+    _counters = attr.ib(factory=collections.Counter)
+    _queue_depth = attr.ib(default=0)
+    _max_queue_depth = attr.ib(default=0)
+    _lock = attr.ib(factory=threading.Lock)
+
+    def __attrs_post_init__(self):
+        self._started = self._last_report = self.clock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+
+            with self._lock:
+                self._stage_seconds[name] += elapsed
+                self._stage_calls[name] += 1
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def record_response(self, resp):
+        """
+        Count the retries botocore made before it got this response.
+        """
+        self.add("retries", resp["ResponseMetadata"].get("RetryAttempts", 0))
+
+    def observe_queue_depth(self, depth):
+        with self._lock:
+            self._queue_depth = depth
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+
+    def instrument(self, client):
+        """
+        Count the requests AWS throttles on this boto3 client.  botocore
+        retries them for us, so we'd never see them otherwise.
+        """
+        # Clients are shared, so we may be asked to instrument a client more
+        # than once; the unique ID means we only count its throttles once.
+        client.meta.events.register(
+            "needs-retry",
+            self._check_for_throttling,
+            unique_id=f"ingest-telemetry-{id(self)}",
+        )
+        return client
+
+    def _check_for_throttling(self, response=None, **kwargs):
+        # If the request failed before we got a response (e.g. a connection
+        # error), there's no error code to look at.
+        if response is None:
+            return
+
+        _, parsed = response
+        if parsed.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+            self.add("throttles")
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = self.clock() - self._started
+
+            def per_second(count):
+                return count / elapsed if elapsed else 0
+
+            return {
+                "elapsed_seconds": elapsed,
+                "stages": {
+                    name: {
+                        "calls": self._stage_calls[name],
+                        "seconds": self._stage_seconds[name],
+                    }
+                    for name in sorted(self._stage_calls)
+                },
+                "counters": dict(sorted(self._counters.items())),
+                "manifests_per_second": per_second(self._counters["manifests"]),
+                "bytes_per_second": per_second(self._counters["bytes_downloaded"]),
+                "queue_depth": self._queue_depth,
+                "max_queue_depth": self._max_queue_depth,
+            }
+
+    def _write(self, event, snapshot):
+        if self.output is not None:
+            self.output.write(json.dumps({"event": event, **snapshot}) + "\n")
+            self.output.flush()
+
+    def maybe_report(self):
+        """
+        Write a snapshot, if it's been ``interval`` seconds since the last one.
+        """
+        now = self.clock()
+
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self._write("progress", self.snapshot())
+
+    def finish(self):
+        """
+        Write a final snapshot, and return a summary of the run for a human
+        to read.
+        """
+        snapshot = self.snapshot()
+        self._write("summary", snapshot)
+
+        counters = snapshot["counters"]
+        lines = [
+            "Fetched %s manifests (%s) in %.1fs: %.1f manifests/s, %s/s"
+            % (
+                humanize.intcomma(counters.get("manifests", 0)),
+                humanize.naturalsize(counters.get("bytes_downloaded", 0)),
+                snapshot["elapsed_seconds"],
+                snapshot["manifests_per_second"],
+                humanize.naturalsize(snapshot["bytes_per_second"]),
+            )
+        ]
+
+        for name, stage in snapshot["stages"].items():
+            lines.append(
+                "  %-12s %9.1fs  %8.1fms/call  (%s calls)"
+                % (
+                    name,
+                    stage["seconds"],
+                    stage["seconds"] / stage["calls"] * 1000,
+                    humanize.intcomma(stage["calls"]),
+                )
+            )
+
+        lines.append(
+            "Retries: %d, throttles: %d, max writer queue depth: %d"
+            % (
+                counters.get("retries", 0),
+                counters.get("throttles", 0),
+                snapshot["max_queue_depth"],
+            )
+        )
+
+        return "\n".join(lines)
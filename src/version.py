@@ -0,0 +1,57 @@
+"""
+Find out which commit of the app is running.
+
+Shelling out to git is slow, and it doesn't work if the app is deployed
+without the .git directory, so we resolve the commit once at install time:
+
+    python3 -m src.version
+
+which writes it to GIT_COMMIT in the root of the repo.  If that file is
+missing, we fall back to asking git (once).
+"""
+
+import functools
+import os
+import pathlib
+import subprocess
+
+
+COMMIT_PATH = pathlib.Path(__file__).resolve().parent.parent / "GIT_COMMIT"
+
+
+def _ask_git():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=COMMIT_PATH.parent,
+                stderr=subprocess.DEVNULL,
+            )
+            .strip()
+            .decode("ascii")
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+@functools.lru_cache()
+def get_git_commit(commit_path=COMMIT_PATH):
+    try:
+        return os.environ["BAG_BROWSER_GIT_COMMIT"]
+    except KeyError:
+        pass
+
+    try:
+        return pathlib.Path(commit_path).read_text().strip()
+    except FileNotFoundError:
+        return _ask_git()
+
+
+def write_commit_file(commit_path=COMMIT_PATH):
+    commit = _ask_git()
+    pathlib.Path(commit_path).write_text(commit + "\n")
+    return commit
+
+
+if __name__ == "__main__":  # pragma: no cover
+    print(write_commit_file())
@@ -0,0 +1,119 @@
+"""
+Work out the size of a ZIP before we create it.
+
+When somebody downloads every bag that matches a query as a single ZIP,
+we want to send a Content-Length header, so their browser can show
+a progress bar -- but we don't want to fetch thousands of manifests from
+S3 before we send the first byte.
+
+The size of a ZIP only depends on the names and sizes of the files in it,
+and the sizes of the different parts add up, so we work out the layout of
+each bag when we store it, and add them up when somebody downloads a query.
+
+The record sizes here match the ZIPs written by zipstreamer (uncompressed,
+with an extended timestamp on every file, and no comments).
+"""
+
+import attr
+
+
+# Every file has a local header (30 bytes, then the filename and a 9-byte
+# extended timestamp), its data, and then a data descriptor.
+LOCAL_HEADER_SIZE = 30
+EXTENDED_TIMESTAMP_SIZE = 9
+DATA_DESCRIPTOR_SIZE = 16
+
+# ...and an entry in the central directory at the end of the ZIP (46 bytes,
+# then the filename and the extended timestamp).
+CENTRAL_DIRECTORY_ENTRY_SIZE = 46
+
+# The original ZIP format stores sizes and offsets in 32 bits, and the
+# number of files in 16 bits.  Anything bigger needs ZIP64 records.
+UINT16_MAX = 2 ** 16 - 1
+UINT32_MAX = 2 ** 32 - 1
+
+# Files over 4GB need a bigger data descriptor, and an extra field in the
+# central directory.
+ZIP64_DATA_DESCRIPTOR_SIZE = 24
+ZIP64_EXTRA_FIELD_SIZE = 28
+
+# The end of the ZIP is a 22-byte record, which is preceded by two ZIP64
+# records (56 + 20 bytes) if the ZIP is too big for the original format.
+END_OF_CENTRAL_DIRECTORY_SIZE = 22
+ZIP64_END_OF_CENTRAL_DIRECTORY_SIZE = 56 + 20
+
+
+def bag_directory(bag_identifier):
+    """
+    The directory that holds a bag's files in a multi-bag ZIP,
+    e.g. ``digitised/b1234/v1/``.
+    """
+    return "/".join(
+        [
+            bag_identifier.space,
+            bag_identifier.external_identifier,
+            bag_identifier.display_version,
+            "",
+        ]
+    )
+
+
+@attr.s(frozen=True)
+class ZipLayout:
+    """
+    The numbers that decide how long a ZIP is: how many files it has, the
+    bytes taken by the files (their headers and data), and the bytes taken
+    by the central directory.
+    """
+
+    entry_count = attr.ib(default=0)
+    data_size = attr.ib(default=0)
+    directory_size = attr.ib(default=0)
+
+    @classmethod
+    def from_files(cls, files):
+        """
+        Given the (filename, size) of every file in a ZIP, work out its layout.
+        """
+        entry_count = data_size = directory_size = 0
+
+        for filename, size in files:
+            name_size = len(filename.encode("utf8"))
+
+            entry_count += 1
+            data_size += LOCAL_HEADER_SIZE + name_size + EXTENDED_TIMESTAMP_SIZE + size
+            directory_size += (
+                CENTRAL_DIRECTORY_ENTRY_SIZE + name_size + EXTENDED_TIMESTAMP_SIZE
+            )
+
+            if size > UINT32_MAX:
+                data_size += ZIP64_DATA_DESCRIPTOR_SIZE
+                directory_size += ZIP64_EXTRA_FIELD_SIZE
+            else:
+                data_size += DATA_DESCRIPTOR_SIZE
+
+        return cls(
+            entry_count=entry_count, data_size=data_size, directory_size=directory_size
+        )
+
+    def __add__(self, other):
+        return ZipLayout(
+            entry_count=self.entry_count + other.entry_count,
+            data_size=self.data_size + other.data_size,
+            directory_size=self.directory_size + other.directory_size,
+        )
+
+    def archive_size(self):
+        """
+        The size of a ZIP with this layout, in bytes.
+        """
+        size = self.data_size + self.directory_size + END_OF_CENTRAL_DIRECTORY_SIZE
+
+        if (
+            self.entry_count >= UINT16_MAX
+            or self.directory_size >= UINT32_MAX
+            or self.data_size >= UINT32_MAX
+        ):
+            size += ZIP64_END_OF_CENTRAL_DIRECTORY_SIZE
+
+        return size
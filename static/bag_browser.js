@@ -14,6 +14,11 @@ class BagHandler {
   }
 
   renderTable() {
+    this.renderBags();
+    this.renderTotals();
+  }
+
+  renderBags() {
     var old_tbody = document.getElementById("tbody__bags");
 
     var new_tbody = document.createElement("tbody");
@@ -51,6 +56,44 @@ class BagHandler {
 
     old_tbody.parentNode.replaceChild(new_tbody, old_tbody);
 
+    // Display or hide the "no bags found" message as appropriate.
+    //
+    // We also hide other parts of the bags panel which aren't appropriate
+    // if there aren't any results.
+    var noBagsMessage = document.getElementById("no_bags_message");
+    var bagsTable = document.getElementById("bags_table");
+    var bagsDetails = document.getElementById("bag_details");
+
+    if (this.payload["bags"].length === 0) {
+      hide(bagsTable);
+      hide(bagsDetails);
+
+      unhide(noBagsMessage);
+    } else {
+      unhide(bagsTable);
+      unhide(bagsDetails);
+
+      hide(noBagsMessage);
+    }
+  }
+
+  // Update the totals in place.  If they're estimates, we show the error
+  // bounds, and they get replaced when the exact totals arrive.
+  updateTotals(totals) {
+    for (var key in totals) {
+      this.payload[key] = totals[key];
+    }
+
+    if (!totals["approximate"]) {
+      delete this.payload["approximate"];
+    }
+
+    this.renderTotals();
+  }
+
+  renderTotals() {
+    var approximate = this.payload["approximate"];
+
     if (this.payload["total_bags"] == 1) {
       document.getElementById("li__total_bags").innerHTML = "1 matching bag";
     } else {
@@ -65,6 +108,14 @@ class BagHandler {
 
     document.getElementById("li__total_file_size").innerHTML = this.payload["total_file_size"] + " of data";
 
+    if (approximate) {
+      document.getElementById("li__total_file_count").innerHTML += " (&plusmn; " + this.payload["total_file_count_error"] + ")";
+      document.getElementById("li__total_file_size").innerHTML += " (&plusmn; " + this.payload["total_file_size_error"] + ")";
+      unhide(document.getElementById("li__estimate_note"));
+    } else {
+      hide(document.getElementById("li__estimate_note"));
+    }
+
     // https://stackoverflow.com/a/1069840/1558022
     var old_file_ext_tally = document.getElementById("total_file_ext_tally");
 
@@ -97,29 +148,13 @@ class BagHandler {
       var countCell = row.insertCell(-1);
       countCell.classList.add("file_tally_count");
       countCell.innerHTML = intComma(count.toString());
+
+      if (approximate) {
+        countCell.innerHTML = "~" + countCell.innerHTML;
+      }
     }
 
     old_file_ext_tally.parentNode.replaceChild(new_file_ext_tally, old_file_ext_tally);
-
-    // Display or hide the "no bags found" message as appropriate.
-    //
-    // We also hide other parts of the bags panel which aren't appropriate
-    // if there aren't any results.
-    var noBagsMessage = document.getElementById("no_bags_message");
-    var bagsTable = document.getElementById("bags_table");
-    var bagsDetails = document.getElementById("bag_details");
-
-    if (this.payload["bags"].length === 0) {
-      hide(bagsTable);
-      hide(bagsDetails);
-
-      unhide(noBagsMessage);
-    } else {
-      unhide(bagsTable);
-      unhide(bagsDetails);
-
-      hide(noBagsMessage);
-    }
   }
 }
 
@@ -154,6 +189,37 @@ function updateURLParameter(url, param, paramVal){
     return baseURL + "?" + newAdditionalURL + rows_txt;
 }
 
+// A cache that holds up to maxSize entries, and forgets the least recently
+// used entry when it's full.  A Map remembers the order its keys were added
+// in, so we move an entry to the end whenever we use it, and the first key
+// is always the least recently used.
+class LRUCache {
+  constructor(maxSize) {
+    this.maxSize = maxSize;
+    this.entries = new Map();
+  }
+
+  get(key) {
+    if (!this.entries.has(key)) {
+      return undefined;
+    }
+
+    var value = this.entries.get(key);
+    this.entries.delete(key);
+    this.entries.set(key, value);
+    return value;
+  }
+
+  set(key, value) {
+    this.entries.delete(key);
+    this.entries.set(key, value);
+
+    while (this.entries.size > this.maxSize) {
+      this.entries.delete(this.entries.keys().next().value);
+    }
+  }
+}
+
 class QueryContext {
   constructor(space, external_identifier_prefix, created_date_before, created_date_after, page, page_size, bagHandler) {
     this.space = space;
@@ -163,11 +229,22 @@ class QueryContext {
     this.page = page;
     this.page_size = page_size;
     this.bagHandler = bagHandler;
+
+    // The results we've already fetched, so going back to a page (or
+    // undoing a change to the filters) doesn't ask the server again.
+    // The totals are the same for every page of a query, so we cache
+    // them separately, and then only need to fetch the bags for a page.
+    this.pageCache = new LRUCache(50);
+    this.totalsCache = new LRUCache(20);
+
+    // Pages we're already fetching, and the callbacks waiting for them.
+    this.pendingPages = new Map();
   }
 
   changeExternalIdentifierPrefix(newPrefix) {
     this.external_identifier_prefix = newPrefix;
     this.updateResults();
+    this.updateSuggestions();
 
     var newUrl = updateURLParameter(window.location.href, "prefix", newPrefix);
     history.pushState({"prefix": newPrefix}, "", newUrl);
@@ -189,34 +266,338 @@ class QueryContext {
     history.pushState({"created_after": newDateCreatedAfter}, "", newUrl);
   }
 
+  changePage(newPage) {
+    this.page = newPage;
+    this.updateResults();
+
+    var newUrl = updateURLParameter(window.location.href, "page", newPage);
+    history.pushState({"page": newPage}, "", newUrl);
+  }
+
+  nextPage() {
+    this.changePage(this.page + 1);
+  }
+
+  previousPage() {
+    this.changePage(this.page - 1);
+  }
+
+  // When the user goes back or forward through their history, show the
+  // results for the new URL -- usually from the cache.
+  restoreFromURL() {
+    var params = new URLSearchParams(window.location.search);
+
+    this.external_identifier_prefix = params.get("prefix") || "";
+    this.created_date_before = params.get("created_before") || "";
+    this.created_date_after = params.get("created_after") || "";
+    this.page = parseInt(params.get("page") || "1", 10);
+
+    document.getElementById("external_identifier_input").value = this.external_identifier_prefix;
+    document.getElementById("created_date_before").value = this.created_date_before;
+    document.getElementById("created_date_after").value = this.created_date_after;
+
+    this.updateResults();
+    this.updateSuggestions();
+  }
+
+  // Fill in the <datalist> of suggestions for the identifier box: first
+  // the possible next characters, with how many identifiers continue that
+  // way, then the first few matching identifiers.
+  updateSuggestions() {
+    var datalist = document.getElementById("external_identifier_suggestions");
+    if (!datalist) {
+      return;
+    }
+
+    var xhttp = new XMLHttpRequest();
+    var prefix = this.external_identifier_prefix;
+
+    xhttp.onreadystatechange = function() {
+      if (this.readyState == 4 && this.status == 200) {
+        var suggestions = JSON.parse(this.responseText);
+
+        // A slow response might arrive after the user has typed more.
+        if (suggestions["prefix"] !== document.getElementById("external_identifier_input").value) {
+          return;
+        }
+
+        datalist.innerHTML = "";
+
+        var nextCharacters = Object.keys(suggestions["next_characters"]).sort();
+        for (var i = 0; i < nextCharacters.length; i++) {
+          var count = suggestions["next_characters"][nextCharacters[i]];
+          var option = document.createElement("option");
+          option.value = prefix + nextCharacters[i];
+          option.label = intComma(count.toString()) + (count == 1 ? " identifier" : " identifiers");
+          datalist.appendChild(option);
+        }
+
+        for (var i = 0; i < suggestions["identifiers"].length; i++) {
+          var option = document.createElement("option");
+          option.value = suggestions["identifiers"][i];
+          datalist.appendChild(option);
+        }
+      }
+    };
+    xhttp.open(
+      "GET",
+      "/spaces/" + this.space + "/autocomplete?prefix=" + encodeURIComponent(prefix),
+      true
+    );
+    xhttp.send();
+  }
+
+  filterString() {
+    return "prefix=" + this.external_identifier_prefix + "&created_before=" + this.created_date_before + "&created_after=" + this.created_date_after;
+  }
+
+  queryString(page = this.page) {
+    return this.filterString() + "&page=" + page;
+  }
+
+  pageKey(page = this.page) {
+    return this.space + "?" + this.queryString(page);
+  }
+
+  totalsKey() {
+    return this.space + "?" + this.filterString();
+  }
+
+  totalPages() {
+    return Math.ceil(this.bagHandler.payload["total"] / this.page_size);
+  }
+
   updateResults() {
+    var bags = this.pageCache.get(this.pageKey());
+    var totals = this.totalsCache.get(this.totalsKey());
+
+    // If we're still waiting for the results of an earlier query, we
+    // don't want them any more.
+    if (this.eventSource) {
+      this.eventSource.close();
+    }
+
+    if (bags !== undefined && totals !== undefined) {
+      this.showResults(bags, totals);
+    } else if (totals !== undefined) {
+      var queryContext = this;
+      var pageKey = this.pageKey();
+
+      this.fetchPage(this.page, function(bags) {
+        // The user may have moved on while we were waiting.
+        if (queryContext.pageKey() === pageKey) {
+          queryContext.showResults(bags, totals);
+        }
+      });
+    } else if (window.EventSource) {
+      this.streamResults();
+    } else {
+      this.fetchResults();
+    }
+  }
+
+  showResults(bags, totals) {
+    this.bagHandler.payload = Object.assign({"bags": bags}, totals);
+    this.bagHandler.renderTable();
+    this.pageRendered();
+  }
+
+  // Once a page is showing, update the previous/next links, and fetch the
+  // pages either side in the background, so following them is instant.
+  pageRendered() {
+    var totalPages = this.totalPages();
+
+    var previousLinks = document.getElementsByClassName("prev_page");
+    for (var i = 0; i < previousLinks.length; i++) {
+      if (this.page > 1) {
+        unhide(previousLinks[i]);
+      } else {
+        hide(previousLinks[i]);
+      }
+    }
+
+    var nextLinks = document.getElementsByClassName("next_page");
+    for (var i = 0; i < nextLinks.length; i++) {
+      if (this.page < totalPages) {
+        unhide(nextLinks[i]);
+      } else {
+        hide(nextLinks[i]);
+      }
+    }
+
+    if (this.page > 1) {
+      this.fetchPage(this.page - 1);
+    }
+
+    if (this.page < totalPages) {
+      this.fetchPage(this.page + 1);
+    }
+  }
+
+  // Get the bags on a page, without the totals, and pass them to callback
+  // (if there is one).  Without a callback, this just fills the cache.
+  fetchPage(page, callback) {
+    var key = this.pageKey(page);
+    var callbacks = this.pendingPages.get(key);
+
+    var bags = this.pageCache.get(key);
+    if (bags !== undefined) {
+      if (callback) {
+        callback(bags);
+      }
+      return;
+    }
+
+    // If we're already fetching this page (e.g. prefetching it), wait for
+    // that rather than fetching it twice.
+    if (callbacks !== undefined) {
+      if (callback) {
+        callbacks.push(callback);
+      }
+      return;
+    }
+
+    callbacks = callback ? [callback] : [];
+    this.pendingPages.set(key, callbacks);
+
+    var pageCache = this.pageCache;
+    var pendingPages = this.pendingPages;
+
+    var xhttp = new XMLHttpRequest();
+
+    xhttp.onreadystatechange = function() {
+      if (this.readyState == 4) {
+        pendingPages.delete(key);
+
+        if (this.status == 200) {
+          var bags = JSON.parse(this.responseText)["bags"];
+          pageCache.set(key, bags);
+
+          for (var i = 0; i < callbacks.length; i++) {
+            callbacks[i](bags);
+          }
+        }
+      }
+    };
+    xhttp.open(
+      "GET",
+      "/spaces/" + this.space + "/get_bags_page?" + this.queryString(page),
+      true
+    );
+    xhttp.send();
+  }
+
+  // Get the page of bags and estimated totals first, then the exact
+  // totals when they're ready -- so the page appears quickly, even if
+  // the exact totals are slow.
+  streamResults() {
+    var eventSource = new EventSource("/spaces/" + this.space + "/stream_bags_data?" + this.queryString());
+    this.eventSource = eventSource;
+
+    var queryContext = this;
+    var bagHandler = this.bagHandler;
+    var pageKey = this.pageKey();
+    var totalsKey = this.totalsKey();
+
+    eventSource.addEventListener("page", function(event) {
+      bagHandler.payload = JSON.parse(event.data);
+      bagHandler.renderTable();
+
+      queryContext.pageCache.set(pageKey, bagHandler.payload["bags"]);
+      queryContext.pageRendered();
+    });
+
+    eventSource.addEventListener("totals", function(event) {
+      var totals = JSON.parse(event.data);
+      bagHandler.updateTotals(totals);
+
+      // We only cache the exact totals, not the estimates.
+      queryContext.totalsCache.set(totalsKey, totals);
+
+      // Otherwise the browser would reconnect and run the query again.
+      eventSource.close();
+    });
+
+    // If the stream fails before we get a page, fall back to fetching
+    // the results in one go.
+    var gotPage = false;
+    eventSource.addEventListener("page", function() { gotPage = true; });
+    eventSource.onerror = function() {
+      eventSource.close();
+      if (!gotPage) {
+        queryContext.fetchResults();
+      }
+    };
+  }
+
+  fetchResults() {
     var xhttp = new XMLHttpRequest();
 
     // Extract it as a variable here -- inside onreadystatechange, this
     // refers to the response, not the QueryContext.
-    bagHandler = this.bagHandler;
+    var queryContext = this;
+    var pageKey = this.pageKey();
+    var totalsKey = this.totalsKey();
 
     xhttp.onreadystatechange = function() {
       if (this.readyState == 4 && this.status == 200) {
-        bagHandler.payload = JSON.parse(this.responseText);
-        bagHandler.renderTable();
+        var totals = JSON.parse(this.responseText);
+        var bags = totals["bags"];
+        delete totals["bags"];
+
+        queryContext.pageCache.set(pageKey, bags);
+        queryContext.totalsCache.set(totalsKey, totals);
+
+        if (queryContext.pageKey() === pageKey) {
+          queryContext.showResults(bags, totals);
+        }
       }
     };
     xhttp.open(
       "GET",
-      "/spaces/" + this.space + "/get_bags_data?prefix=" + this.external_identifier_prefix + "&page=" + this.page + "&created_before=" + this.created_date_before + "&created_after=" + this.created_date_after,
+      "/spaces/" + this.space + "/get_bags_data?" + this.queryString(),
       true
     );
     xhttp.send();
   }
 }
 
-function nextPage(page) {
-  window.location.href = updateURLParameter(window.location.href, "page", page + 1);
-}
+// Fill in the totals and most common file types for every space on the
+// index page, with one request for all of them.
+function loadSpaceTotals(spaces) {
+  var xhttp = new XMLHttpRequest();
+
+  xhttp.onreadystatechange = function() {
+    if (this.readyState == 4 && this.status == 200) {
+      var results = JSON.parse(this.responseText)["results"];
+      var elements = document.getElementsByClassName("space_totals");
+
+      for (var i = 0; i < results.length; i++) {
+        var tally = results[i]["file_ext_tally"];
+
+        var extensions = Object.keys(tally).sort(function(a, b) {
+          return tally[b] - tally[a];
+        });
 
-function previousPage(page) {
-  window.location.href = updateURLParameter(window.location.href, "page", page - 1);
+        var topExtensions = extensions.slice(0, 3).map(function(extension) {
+          return extension === "" ? "(none)" : extension;
+        });
+
+        elements[i].innerHTML = results[i]["total_file_count"] + " files, " + results[i]["total_file_size"];
+
+        if (topExtensions.length > 0) {
+          elements[i].innerHTML += "; mostly " + topExtensions.join(", ");
+        }
+      }
+    }
+  };
+  xhttp.open("POST", "/batch/get_bags_data", true);
+  xhttp.setRequestHeader("Content-Type", "application/json");
+  xhttp.send(JSON.stringify({
+    "queries": spaces.map(function(space) {
+      return {"space": space, "page_size": 0};
+    })
+  }));
 }
 
 function intComma(value) {
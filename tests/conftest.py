@@ -1,9 +1,36 @@
 import pytest
 
-from src.database import SqliteDatabase
+from src.concurrency import NonBlocking
+from src.database import BagsDatabase, SqliteDatabase
+from src.metrics import MetricsRegistry
 
 
 @pytest.fixture
 def db(tmpdir):
     db_path = tmpdir / "bags.db"
     yield SqliteDatabase(path=db_path)
+
+
+@pytest.fixture
+def app_db(tmpdir):
+    """
+    The database served by the ``client`` fixture.  Store some bags in it
+    before you make any requests.
+    """
+    return BagsDatabase.from_path(tmpdir / "bags.db", metrics=MetricsRegistry())
+
+
+@pytest.fixture
+def client(app_db, monkeypatch):
+    """
+    A Flask test client for the web app, serving ``app_db``.
+    """
+    # The app opens the database when it's first imported, so it needs
+    # to point at a database that exists.
+    monkeypatch.setenv("BAG_BROWSER_DATABASE", str(app_db.database.path))
+
+    import app
+
+    monkeypatch.setattr(app, "bags_database", NonBlocking(app_db))
+
+    return app.app.test_client()
@@ -0,0 +1,48 @@
+import pytest
+
+from src.models import Bag, BagIdentifier
+
+
+@pytest.fixture
+def app_db(app_db):
+    with app_db.bulk_store_bags() as bulk_helper:
+        for external_identifier in ["b1", "b12", "b13", "b2", "PP/MON/1"]:
+            bulk_helper.store_bag(
+                Bag(
+                    identifier=BagIdentifier(
+                        space="digitised",
+                        external_identifier=external_identifier,
+                        version=1,
+                    ),
+                    created_date="2020-01-01T01:01:01.000000Z",
+                    file_count=1,
+                    total_file_size=100,
+                    file_ext_tally={},
+                )
+            )
+
+    return app_db
+
+
+def test_can_autocomplete_an_identifier(client):
+    resp = client.get("/spaces/digitised/autocomplete?prefix=b1&limit=2")
+
+    assert resp.json == {
+        "prefix": "b1",
+        "total": 3,
+        "identifiers": ["b1", "b12"],
+        "next_characters": {"2": 1, "3": 1},
+    }
+
+
+@pytest.mark.parametrize("limit, expected_count", [("-3", 1), ("0", 1), ("500", 3)])
+def test_clamps_the_limit(client, limit, expected_count):
+    resp = client.get(f"/spaces/digitised/autocomplete?prefix=b1&limit={limit}")
+
+    assert len(resp.json["identifiers"]) == expected_count
+
+
+def test_a_limit_that_isnt_a_number_is_a_bad_request(client):
+    resp = client.get("/spaces/digitised/autocomplete?prefix=b1&limit=lots")
+
+    assert resp.status_code == 400
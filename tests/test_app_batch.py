@@ -0,0 +1,65 @@
+import pytest
+
+from src.models import Bag, BagIdentifier
+
+
+@pytest.fixture
+def app_db(app_db):
+    with app_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(
+            Bag(
+                identifier=BagIdentifier(
+                    space="digitised", external_identifier="b1", version=1
+                ),
+                created_date="2020-01-01T01:01:01.000000Z",
+                file_count=4,
+                total_file_size=1024,
+                file_ext_tally={".bin": 4},
+            )
+        )
+
+    return app_db
+
+
+def test_can_run_a_batch_of_queries(client):
+    queries = [
+        {"space": "digitised", "page_size": 0},
+        {"space": "digitised", "prefix": "b1"},
+        {"space": "missing"},
+    ]
+
+    results = client.post("/batch/get_bags_data", json={"queries": queries}).json[
+        "results"
+    ]
+
+    assert [result["total"] for result in results] == [1, 1, 0]
+    assert [len(result["bags"]) for result in results] == [0, 1, 0]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        {"prefix": "b1"},
+        {"space": ["digitised"]},
+        {"space": "digitised", "prefix": 5},
+        {"space": "digitised", "created_after": "2021-01"},
+        {"space": "digitised", "created_before": 20210101},
+        {"space": "digitised", "page": 0},
+        {"space": "digitised", "page": "first"},
+    ],
+)
+def test_a_batch_with_a_bad_query_is_a_bad_request(client, query):
+    resp = client.post(
+        "/batch/get_bags_data", json={"queries": [{"space": "digitised"}, query]}
+    )
+
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "body", [None, {}, {"queries": [{"space": "digitised"}] * 101}]
+)
+def test_a_batch_needs_a_list_of_queries(client, body):
+    resp = client.post("/batch/get_bags_data", json=body)
+
+    assert resp.status_code == 400
@@ -0,0 +1,110 @@
+import io
+import json
+import zipfile
+
+import boto3
+from moto import mock_dynamodb2, mock_s3
+import pytest
+
+from src.models import Bag
+
+
+STORAGE_MANIFEST = {
+    "space": "digitised",
+    "info": {"externalIdentifier": "b1"},
+    "version": 1,
+    "createdDate": "2020-01-01T01:01:01.000000Z",
+    "manifest": {
+        "files": [
+            {
+                "name": f"data/file_{i}.bin",
+                "path": f"v1/data/file_{i}.bin",
+                "size": 1024,
+            }
+            for i in range(4)
+        ]
+    },
+    "tagManifest": {"files": []},
+    "location": {"prefix": {"namespace": "bags", "path": "digitised/b1"}},
+}
+
+
+@pytest.fixture
+def app_db(app_db):
+    with app_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(Bag.from_storage_manifest(STORAGE_MANIFEST))
+
+    return app_db
+
+
+@pytest.fixture
+def storage():
+    """
+    Mock the S3 bucket and DynamoDB table where the storage service keeps
+    the bag and its manifest.
+    """
+    with mock_s3(), mock_dynamodb2():
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket="bags")
+
+        for bag_file in STORAGE_MANIFEST["manifest"]["files"]:
+            s3.put_object(
+                Bucket="bags",
+                Key=f"digitised/b1/{bag_file['path']}",
+                Body=b"x" * bag_file["size"],
+            )
+
+        s3.put_object(
+            Bucket="bags", Key="manifests/b1.json", Body=json.dumps(STORAGE_MANIFEST)
+        )
+
+        dynamodb = boto3.resource("dynamodb")
+        dynamodb.create_table(
+            AttributeDefinitions=[
+                {"AttributeName": "id", "AttributeType": "S"},
+                {"AttributeName": "version", "AttributeType": "N"},
+            ],
+            TableName="vhs-storage-manifests",
+            KeySchema=[
+                {"AttributeName": "id", "KeyType": "HASH"},
+                {"AttributeName": "version", "KeyType": "RANGE"},
+            ],
+        )
+        dynamodb.Table("vhs-storage-manifests").put_item(
+            Item={
+                "id": "digitised/b1",
+                "version": 1,
+                "payload": {
+                    "typedStoreId": {"namespace": "bags", "path": "manifests/b1.json"}
+                },
+            }
+        )
+
+        yield
+
+
+def test_can_download_a_bag(client, storage):
+    resp = client.get("/bags/digitised/b1/v1/files")
+
+    body = resp.get_data()
+    assert len(body) == int(resp.headers["Content-Length"])
+
+    with zipfile.ZipFile(io.BytesIO(body)) as zf:
+        assert len(zf.namelist()) == 4
+        assert zf.read("data/file_0.bin") == b"x" * 1024
+
+
+def test_can_download_every_bag_in_a_query(client, storage):
+    resp = client.get("/spaces/digitised/files.zip")
+
+    assert resp.headers["Content-Disposition"] == "attachment; filename=digitised.zip"
+
+    body = resp.get_data()
+    assert len(body) == int(resp.headers["Content-Length"])
+
+    with zipfile.ZipFile(io.BytesIO(body)) as zf:
+        assert len(zf.namelist()) == 4
+        assert zf.read("digitised/b1/v1/data/file_0.bin") == b"x" * 1024
+
+    # The download used a shared S3 client, which we report on.
+    assert client.get("/metrics/aws").json["s3"]["clients"] >= 1
@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+
+import pytest
+
+from src.models import Bag, BagIdentifier
+
+
+@pytest.fixture
+def app_db(app_db):
+    with app_db.bulk_store_bags() as bulk_helper:
+        for i in range(3):
+            bulk_helper.store_bag(
+                Bag(
+                    identifier=BagIdentifier(
+                        space="digitised", external_identifier=f"b{i}", version=1
+                    ),
+                    created_date=f"2020-01-0{i + 1}T01:01:01.000000Z",
+                    file_count=i,
+                    total_file_size=i * 100,
+                    file_ext_tally={},
+                )
+            )
+
+    return app_db
+
+
+def test_can_export_bags_as_csv(client):
+    resp = client.get("/spaces/digitised/export.csv?created_after=2020-01-02")
+
+    assert resp.mimetype == "text/csv"
+    assert resp.headers["Content-Disposition"] == "attachment; filename=digitised.csv"
+
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+    assert [row["external_identifier"] for row in rows] == ["b1", "b2"]
+
+
+def test_can_export_bags_as_ndjson(client):
+    resp = client.get("/spaces/digitised/export.ndjson?prefix=b2")
+
+    assert resp.headers["Content-Disposition"] == (
+        "attachment; filename=digitised.ndjson"
+    )
+
+    lines = resp.get_data(as_text=True).splitlines()
+    assert [json.loads(line)["external_identifier"] for line in lines] == ["b2"]
+
+
+def test_can_only_export_known_formats(client):
+    assert client.get("/spaces/digitised/export.xlsx").status_code == 404
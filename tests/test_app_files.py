@@ -0,0 +1,79 @@
+import hashlib
+
+import pytest
+
+from src.database import BagsDatabase
+from src.metrics import MetricsRegistry
+from src.models import Bag
+
+
+def create_bag(external_identifier, files):
+    return Bag.from_storage_manifest(
+        {
+            "space": "digitised",
+            "info": {"externalIdentifier": external_identifier},
+            "version": 1,
+            "createdDate": "2020-01-01T01:01:01.000000Z",
+            "manifest": {
+                "files": [
+                    {
+                        "name": name,
+                        "path": f"v1/{name}",
+                        "size": size,
+                        "checksum": hashlib.sha256(name.encode("utf8")).hexdigest(),
+                    }
+                    for name, size in files
+                ]
+            },
+            "tagManifest": {"files": []},
+        }
+    )
+
+
+@pytest.fixture
+def app_db(tmpdir):
+    app_db = BagsDatabase.from_path(
+        tmpdir / "bags.db", metrics=MetricsRegistry(), index_files=True
+    )
+
+    with app_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(
+            create_bag(
+                "b1",
+                [("data/b1.xml", 100), ("data/b1_1.tif", 2000), ("data/b1_2.tif", 500)],
+            )
+        )
+        bulk_helper.store_bag(create_bag("b2", [("data/b2.tif", 1500)]))
+
+    return app_db
+
+
+def test_can_search_for_files(client):
+    files = client.get("/files/search?extension=.tif&min_size=1000").json
+
+    assert [f["path"] for f in files] == ["data/b1_1.tif", "data/b2.tif"]
+    assert files[0]["bag_id"] == "digitised/b1/v1"
+
+
+@pytest.mark.parametrize("limit, expected_count", [("2", 2), ("-1", 1), ("0", 4)])
+def test_limits_the_number_of_files(client, limit, expected_count):
+    files = client.get(f"/files/search?limit={limit}").json
+
+    assert len(files) == expected_count
+
+
+@pytest.mark.parametrize("arg", ["min_size", "max_size", "limit"])
+def test_a_number_that_isnt_a_number_is_a_bad_request(client, arg):
+    assert client.get(f"/files/search?{arg}=abc").status_code == 400
+
+
+def test_can_find_files_by_checksum(client):
+    checksum = hashlib.sha256(b"data/b2.tif").hexdigest()
+
+    files = client.get(f"/files/by_checksum/{checksum}").json
+
+    assert [f["path"] for f in files] == ["data/b2.tif"]
+
+
+def test_a_checksum_must_be_hex(client):
+    assert client.get("/files/by_checksum/not-a-checksum").status_code == 400
@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+from src.models import Bag, BagIdentifier
+
+
+def create_bag(external_identifier, created_date="2020-01-01T01:01:01.000000Z"):
+    return Bag(
+        identifier=BagIdentifier(
+            space="digitised", external_identifier=external_identifier, version=1
+        ),
+        created_date=created_date,
+        file_count=2,
+        total_file_size=100,
+        file_ext_tally={".xml": 1, ".jp2": 1},
+    )
+
+
+@pytest.fixture
+def app_db(app_db):
+    with app_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(create_bag("b1", "2020-01-01T01:01:01.000000Z"))
+        bulk_helper.store_bag(create_bag("b2", "2020-02-01T01:01:01.000000Z"))
+        bulk_helper.store_bag(create_bag("c3", "2021-01-01T01:01:01.000000Z"))
+
+    return app_db
+
+
+def test_can_get_bags_data(client):
+    result = client.get("/spaces/digitised/get_bags_data?prefix=b").json
+
+    assert [bag["id"] for bag in result["bags"]] == [
+        "digitised/b1/v1",
+        "digitised/b2/v1",
+    ]
+    assert result["total"] == 2
+    assert result["total_bags"] == "2"
+    assert result["total_file_count"] == "4"
+    assert result["file_ext_tally"] == {".xml": 2, ".jp2": 2}
+
+
+def test_can_get_a_page_of_bags_without_the_totals(client):
+    resp = client.get("/spaces/digitised/get_bags_page?prefix=b&page=1")
+
+    assert list(resp.json) == ["bags"]
+    assert [bag["id"] for bag in resp.json["bags"]] == [
+        "digitised/b1/v1",
+        "digitised/b2/v1",
+    ]
+
+    # This lets benchmarks/replay.py check every request went to one worker.
+    assert resp.headers["X-Bag-Browser-Worker"].isdigit()
+
+    resp = client.get("/spaces/digitised/get_bags_page?prefix=b&page=2")
+    assert resp.json == {"bags": []}
+
+
+def test_streams_the_page_then_the_totals(client):
+    resp = client.get("/spaces/digitised/stream_bags_data?prefix=b")
+
+    assert resp.mimetype == "text/event-stream"
+    assert resp.headers["X-Accel-Buffering"] == "no"
+
+    events = [
+        event.split("\n")
+        for event in resp.get_data(as_text=True).split("\n\n")
+        if event
+    ]
+    assert [name for name, _ in events] == ["event: page", "event: totals"]
+
+    page = json.loads(events[0][1].split("data: ", 1)[1])
+    assert [bag["id"] for bag in page["bags"]] == ["digitised/b1/v1", "digitised/b2/v1"]
+
+    totals = json.loads(events[1][1].split("data: ", 1)[1])
+    assert totals["total"] == 2
+    assert totals["file_ext_tally"] == {".xml": 2, ".jp2": 2}
+
+
+def test_the_space_page_doesnt_wait_for_the_totals(client, app_db):
+    resp = client.get("/spaces/digitised?prefix=b")
+
+    # The browser shows the "next page" link once it has the first page.
+    assert 'class="next_page hidden"' in resp.get_data(as_text=True)
+
+    # We haven't run any queries.
+    assert "bag_browser_query_statement_seconds_count" not in app_db.metrics.render()
+
+
+def test_can_get_a_date_histogram(client):
+    resp = client.get("/spaces/digitised/get_date_histogram?interval=month")
+
+    assert resp.json == {
+        "interval": "month",
+        "periods": [
+            {"period": "2020-01", "bag_count": 1, "total_file_size": 100},
+            {"period": "2020-02", "bag_count": 1, "total_file_size": 100},
+            {"period": "2021-01", "bag_count": 1, "total_file_size": 100},
+        ],
+    }
+
+
+def test_a_date_histogram_needs_a_known_interval(client):
+    resp = client.get("/spaces/digitised/get_date_histogram?interval=fortnight")
+
+    assert resp.status_code == 400
+
+
+def test_can_get_a_size_distribution(client):
+    resp = client.get("/spaces/digitised/get_size_distribution?prefix=b")
+
+    # These bags were stored without a size sketch.
+    assert resp.json["bags_without_sizes"] == 2
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/spaces/digitised/get_bags_data?created_after=2021-01",
+        "/spaces/digitised/get_bags_page?created_before=yesterday",
+        "/spaces/digitised/get_size_distribution?created_after=2021-01",
+        "/spaces/digitised?created_after=2002-01-01&created_before=2001-01-01",
+    ],
+)
+def test_a_query_with_bad_dates_is_a_bad_request(client, path):
+    resp = client.get(path)
+
+    assert resp.status_code == 400
+    assert "error" in resp.json
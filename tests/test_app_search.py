@@ -0,0 +1,56 @@
+import pytest
+
+from src.models import Bag, BagIdentifier
+
+
+@pytest.fixture
+def app_db(app_db):
+    with app_db.bulk_store_bags() as bulk_helper:
+        for space, external_identifier in [
+            ("digitised", "b1"),
+            ("digitised", "b2"),
+            ("born-digital", "b3"),
+            ("archives", "b4"),
+        ]:
+            bulk_helper.store_bag(
+                Bag(
+                    identifier=BagIdentifier(
+                        space=space, external_identifier=external_identifier, version=1
+                    ),
+                    created_date="2020-01-01T01:01:01.000000Z",
+                    file_count=1,
+                    total_file_size=100,
+                    file_ext_tally={".xml": 1},
+                )
+            )
+
+    return app_db
+
+
+def test_can_search_every_space(client):
+    result = client.get("/search/get_bags_data?prefix=b").json
+
+    assert result["total"] == 4
+    assert result["file_ext_tally"] == {".xml": 4}
+    assert [bag["id"] for bag in result["bags"]] == [
+        "archives/b4/v1",
+        "born-digital/b3/v1",
+        "digitised/b1/v1",
+        "digitised/b2/v1",
+    ]
+
+
+def test_can_search_some_spaces(client):
+    result = client.get("/search/get_bags_data?spaces=digitised,archives").json
+
+    assert result["total"] == 3
+    assert [bag["id"] for bag in result["bags"]] == [
+        "archives/b4/v1",
+        "digitised/b1/v1",
+        "digitised/b2/v1",
+    ]
+
+
+def test_can_only_page_so_far(client):
+    assert client.get("/search/get_bags_data?page=40").status_code == 200
+    assert client.get("/search/get_bags_data?page=100000").status_code == 400
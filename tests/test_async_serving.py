@@ -0,0 +1,208 @@
+"""
+Check that under gevent, long-running ZIP downloads don't stop the app
+from answering queries.
+
+We run the app in a subprocess (gevent has to monkey-patch the standard
+library before anything else is imported), with S3 and DynamoDB mocked
+by moto, start lots of downloads that read very slowly, and check that
+a query still comes back quickly.
+"""
+
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import zipfile
+
+import pytest
+
+from src.database import BagsDatabase
+from src.models import Bag
+
+
+pytest.importorskip("gevent")
+
+
+FILE_COUNT = 4
+FILE_SIZE = 1024 * 1024
+CONCURRENT_DOWNLOADS = 20
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STORAGE_MANIFEST = {
+    "space": "digitised",
+    "info": {"externalIdentifier": "b1"},
+    "version": 1,
+    "createdDate": "2020-01-01T01:01:01.000000Z",
+    "manifest": {
+        "files": [
+            {
+                "name": f"data/file_{i}.bin",
+                "path": f"v1/data/file_{i}.bin",
+                "size": FILE_SIZE,
+            }
+            for i in range(FILE_COUNT)
+        ]
+    },
+    "tagManifest": {"files": []},
+    "location": {"prefix": {"namespace": "bags", "path": "digitised/b1"}},
+}
+
+
+def serve(port, database):  # pragma: no cover
+    """
+    Runs in the subprocess: mock S3/DynamoDB with a single bag, then serve
+    the app with gevent, the same way a gunicorn gevent worker would.
+    """
+    from gevent import monkey
+
+    monkey.patch_all()
+
+    import boto3
+    from gevent.pywsgi import WSGIServer
+    from moto import mock_dynamodb2, mock_s3
+
+    with mock_s3(), mock_dynamodb2():
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket="bags")
+
+        for bag_file in STORAGE_MANIFEST["manifest"]["files"]:
+            s3.put_object(
+                Bucket="bags",
+                Key=f"digitised/b1/{bag_file['path']}",
+                Body=b"x" * FILE_SIZE,
+            )
+
+        s3.put_object(
+            Bucket="bags", Key="manifests/b1.json", Body=json.dumps(STORAGE_MANIFEST)
+        )
+
+        dynamodb = boto3.resource("dynamodb")
+        dynamodb.create_table(
+            AttributeDefinitions=[
+                {"AttributeName": "id", "AttributeType": "S"},
+                {"AttributeName": "version", "AttributeType": "N"},
+            ],
+            TableName="vhs-storage-manifests",
+            KeySchema=[
+                {"AttributeName": "id", "KeyType": "HASH"},
+                {"AttributeName": "version", "KeyType": "RANGE"},
+            ],
+        )
+        dynamodb.Table("vhs-storage-manifests").put_item(
+            Item={
+                "id": "digitised/b1",
+                "version": 1,
+                "payload": {
+                    "typedStoreId": {"namespace": "bags", "path": "manifests/b1.json"}
+                },
+            }
+        )
+
+        os.environ["BAG_BROWSER_DATABASE"] = database
+
+        import app
+
+        WSGIServer(("127.0.0.1", port), app.app, log=None).serve_forever()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _is_up(base_url):
+    try:
+        urllib.request.urlopen(base_url + "/metrics", timeout=1).read()
+        return True
+    except OSError:
+        return False
+
+
+@pytest.fixture
+def server(tmpdir):
+    database = str(tmpdir / "bags.db")
+    bags_db = BagsDatabase.from_path(database)
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(Bag.from_storage_manifest(STORAGE_MANIFEST))
+
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, __file__, str(port), database],
+        cwd=REPO_ROOT,
+        env={**os.environ, "PYTHONPATH": REPO_ROOT},
+    )
+
+    base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        deadline = time.time() + 30
+        while not _is_up(base_url):
+            assert proc.poll() is None, "The server exited"
+            assert time.time() < deadline, "The server didn't start"
+            time.sleep(0.1)
+
+        yield base_url
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_queries_are_fast_during_many_slow_downloads(server):
+    release = threading.Event()
+    started = threading.Barrier(CONCURRENT_DOWNLOADS + 1, timeout=30)
+    downloads = [None] * CONCURRENT_DOWNLOADS
+
+    def download(i):
+        url = server + "/bags/digitised/b1/v1/files"
+        with urllib.request.urlopen(url, timeout=60) as resp:
+            # Read the start of the ZIP, then stall like a slow client --
+            # this leaves the server mid-way through the stream.
+            body = resp.read(1024)
+            started.wait()
+            release.wait(timeout=60)
+
+            body += resp.read()
+            downloads[i] = (int(resp.headers["Content-Length"]), body)
+
+    threads = [
+        threading.Thread(target=download, args=(i,))
+        for i in range(CONCURRENT_DOWNLOADS)
+    ]
+    for t in threads:
+        t.start()
+
+    try:
+        started.wait()
+
+        start = time.perf_counter()
+        with urllib.request.urlopen(
+            server + "/spaces/digitised/get_bags_data?prefix=b", timeout=10
+        ) as resp:
+            result = json.load(resp)
+        elapsed = time.perf_counter() - start
+    finally:
+        release.set()
+        for t in threads:
+            t.join()
+
+    assert result["total"] == 1
+    assert result["total_bags"] == "1"
+    assert elapsed < 2
+
+    for content_length, body in downloads:
+        assert len(body) == content_length
+
+        with zipfile.ZipFile(io.BytesIO(body)) as zf:
+            assert len(zf.namelist()) == FILE_COUNT
+            assert zf.read("data/file_0.bin") == b"x" * FILE_SIZE
+
+
+if __name__ == "__main__":  # pragma: no cover
+    serve(port=int(sys.argv[1]), database=sys.argv[2])
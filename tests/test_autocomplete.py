@@ -0,0 +1,53 @@
+import sys
+
+import pytest
+
+from src.autocomplete import IdentifierIndex
+
+
+@pytest.fixture
+def index():
+    return IdentifierIndex(
+        identifiers=["b13x", "b12", "b1", "b2", "a", "b13", "PP/MON/1", "PP/MON/2"]
+    )
+
+
+def test_completes_a_prefix(index):
+    assert index.complete("b1") == {
+        "prefix": "b1",
+        "total": 4,
+        "identifiers": ["b1", "b12", "b13", "b13x"],
+        "next_characters": {"2": 1, "3": 2},
+    }
+
+
+def test_empty_prefix_matches_everything(index):
+    result = index.complete("")
+
+    assert result["total"] == 8
+    assert result["next_characters"] == {"P": 2, "a": 1, "b": 5}
+
+
+def test_limits_the_number_of_identifiers(index):
+    result = index.complete("b", limit=2)
+
+    assert result["identifiers"] == ["b1", "b12"]
+    assert result["total"] == 5
+
+
+def test_prefix_with_no_matches(index):
+    assert index.complete("c") == {
+        "prefix": "c",
+        "total": 0,
+        "identifiers": [],
+        "next_characters": {},
+    }
+
+
+def test_handles_the_largest_character():
+    max_char = chr(sys.maxunicode)
+    index = IdentifierIndex(identifiers=["a", "b" + max_char, "b" + max_char + "x"])
+
+    assert index.complete("b")["next_characters"] == {max_char: 2}
+    assert index.complete("b" + max_char)["next_characters"] == {"x": 1}
+    assert index.complete(max_char)["total"] == 0
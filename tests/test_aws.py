@@ -0,0 +1,131 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+from src import aws
+from src.aws import AwsClients
+from src.metrics import MetricsRegistry
+
+
+@pytest.fixture
+def aws_clients():
+    return AwsClients(metrics=MetricsRegistry())
+
+
+class FakeDynamoDBHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1, so the client can keep the connection open between requests.
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+
+        body = json.dumps({"TableNames": []}).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_dynamodb():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeDynamoDBHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_reuses_clients_in_the_same_thread(aws_clients):
+    s3 = aws_clients.client("s3")
+
+    assert aws_clients.client("s3") is s3
+    assert aws_clients.client("dynamodb") is not s3
+
+    assert aws_clients._clients_created.value(service="s3") == 1
+    assert aws_clients._client_reuses.value(service="s3") == 1
+
+
+def test_creates_separate_clients_in_each_thread(aws_clients):
+    clients = []
+
+    for _ in range(2):
+        thread = threading.Thread(
+            target=lambda: clients.append(aws_clients.client("s3"))
+        )
+        thread.start()
+        thread.join()
+
+    assert clients[0] is not clients[1]
+
+
+def test_reuses_resources(aws_clients):
+    dynamodb = aws_clients.resource("dynamodb")
+
+    assert aws_clients.resource("dynamodb") is dynamodb
+    assert aws_clients.client("dynamodb") is not dynamodb.meta.client
+
+
+def test_configures_clients():
+    aws_clients = AwsClients(
+        max_pool_connections=25,
+        max_attempts=3,
+        connect_timeout=1,
+        read_timeout=2,
+        metrics=MetricsRegistry(),
+    )
+
+    config = aws_clients.client("s3").meta.config
+
+    assert config.max_pool_connections == 25
+    assert config.retries == {"mode": "adaptive", "total_max_attempts": 3}
+    assert config.connect_timeout == 1
+    assert config.read_timeout == 2
+
+
+def test_creates_new_clients_after_a_fork(aws_clients, monkeypatch):
+    s3 = aws_clients.client("s3")
+
+    monkeypatch.setattr(aws.os, "getpid", lambda: -1)
+
+    assert aws_clients.client("s3") is not s3
+
+
+def test_uses_an_os_thread_local_under_gevent(monkeypatch):
+    pytest.importorskip("gevent")
+    from gevent.local import local as greenlet_local
+
+    monkeypatch.setattr(aws, "gevent_is_active", lambda: True)
+
+    # If every greenlet had its own clients, we'd create clients for every
+    # request, so we use a thread-local rather than a greenlet-local.
+    aws_clients = AwsClients(metrics=MetricsRegistry())
+
+    assert isinstance(aws_clients._local, threading.local)
+    assert not isinstance(aws_clients._local, greenlet_local)
+
+
+def test_counts_requests_and_connections(aws_clients, fake_dynamodb):
+    dynamodb = aws_clients.client(
+        "dynamodb",
+        endpoint_url=fake_dynamodb,
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+    )
+
+    for _ in range(3):
+        dynamodb.list_tables()
+
+    assert aws_clients._requests.value(service="dynamodb") == 3
+    assert aws_clients.stats() == {
+        "dynamodb": {"clients": 1, "requests": 3, "connections": 1}
+    }
@@ -4,6 +4,7 @@ import pytest
 
 from src.database import BagsDatabase, SqliteDatabase
 from src.models import Bag, BagIdentifier
+from src.query import QueryContext
 
 
 def test_creates_tables(db):
@@ -14,7 +15,7 @@ def test_creates_tables(db):
         names = {res[0] for res in cursor.fetchall()}
 
         assert "bags" in names
-        assert "file_extensions" in names
+        assert "bag_extensions" in names
 
 
 def test_table_creation_is_idempotent(db):
@@ -87,3 +88,217 @@ def test_can_store_bags_in_database(db):
 
     assert bag_ids == {"example/1234/v1", "example/1234/v2"}
     assert bags_db.get_known_ids() == bag_ids
+
+
+def test_read_only_database_does_not_create_tables(db):
+    with db.cursor() as cursor:
+        cursor.execute("CREATE TABLE words (word TEXT PRIMARY KEY)")
+
+    BagsDatabase(db, read_only=True)
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        names = {res[0] for res in cursor.fetchall()}
+
+    assert names == {"words"}
+
+
+def test_stores_created_timestamp(db):
+    bags_db = BagsDatabase(db)
+
+    bag = Bag(
+        identifier=BagIdentifier(
+            space="example", external_identifier="1234", version=1
+        ),
+        created_date="2020-01-01T01:01:01.000000Z",
+        file_count=4,
+        total_file_size=4,
+        file_ext_tally={".xml": 4},
+    )
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(bag)
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT created_timestamp FROM bags")
+        assert cursor.fetchall() == [(1577840461,)]
+
+        cursor.execute("SELECT max_file_size FROM bags")
+        assert cursor.fetchall() == [(None,)]
+
+
+def test_adds_created_timestamp_to_existing_database(db):
+    # This is the schema of the bags table before we added
+    # the created_timestamp column.
+    with db.cursor() as cursor:
+        cursor.execute(
+            """CREATE TABLE bags
+            (
+                id TEXT PRIMARY KEY,
+                space TEXT,
+                external_identifier TEXT,
+                version INTEGER,
+                created_date TEXT,
+                file_count INTEGER,
+                total_file_size INTEGER
+            )"""
+        )
+        cursor.execute(
+            """INSERT INTO bags VALUES
+            ('example/1234/v1', 'example', '1234', 1, '2020-01-01T01:01:01.000000Z', 1, 1)"""
+        )
+
+    BagsDatabase(db)
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT created_timestamp FROM bags")
+        assert cursor.fetchall() == [(1577840461,)]
+
+        cursor.execute("SELECT max_file_size FROM bags")
+        assert cursor.fetchall() == [(None,)]
+
+
+def test_moves_file_extensions_into_bag_extensions(db):
+    # This is how we stored file extension tallies before we had the
+    # bag_extensions table.
+    with db.cursor() as cursor:
+        cursor.execute(
+            """CREATE TABLE bags
+            (
+                id TEXT PRIMARY KEY,
+                space TEXT,
+                external_identifier TEXT,
+                version INTEGER,
+                created_date TEXT,
+                file_count INTEGER,
+                total_file_size INTEGER
+            )"""
+        )
+        cursor.execute(
+            """CREATE TABLE file_extensions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bag_id TEXT,
+                extension TEXT,
+                count INTEGER,
+                CONSTRAINT fk_storage_key
+                    FOREIGN KEY (bag_id)
+                    REFERENCES bags(id),
+                UNIQUE (bag_id, extension)
+            )"""
+        )
+        cursor.execute(
+            """INSERT INTO bags VALUES
+            ('example/1234/v1', 'example', '1234', 1, '2020-01-01T01:01:01.000000Z', 3, 3),
+            ('example/5678/v1', 'example', '5678', 1, '2020-01-01T01:01:01.000000Z', 3, 3)"""
+        )
+        cursor.execute(
+            """INSERT INTO file_extensions(bag_id, extension, count) VALUES
+            ('example/1234/v1', '.xml', 1),
+            ('example/1234/v1', '.XML', 2),
+            ('example/5678/v1', '.xml', 2),
+            ('example/5678/v1', '.jp2', 1)"""
+        )
+
+    bags_db = BagsDatabase(db, prefix_bucket_depth=None)
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        assert "file_extensions" not in {res[0] for res in cursor.fetchall()}
+
+    result = bags_db.query(QueryContext(space="example", external_identifier_prefix=""))
+    assert result.file_ext_tally == {".xml": 3, ".XML": 2, ".jp2": 1}
+
+    # Bags we store after the migration use the same extension IDs.
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(
+            Bag(
+                identifier=BagIdentifier(
+                    space="example", external_identifier="9999", version=1
+                ),
+                created_date="2020-01-01T01:01:01.000000Z",
+                file_count=1,
+                total_file_size=1,
+                file_ext_tally={".jp2": 1},
+            )
+        )
+
+    bags_db._make_query.cache_clear()
+    result = bags_db.query(QueryContext(space="example", external_identifier_prefix=""))
+    assert result.file_ext_tally == {".xml": 3, ".XML": 2, ".jp2": 2}
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM extensions")
+        assert cursor.fetchone() == (3,)
+
+
+def test_gives_bags_an_explicit_bag_key(db):
+    # Before we had the bag_key column, the other tables referred to bags
+    # by their implicit rowid, which VACUUM may renumber.
+    with db.cursor() as cursor:
+        cursor.execute(
+            """CREATE TABLE bags
+            (
+                id TEXT PRIMARY KEY,
+                space TEXT,
+                external_identifier TEXT,
+                version INTEGER,
+                created_date TEXT,
+                file_count INTEGER,
+                total_file_size INTEGER,
+                created_timestamp INTEGER,
+                max_file_size INTEGER
+            )"""
+        )
+        cursor.execute(
+            """CREATE TABLE extensions (
+                id INTEGER PRIMARY KEY,
+                extension TEXT UNIQUE
+            )"""
+        )
+        cursor.execute(
+            """CREATE TABLE bag_extensions (
+                bag_key INTEGER,
+                ext_id INTEGER,
+                count INTEGER,
+                PRIMARY KEY (bag_key, ext_id)
+            ) WITHOUT ROWID"""
+        )
+        cursor.execute(
+            """INSERT INTO bags VALUES
+            ('example/1/v1', 'example', '1', 1, '2020-01-01T01:01:01.000000Z', 1, 1, 1577840461, NULL),
+            ('example/2/v1', 'example', '2', 1, '2020-01-01T01:01:01.000000Z', 1, 1, 1577840461, NULL),
+            ('example/3/v1', 'example', '3', 1, '2020-01-01T01:01:01.000000Z', 2, 2, 1577840461, NULL)"""
+        )
+        cursor.execute("INSERT INTO extensions VALUES (1, '.xml'), (2, '.jp2')")
+        cursor.execute(
+            """INSERT INTO bag_extensions
+            SELECT rowid, CASE WHEN id = 'example/1/v1' THEN 1 ELSE 2 END, file_count
+            FROM bags"""
+        )
+
+        # Leave a gap in the rowids, which is what VACUUM might close up.
+        cursor.execute("DELETE FROM bags WHERE id = 'example/2/v1'")
+        cursor.execute("DELETE FROM bag_extensions WHERE bag_key = 2")
+
+    bags_db = BagsDatabase(db, prefix_bucket_depth=None)
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT bag_key, id FROM bags ORDER BY bag_key")
+        assert cursor.fetchall() == [(1, "example/1/v1"), (3, "example/3/v1")]
+
+    with db.conn_cursor() as (conn, cursor):
+        conn.commit()
+        cursor.execute("VACUUM")
+
+    result = bags_db.query(
+        QueryContext(space="example", external_identifier_prefix="3")
+    )
+    assert result.file_ext_tally == {".jp2": 2}
+
+    # Rebuilding the table dropped its indexes, so they were created again.
+    with db.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE tbl_name='bags'")
+        assert {res[0] for res in cursor.fetchall()} >= {
+            "bags_by_created_timestamp",
+            "bags_by_identifier",
+        }
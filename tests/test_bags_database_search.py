@@ -1,8 +1,15 @@
+import sqlite3
+
+import attr
 import pytest
 
+from src import database
 from src.database import BagsDatabase
+from src.metrics import MetricsRegistry
 from src.models import Bag, BagIdentifier
 from src.query import QueryContext, QueryResult
+from src.sketch import SizeSketch
+from src.zip_layout import ZipLayout
 
 
 bag1 = Bag(
@@ -129,3 +136,685 @@ def test_can_find_exact_identifier_match(db):
     assert result.total_file_count == 30
     assert result.file_ext_tally == {".xml": 15, ".jpg": 15}
     assert len(result.bags) == 15
+
+
+def test_records_cache_hits_and_misses(db):
+    registry = MetricsRegistry()
+    bags_db = BagsDatabase(db, metrics=registry, prefix_bucket_depth=None)
+
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+
+    bags_db.query(query_context)
+    bags_db.query(query_context)
+
+    lookups = registry.counter("bag_browser_query_cache_lookups_total", "")
+    assert lookups.value(result="miss") == 1
+    assert lookups.value(result="hit") == 1
+
+    latency = registry.histogram("bag_browser_query_statement_seconds", "")
+    for statement in ("count", "tally", "bags"):
+        assert latency.count(statement=statement) == 1
+
+    assert "bag_browser_query_rows_scanned_count 1" in registry.render()
+
+
+def test_captures_query_plan_of_slow_queries(bags_db):
+    bags_db.metrics = MetricsRegistry()
+    bags_db.slow_query_threshold = 0
+
+    # This prefix is too long to be answered from the prefix buckets
+    query_context = QueryContext(space="digitised", external_identifier_prefix="b1234")
+    bags_db.query(query_context)
+
+    assert [sq.statement for sq in bags_db.slow_queries] == ["count", "tally", "bags"]
+    assert all(sq.query_plan for sq in bags_db.slow_queries)
+    assert all(sq.elapsed >= 0 for sq in bags_db.slow_queries)
+
+
+def test_does_not_capture_query_plans_by_default(bags_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="b")
+    bags_db.query(query_context)
+
+    assert len(bags_db.slow_queries) == 0
+
+
+def test_spaces_are_refreshed_when_the_database_changes(bags_db):
+    assert bags_db.get_spaces() == {"digitised": 2, "born-digital": 1}
+
+    bag4 = attr.evolve(
+        bag1,
+        identifier=BagIdentifier(
+            space="testing", external_identifier="b1234", version=1
+        ),
+    )
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(bag4)
+
+    assert bags_db.get_spaces() == {"digitised": 2, "born-digital": 1, "testing": 1}
+
+
+def test_cached_spaces_cannot_be_modified(bags_db):
+    bags_db.get_spaces()["digitised"] = 100
+
+    assert bags_db.get_spaces() == {"digitised": 2, "born-digital": 1}
+
+
+@pytest.mark.parametrize(
+    "created_after, created_before, expected_ids",
+    [
+        ("2001-01-01", "2001-01-01", {bag1.id}),
+        ("2001-01-02", "", {bag2.id}),
+        ("", "2001-12-31", {bag1.id}),
+        ("", "2002-01-01", {bag1.id, bag2.id}),
+        ("2002-01-02", "", set()),
+    ],
+)
+def test_can_filter_by_created_date(bags_db, created_after, created_before, expected_ids):
+    query_context = QueryContext(
+        space="digitised",
+        external_identifier_prefix="",
+        created_after=created_after,
+        created_before=created_before,
+    )
+
+    result = bags_db.query(query_context)
+
+    assert {bag.id for bag in result.bags} == expected_ids
+    assert result.total_count == len(expected_ids)
+
+
+def test_bags_from_query_have_created_timestamp(bags_db):
+    query_context = QueryContext(space="born-digital", external_identifier_prefix="")
+
+    result = bags_db.query(query_context)
+
+    assert result.bags[0].created_timestamp == bag3.created_timestamp
+
+
+def test_can_get_date_histogram(bags_db):
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(
+            Bag(
+                identifier=BagIdentifier(
+                    space="digitised", external_identifier="b1235", version=2
+                ),
+                created_date="2002-01-01T23:59:59.000000Z",
+                file_count=3,
+                total_file_size=400,
+                file_ext_tally={".xml": 2, ".jp2": 1},
+            )
+        )
+
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+
+    assert bags_db.date_histogram(query_context) == [
+        {"period": "2001-01-01", "bag_count": 1, "total_file_size": 1100},
+        {"period": "2002-01-01", "bag_count": 2, "total_file_size": 800},
+    ]
+
+
+def test_can_get_monthly_date_histogram(bags_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="b1")
+
+    assert bags_db.date_histogram(query_context, interval="month") == [
+        {"period": "2001-01", "bag_count": 1, "total_file_size": 1100},
+        {"period": "2002-01", "bag_count": 1, "total_file_size": 400},
+    ]
+
+
+def test_unrecognised_histogram_interval_is_error(bags_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+
+    with pytest.raises(ValueError, match="Unrecognised interval"):
+        bags_db.date_histogram(query_context, interval="fortnight")
+
+
+def test_can_get_size_distribution(db):
+    bags_db = BagsDatabase(db)
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(
+            attr.evolve(bag1, size_sketch=SizeSketch.from_sizes([100] * 10 + [1000]))
+        )
+        bulk_helper.store_bag(
+            attr.evolve(bag2, size_sketch=SizeSketch.from_sizes([100, 100, 50000]))
+        )
+        bulk_helper.store_bag(bag3)
+        bulk_helper.store_bag(
+            Bag(
+                identifier=BagIdentifier(
+                    space="digitised", external_identifier="c1", version=1
+                ),
+                created_date="2002-01-01T01:01:01.000000Z",
+                file_count=1,
+                total_file_size=10 ** 9,
+                file_ext_tally={".mp4": 1},
+                size_sketch=SizeSketch.from_sizes([10 ** 9]),
+            )
+        )
+
+    distribution = bags_db.size_distribution(
+        QueryContext(space="digitised", external_identifier_prefix="b")
+    )
+
+    assert distribution["file_count"] == 14
+    assert distribution["max"] == 50000
+    assert distribution["bags_without_sizes"] == 0
+    assert abs(distribution["median"] - 100) <= 10
+    assert abs(distribution["p90"] - 1000) <= 100
+    assert abs(distribution["p99"] - 50000) <= 5000
+
+    # Bags without a sketch are counted, but don't contribute any files
+    assert bags_db.size_distribution(
+        QueryContext(space="born-digital", external_identifier_prefix="")
+    ) == {
+        "file_count": 0,
+        "median": None,
+        "p90": None,
+        "p99": None,
+        "max": None,
+        "bags_without_sizes": 1,
+    }
+
+
+def test_size_distribution_respects_date_filters(db):
+    bags_db = BagsDatabase(db)
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(attr.evolve(bag1, size_sketch=SizeSketch.from_sizes([10])))
+        bulk_helper.store_bag(attr.evolve(bag2, size_sketch=SizeSketch.from_sizes([20, 20])))
+
+    distribution = bags_db.size_distribution(
+        QueryContext(
+            space="digitised",
+            external_identifier_prefix="",
+            created_after="2002-01-01",
+        )
+    )
+
+    assert distribution["file_count"] == 2
+    assert distribution["max"] == 20
+
+
+def test_can_get_page_without_totals(bags_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="b1")
+
+    assert bags_db.query_page(query_context) == bags_db.query(query_context).bags
+
+
+def test_page_has_bag_summaries(bags_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="b1234")
+
+    (summary,) = bags_db.query_page(query_context)
+
+    assert summary.identifier == bag1.identifier
+    assert summary.id == bag1.id
+    assert summary.created_date == bag1.created_date
+    assert summary.created_timestamp == bag1.created_timestamp
+    assert summary.file_count == bag1.file_count
+    assert summary.total_file_size == bag1.total_file_size
+
+
+def test_page_sorts_versions_numerically(db):
+    bags_db = BagsDatabase(db)
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        for version in (1, 2, 10, 11):
+            bulk_helper.store_bag(
+                attr.evolve(
+                    bag1,
+                    identifier=BagIdentifier(
+                        space="digitised", external_identifier="b1234", version=version
+                    ),
+                )
+            )
+
+    query_context = QueryContext(
+        space="digitised", external_identifier_prefix="", page=1, page_size=3
+    )
+
+    assert [bag.version for bag in bags_db.query_page(query_context)] == [1, 2, 10]
+
+
+def test_estimate_is_exact_for_small_queries(bags_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+
+    estimate = bags_db.estimate_totals(query_context)
+    result = bags_db.query(query_context)
+
+    assert estimate.is_exact
+    assert estimate.total_count == result.total_count
+    assert estimate.total_file_count == result.total_file_count
+    assert estimate.total_file_size == result.total_file_size
+    assert estimate.file_ext_tally == result.file_ext_tally
+    assert estimate.total_file_count_error == 0
+    assert estimate.file_ext_tally_error == {".xml": 0, ".jp2": 0}
+
+
+def test_can_estimate_totals_from_a_sample(db):
+    bags_db = BagsDatabase(db, prefix_bucket_depth=None)
+
+    with bags_db.bulk_store_bags(commit_every=100) as bulk_helper:
+        for i in range(1000):
+            bulk_helper.store_bag(
+                Bag(
+                    identifier=BagIdentifier(
+                        space="digitised",
+                        external_identifier=f"b{i:04d}",
+                        version=1,
+                    ),
+                    created_date="2001-01-01T01:01:01.000000Z",
+                    file_count=i % 10 + 1,
+                    total_file_size=100 * (i % 10 + 1),
+                    file_ext_tally={".jp2": i % 10, ".xml": 1},
+                )
+            )
+
+    query_context = QueryContext(space="digitised", external_identifier_prefix="b")
+
+    estimate = bags_db.estimate_totals(query_context, sample_size=200)
+    result = bags_db.query(query_context)
+
+    assert not estimate.is_exact
+    assert estimate.total_count == 1000
+    assert 100 <= estimate.sample_size <= 300
+
+    assert (
+        abs(estimate.total_file_count - result.total_file_count)
+        <= estimate.total_file_count_error
+    )
+    assert (
+        abs(estimate.total_file_size - result.total_file_size)
+        <= estimate.total_file_size_error
+    )
+    assert (
+        abs(estimate.file_ext_tally[".jp2"] - result.file_ext_tally[".jp2"])
+        <= estimate.file_ext_tally_error[".jp2"]
+    )
+
+    # Every bag has exactly one XML file, so there's no uncertainty
+    assert estimate.file_ext_tally[".xml"] == 1000
+    assert estimate.file_ext_tally_error[".xml"] == 0
+
+    # The sample is deterministic, so we get the same estimate every time
+    bags_db._make_estimate.cache_clear()
+    assert bags_db.estimate_totals(query_context, sample_size=200) == estimate
+
+
+def test_can_estimate_totals_with_no_matches(bags_db):
+    estimate = bags_db.estimate_totals(
+        QueryContext(space="digitised", external_identifier_prefix="nothing")
+    )
+
+    assert estimate.is_exact
+    assert estimate.total_count == 0
+    assert estimate.total_file_count == 0
+    assert estimate.file_ext_tally == {}
+
+
+def test_can_autocomplete_identifiers(bags_db):
+    assert bags_db.autocomplete("digitised", prefix="b12") == {
+        "prefix": "b12",
+        "total": 2,
+        "identifiers": ["b1234", "b1235"],
+        "next_characters": {"3": 2},
+    }
+
+    # New bags are picked up when the database changes
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(
+            attr.evolve(
+                bag1,
+                identifier=BagIdentifier(
+                    space="digitised", external_identifier="b1299", version=1
+                ),
+            )
+        )
+
+    assert bags_db.autocomplete("digitised", prefix="b12", limit=1) == {
+        "prefix": "b12",
+        "total": 3,
+        "identifiers": ["b1234"],
+        "next_characters": {"3": 2, "9": 1},
+    }
+
+
+def test_can_iterate_over_all_matching_bags(db):
+    bags_db = BagsDatabase(db)
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        for version in range(1, 16):
+            bulk_helper.store_bag(
+                attr.evolve(
+                    bag1,
+                    identifier=BagIdentifier(
+                        space="digitised", external_identifier="b1234", version=version
+                    ),
+                )
+            )
+        bulk_helper.store_bag(bag3)
+
+    query_context = QueryContext(space="digitised", external_identifier_prefix="b1", page=2, page_size=2)
+
+    bags = list(bags_db.iter_bags(query_context, chunk_size=4))
+
+    # The page is ignored, and the bags are sorted by numeric version
+    assert [bag.version for bag in bags] == list(range(1, 16))
+    assert bags[0].created_timestamp == bag1.created_timestamp
+
+
+def test_closes_the_database_if_we_stop_iterating_early(db, monkeypatch):
+    bags_db = BagsDatabase(db)
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(bag1)
+        bulk_helper.store_bag(bag2)
+
+    connections = []
+    original_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        connections.append(original_connect(*args, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(database.sqlite3, "connect", connect)
+
+    bags = bags_db.iter_bags(
+        QueryContext(space="digitised", external_identifier_prefix=""), chunk_size=1
+    )
+    next(bags)
+    bags.close()
+
+    assert len(connections) == 1
+
+    with pytest.raises(sqlite3.ProgrammingError, match="closed database"):
+        connections[0].execute("SELECT 1")
+
+
+def test_can_get_zip_layout(db):
+    bags_db = BagsDatabase(db)
+
+    layout1 = ZipLayout.from_files([("digitised/b1234/v1/bagit.txt", 10)])
+    layout2 = ZipLayout.from_files([("digitised/b1235/v1/data/b1235.xml", 20)] * 2)
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(attr.evolve(bag1, zip_layout=layout1))
+        bulk_helper.store_bag(attr.evolve(bag2, zip_layout=layout2))
+        bulk_helper.store_bag(bag3)
+
+    assert (
+        bags_db.zip_layout(
+            QueryContext(space="digitised", external_identifier_prefix="b")
+        )
+        == layout1 + layout2
+    )
+    assert bags_db.zip_layout(
+        QueryContext(
+            space="digitised",
+            external_identifier_prefix="b",
+            created_after="2002-01-01",
+        )
+    ) == layout2
+
+    # If we don't know the layout of one of the bags, we can't tell how
+    # big the ZIP will be.
+    assert (
+        bags_db.zip_layout(
+            QueryContext(space="born-digital", external_identifier_prefix="")
+        )
+        is None
+    )
+
+    # An empty ZIP is still a ZIP
+    assert bags_db.zip_layout(
+        QueryContext(space="digitised", external_identifier_prefix="c")
+    ) == ZipLayout()
+
+
+def test_zip_layout_is_refreshed_when_the_database_changes(db):
+    bags_db = BagsDatabase(db)
+    query_context = QueryContext(space="digitised", external_identifier_prefix="b")
+
+    layout1 = ZipLayout.from_files([("digitised/b1234/v1/bagit.txt", 10)])
+    layout2 = ZipLayout.from_files([("digitised/b1235/v1/bagit.txt", 10)])
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(attr.evolve(bag1, zip_layout=layout1))
+
+    assert bags_db.zip_layout(query_context) == layout1
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(attr.evolve(bag2, zip_layout=layout2))
+
+    assert bags_db.zip_layout(query_context) == layout1 + layout2
+
+
+PREFIX_BUCKET_IDENTIFIERS = [
+    "b1",
+    "b12",
+    "b1234",
+    "b12345",
+    "b12zz",
+    "b12~",
+    "b2",
+    "B1",
+    "LE/MON/1",
+    "éclair",
+    "",
+]
+
+
+def store_prefix_bucket_bags(bags_db):
+    bags = [
+        Bag(
+            identifier=BagIdentifier(
+                space="digitised", external_identifier=external_identifier, version=1
+            ),
+            created_date="2001-01-01T01:01:01.000000Z",
+            file_count=i + 1,
+            total_file_size=100 * (i + 1),
+            file_ext_tally={".jp2": i, ".xml": 1},
+        )
+        for i, external_identifier in enumerate(PREFIX_BUCKET_IDENTIFIERS)
+    ]
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        for bag in bags:
+            bulk_helper.store_bag(bag)
+
+    return bags
+
+
+def expected_totals(bags, prefix):
+    matching_bags = [bag for bag in bags if bag.external_identifier.startswith(prefix)]
+
+    file_ext_tally = {}
+    for bag in matching_bags:
+        for extension, count in bag.file_ext_tally.items():
+            file_ext_tally[extension] = file_ext_tally.get(extension, 0) + count
+
+    return (
+        len(matching_bags),
+        sum(bag.file_count for bag in matching_bags),
+        sum(bag.total_file_size for bag in matching_bags),
+        file_ext_tally,
+    )
+
+
+PREFIXES = ["", "b", "b1", "b12", "b123", "b1234", "b12z", "b12~", "B", "é", "x"]
+
+
+@pytest.mark.parametrize("prefix_bucket_depth", [None, 0, 3, 10])
+@pytest.mark.parametrize("prefix", PREFIXES)
+def test_totals_match_prefix(db, prefix_bucket_depth, prefix):
+    bags_db = BagsDatabase(db, prefix_bucket_depth=prefix_bucket_depth)
+    bags = store_prefix_bucket_bags(bags_db)
+
+    query_context = QueryContext(space="digitised", external_identifier_prefix=prefix)
+    result = bags_db.query(query_context)
+
+    assert (
+        result.total_count,
+        result.total_file_count,
+        result.total_file_size,
+        result.file_ext_tally,
+    ) == expected_totals(bags, prefix)
+    assert sorted(bag.external_identifier for bag in result.bags) == sorted(
+        bag.external_identifier
+        for bag in bags
+        if bag.external_identifier.startswith(prefix)
+    )
+
+
+def test_short_prefixes_are_answered_from_buckets(db):
+    registry = MetricsRegistry()
+    bags_db = BagsDatabase(db, metrics=registry, prefix_bucket_depth=2)
+    bags = store_prefix_bucket_bags(bags_db)
+
+    latency = registry.histogram("bag_browser_query_statement_seconds", "")
+
+    bags_db.query(QueryContext(space="digitised", external_identifier_prefix="b1"))
+    assert latency.count(statement="prefix_totals") == 1
+    assert latency.count(statement="count") == 0
+
+    # The estimate is exact if we can read it from the buckets
+    estimate = bags_db.estimate_totals(
+        QueryContext(space="digitised", external_identifier_prefix="b")
+    )
+    assert estimate.is_exact
+    assert estimate.total_file_size == expected_totals(bags, "b")[2]
+    assert estimate.file_ext_tally_error == {".jp2": 0, ".xml": 0}
+
+    # A longer prefix, or a date filter, means adding up the bags
+    bags_db.query(QueryContext(space="digitised", external_identifier_prefix="b12"))
+    bags_db.query(
+        QueryContext(
+            space="digitised",
+            external_identifier_prefix="b",
+            created_after="2000-01-01",
+        )
+    )
+    assert latency.count(statement="prefix_totals") == 2
+    assert latency.count(statement="count") == 2
+
+
+def test_prefix_buckets_are_rebuilt_if_the_depth_changes(db):
+    bags = store_prefix_bucket_bags(BagsDatabase(db, prefix_bucket_depth=None))
+
+    # e.g. a database created before we had prefix buckets
+    with db.cursor() as cursor:
+        cursor.execute("DROP TABLE metadata")
+
+    read_only_db = BagsDatabase(db, read_only=True)
+    assert read_only_db.query(
+        QueryContext(space="digitised", external_identifier_prefix="b1")
+    ).total_count == expected_totals(bags, "b1")[0]
+
+    registry = MetricsRegistry()
+    bags_db = BagsDatabase(db, metrics=registry, prefix_bucket_depth=3)
+
+    for prefix in PREFIXES:
+        bags_db._make_query.cache_clear()
+        result = bags_db.query(
+            QueryContext(space="digitised", external_identifier_prefix=prefix)
+        )
+        assert (
+            result.total_count,
+            result.total_file_count,
+            result.total_file_size,
+            result.file_ext_tally,
+        ) == expected_totals(bags, prefix)
+
+    latency = registry.histogram("bag_browser_query_statement_seconds", "")
+    assert latency.count(statement="prefix_totals") == len(
+        [prefix for prefix in PREFIXES if len(prefix) <= 3]
+    )
+
+    # If we turn off the buckets, they're deleted
+    BagsDatabase(db, prefix_bucket_depth=None)
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM prefix_totals")
+        assert cursor.fetchone() == (0,)
+
+
+def query_many_contexts():
+    return [
+        QueryContext(space="digitised", external_identifier_prefix=""),
+        QueryContext(space="born-digital", external_identifier_prefix=""),
+        QueryContext(space="digitised", external_identifier_prefix="b1235"),
+        QueryContext(space="born-digital", external_identifier_prefix="b1235"),
+        QueryContext(
+            space="digitised", external_identifier_prefix="", created_after="2002-01-01"
+        ),
+        QueryContext(
+            space="born-digital",
+            external_identifier_prefix="",
+            created_after="2002-01-01",
+        ),
+        QueryContext(space="missing", external_identifier_prefix=""),
+        QueryContext(
+            space="missing", external_identifier_prefix="", created_after="2002-01-01"
+        ),
+        QueryContext(space="digitised", external_identifier_prefix="", page=2),
+        QueryContext(space="digitised", external_identifier_prefix=""),
+        QueryContext(
+            space="digitised",
+            external_identifier_prefix="b1235",
+            page=2,
+            page_size=0,
+        ),
+    ]
+
+
+@pytest.mark.parametrize("prefix_bucket_depth", [None, 0, 4])
+def test_query_many_matches_query(db, prefix_bucket_depth):
+    bags_db = BagsDatabase(db, prefix_bucket_depth=prefix_bucket_depth)
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        for bag in (bag1, bag2, bag3):
+            bulk_helper.store_bag(bag)
+
+    query_contexts = query_many_contexts()
+
+    assert bags_db.query_many(query_contexts) == [
+        bags_db.query(query_context) for query_context in query_contexts
+    ]
+
+
+def test_query_many_can_skip_the_page_of_bags(bags_db):
+    (result,) = bags_db.query_many(
+        [QueryContext(space="digitised", external_identifier_prefix="", page_size=0)]
+    )
+
+    assert result.total_count == 2
+    assert result.file_ext_tally == {".xml": 7, ".jp2": 7}
+    assert result.bags == []
+
+
+def test_query_many_shares_lookups(db):
+    registry = MetricsRegistry()
+    bags_db = BagsDatabase(db, metrics=registry)
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        for bag in (bag1, bag2, bag3):
+            bulk_helper.store_bag(bag)
+
+    latency = registry.histogram("bag_browser_query_statement_seconds", "")
+
+    bags_db.query_many(query_many_contexts())
+
+    # One lookup in the prefix buckets for every query they can answer, and
+    # we only add up the bags for the rest once, even if they're repeated.
+    assert latency.count(statement="prefix_totals_many") == 1
+    assert latency.count(statement="prefix_tally_many") == 1
+    assert latency.count(statement="prefix_totals") == 0
+    assert latency.count(statement="count") == 5
+
+    # Every query but one asks for a page of bags.
+    assert latency.count(statement="bags") == len(query_many_contexts()) - 1
+
+    # The results are cached.
+    bags_db.query_many(query_many_contexts())
+    assert latency.count(statement="count") == 5
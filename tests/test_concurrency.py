@@ -0,0 +1,52 @@
+import sys
+import threading
+
+import pytest
+
+from src import concurrency
+from src.concurrency import NonBlocking, gevent_is_active, run_blocking
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+
+    def increment(self, amount=1):
+        self.count += amount
+        return threading.get_ident()
+
+
+def test_gevent_is_not_active_in_the_tests():
+    assert not gevent_is_active()
+
+
+def test_gevent_is_not_active_if_not_installed(monkeypatch):
+    monkeypatch.setitem(sys.modules, "gevent", None)
+
+    assert not gevent_is_active()
+
+
+def test_without_gevent_calls_run_directly():
+    counter = Counter()
+
+    assert run_blocking(counter.increment, amount=2) == threading.get_ident()
+    assert counter.count == 2
+
+
+def test_with_gevent_calls_run_in_a_thread_pool(monkeypatch):
+    pytest.importorskip("gevent")
+    monkeypatch.setattr(concurrency, "gevent_is_active", lambda: True)
+
+    counter = Counter()
+
+    assert run_blocking(counter.increment, amount=3) != threading.get_ident()
+    assert counter.count == 3
+
+
+def test_non_blocking_wraps_methods_and_passes_through_attributes():
+    counter = NonBlocking(Counter())
+
+    counter.increment(amount=5)
+
+    assert counter.count == 5
+    assert counter.wrapped.count == 5
@@ -0,0 +1,132 @@
+import io
+import zipfile
+
+import attr
+import boto3
+from moto import mock_s3
+
+from src.downloads import create_multi_bag_zip_stream, create_zip_stream
+from src.models import Bag
+from src.zip_layout import ZipLayout
+
+
+def create_bag_in_s3(s3, bucket_name, file_contents, external_identifier="b1234"):
+    s3.create_bucket(Bucket=bucket_name)
+
+    files = []
+    for name, body in file_contents.items():
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=f"digitised/{external_identifier}/v1/{name}",
+            Body=body,
+        )
+        files.append({"name": name, "path": f"v1/{name}", "size": len(body)})
+
+    storage_manifest = {
+        "space": "digitised",
+        "info": {"externalIdentifier": external_identifier},
+        "version": 1,
+        "createdDate": "2020-01-01T01:01:01.000000Z",
+        "manifest": {"files": files[1:]},
+        "tagManifest": {"files": files[:1]},
+        "location": {
+            "prefix": {
+                "namespace": bucket_name,
+                "path": f"digitised/{external_identifier}",
+            }
+        },
+    }
+
+    return Bag.from_storage_manifest(storage_manifest)
+
+
+@mock_s3
+def test_can_stream_a_bag_as_zip():
+    s3 = boto3.client("s3")
+
+    file_contents = {
+        "bagit.txt": b"BagIt-Version: 0.97",
+        "data/b1234.xml": b"<mets/>",
+        "data/objects/b1234_0001.jp2": b"\x00" * 10000,
+    }
+    bag = create_bag_in_s3(s3, "bag-browser-zip-test", file_contents)
+
+    zs = create_zip_stream(bag, s3=s3)
+    expected_size = zs.size()
+
+    zip_bytes = b"".join(zs.generate())
+    assert len(zip_bytes) == expected_size
+
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+        assert {name: zf.read(name) for name in zf.namelist()} == file_contents
+
+
+@mock_s3
+def test_can_stream_many_bags_as_one_zip():
+    s3 = boto3.client("s3")
+
+    bags = [
+        create_bag_in_s3(
+            s3,
+            "bag-browser-zip-test",
+            file_contents={
+                "bagit.txt": b"BagIt-Version: 0.97",
+                f"data/b{i}.xml": b"<mets/>" * i,
+                f"data/objects/b{i}_0001.jp2": b"\x00" * 1000 * i,
+            },
+            external_identifier=f"b{i}",
+        )
+        for i in range(1, 11)
+    ]
+    bags_by_id = {bag.identifier.id: bag for bag in bags}
+
+    # The bags we get from the database don't have a storage manifest
+    database_bags = (attr.evolve(bag, storage_manifest=None) for bag in bags)
+
+    zs = create_multi_bag_zip_stream(
+        database_bags,
+        get_bag=lambda bag_identifier: bags_by_id[bag_identifier.id],
+        s3=s3,
+        prefetch=2,
+    )
+
+    zip_bytes = b"".join(zs.generate())
+
+    # We can work out the size of the ZIP from the bags, without any manifests
+    layout = sum((bag.zip_layout for bag in bags), ZipLayout())
+    assert len(zip_bytes) == layout.archive_size()
+
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+        assert len(zf.namelist()) == 30
+        assert zf.read("digitised/b3/v1/data/b3.xml") == b"<mets/>" * 3
+        assert zf.read("digitised/b10/v1/bagit.txt") == b"BagIt-Version: 0.97"
+
+
+@mock_s3
+def test_only_fetches_manifests_a_few_bags_ahead():
+    s3 = boto3.client("s3")
+
+    bag = create_bag_in_s3(
+        s3, "bag-browser-zip-test", file_contents={"bagit.txt": b"BagIt-Version: 0.97"}
+    )
+
+    fetched = []
+
+    def get_bag(bag_identifier):
+        fetched.append(bag_identifier)
+        return bag
+
+    zs = create_multi_bag_zip_stream(
+        (bag for _ in range(100)), get_bag=get_bag, s3=s3, prefetch=3
+    )
+
+    stream = zs.generate()
+    next(stream)
+
+    # We're on the first bag, and we start on the second bag's files while
+    # the first bag is streaming, so we've fetched (at most) the manifests
+    # for the first two bags plus three more.
+    assert 1 <= len(fetched) <= 5
+
+    assert len(b"".join(stream)) > 0
+    assert len(fetched) == 100
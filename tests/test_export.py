@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+
+from src.export import export_csv, export_ndjson
+from src.models import Bag, BagIdentifier
+
+
+BAGS = [
+    Bag(
+        identifier=BagIdentifier(
+            space="digitised", external_identifier=f"b{i:04d}", version=1
+        ),
+        created_date="2020-01-01T01:01:01.000000Z",
+        file_count=i,
+        total_file_size=i * 100,
+        file_ext_tally={},
+    )
+    for i in range(5)
+]
+
+
+def test_can_export_csv():
+    chunks = list(export_csv(BAGS, rows_per_chunk=2))
+
+    # One chunk for every two rows, plus the leftover row
+    assert len(chunks) == 3
+
+    rows = list(csv.DictReader(io.StringIO("".join(chunks))))
+    assert len(rows) == 5
+    assert rows[3] == {
+        "space": "digitised",
+        "external_identifier": "b0003",
+        "version": "1",
+        "created_date": "2020-01-01T01:01:01.000000Z",
+        "file_count": "3",
+        "total_file_size": "300",
+    }
+
+
+def test_can_export_empty_csv():
+    assert "".join(export_csv([])).strip() == (
+        "space,external_identifier,version,created_date,file_count,total_file_size"
+    )
+
+
+def test_can_export_ndjson():
+    chunks = list(export_ndjson(BAGS, rows_per_chunk=2))
+    assert len(chunks) == 3
+
+    lines = "".join(chunks).splitlines()
+    assert [json.loads(line)["external_identifier"] for line in lines] == [
+        "b0000",
+        "b0001",
+        "b0002",
+        "b0003",
+        "b0004",
+    ]
+    assert json.loads(lines[1])["total_file_size"] == 100
+
+
+def test_can_export_empty_ndjson():
+    assert list(export_ndjson([])) == []
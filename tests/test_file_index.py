@@ -0,0 +1,163 @@
+import hashlib
+
+import pytest
+
+from src.database import BagsDatabase
+from src.metrics import MetricsRegistry
+from src.models import Bag, BagFile, BagIdentifier
+from src.sharding import ShardedBagsDatabase
+
+
+def checksum(name):
+    return hashlib.sha256(name.encode("utf8")).hexdigest()
+
+
+def create_bag(space, external_identifier, files):
+    storage_manifest = {
+        "space": space,
+        "info": {"externalIdentifier": external_identifier},
+        "version": 1,
+        "createdDate": "2020-01-01T01:01:01.000000Z",
+        "manifest": {
+            "files": [
+                {
+                    "name": name,
+                    "path": f"v1/{name}",
+                    "size": size,
+                    "checksum": checksum(name),
+                }
+                for name, size in files
+            ]
+        },
+        "tagManifest": {"files": []},
+    }
+
+    return Bag.from_storage_manifest(storage_manifest)
+
+
+BAGS = [
+    create_bag(
+        "digitised",
+        "b1234",
+        [
+            ("data/b1234.xml", 100),
+            ("data/b1234_001.TIF", 2000),
+            ("data/b1234_002.tif", 500),
+        ],
+    ),
+    create_bag(
+        "born-digital",
+        "PP/MON/1",
+        [("data/report.pdf", 3000), ("data/scan.tif", 1500), ("data/README", 10)],
+    ),
+]
+
+
+@pytest.fixture(params=["single", "sharded"])
+def bags_db(request, tmpdir):
+    if request.param == "single":
+        bags_db = BagsDatabase.from_path(
+            tmpdir / "bags.db", metrics=MetricsRegistry(), index_files=True
+        )
+    else:
+        bags_db = ShardedBagsDatabase(
+            root=tmpdir / "bags.d", metrics=MetricsRegistry(), index_files=True
+        )
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        for bag in BAGS:
+            bulk_helper.store_bag(bag)
+
+    yield bags_db
+
+
+def test_can_find_files_by_extension(bags_db):
+    files = bags_db.find_files(extension=".tif")
+
+    assert [(f.bag_id, f.path) for f in files] == [
+        ("digitised/b1234/v1", "data/b1234_001.TIF"),
+        ("born-digital/PP/MON/1/v1", "data/scan.tif"),
+        ("digitised/b1234/v1", "data/b1234_002.tif"),
+    ]
+
+
+def test_can_find_files_by_size(bags_db):
+    files = bags_db.find_files(min_size=1000, max_size=2500)
+
+    assert [f.path for f in files] == ["data/b1234_001.TIF", "data/scan.tif"]
+
+
+def test_can_find_files_in_a_space(bags_db):
+    files = bags_db.find_files(extension=".TIF", min_size=1000, space="born-digital")
+
+    assert files == [
+        BagFile(
+            bag_id="born-digital/PP/MON/1/v1",
+            path="data/scan.tif",
+            size=1500,
+            extension=".tif",
+            checksum=checksum("data/scan.tif"),
+        )
+    ]
+
+
+def test_files_without_an_extension_are_indexed(bags_db):
+    files = bags_db.find_files(extension="")
+
+    assert [f.path for f in files] == ["data/README"]
+
+
+def test_limits_number_of_files(bags_db):
+    files = bags_db.find_files(limit=2)
+
+    assert [f.size for f in files] == [3000, 2000]
+
+
+def test_can_find_files_by_checksum(bags_db):
+    files = bags_db.find_files_by_checksum(checksum("data/report.pdf"))
+
+    assert [(f.bag_id, f.path) for f in files] == [
+        ("born-digital/PP/MON/1/v1", "data/report.pdf")
+    ]
+
+    assert bags_db.find_files_by_checksum(checksum("missing")) == []
+
+
+def test_does_not_index_files_by_default(db):
+    bags_db = BagsDatabase(db, metrics=MetricsRegistry())
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(BAGS[0])
+
+    assert bags_db.find_files() == []
+
+
+def test_skips_bags_without_a_manifest(db):
+    bags_db = BagsDatabase(db, metrics=MetricsRegistry(), index_files=True)
+
+    bag = Bag(
+        identifier=BagIdentifier(
+            space="digitised", external_identifier="b1", version=1
+        ),
+        created_date="2020-01-01T01:01:01.000000Z",
+        file_count=1,
+        total_file_size=1,
+        file_ext_tally={".xml": 1},
+    )
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(bag)
+
+    assert bags_db.find_files() == []
+
+
+def test_files_with_missing_checksums_are_indexed(db):
+    bags_db = BagsDatabase(db, metrics=MetricsRegistry(), index_files=True)
+
+    bag = create_bag("digitised", "b1", [("data/b1.xml", 100)])
+    del bag.storage_manifest["manifest"]["files"][0]["checksum"]
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(bag)
+
+    assert [f.checksum for f in bags_db.find_files()] == [None]
@@ -0,0 +1,107 @@
+import attr
+import pytest
+
+from src.database import BagsDatabase
+from src.manifest_cache import ManifestCache, load_bag, rebuild_database
+from src.metrics import MetricsRegistry
+from src.models import Bag, BagIdentifier
+from src.query import QueryContext
+from src.sharding import ShardedBagsDatabase
+
+
+def create_bag(space, external_identifier, version=1):
+    storage_manifest = {
+        "space": space,
+        "info": {"externalIdentifier": external_identifier},
+        "version": version,
+        "createdDate": "2020-01-01T01:01:01.000000Z",
+        "manifest": {
+            "files": [
+                {"name": "data/1.xml", "path": "v1/data/1.xml", "size": 100},
+                {"name": "data/2.JP2", "path": "v1/data/2.JP2", "size": 2000},
+            ]
+        },
+        "tagManifest": {"files": []},
+    }
+
+    return Bag.from_storage_manifest(storage_manifest)
+
+
+BAGS = [
+    create_bag("digitised", "b1234"),
+    create_bag("digitised", "b1234", version=2),
+    create_bag("born-digital", "PP/MON/1"),
+]
+
+
+@pytest.fixture
+def manifest_cache(tmpdir):
+    manifest_cache = ManifestCache(tmpdir / "manifests")
+
+    for bag in BAGS:
+        manifest_cache.save(bag)
+
+    return manifest_cache
+
+
+def test_can_save_and_load_manifests(manifest_cache):
+    assert len(manifest_cache.paths()) == 3
+
+    path = manifest_cache.path_for(BAGS[2].identifier)
+    assert path.parent.name == "PP%2FMON%2F1"
+
+    assert load_bag(path) == attr.evolve(BAGS[2], storage_manifest=None)
+    assert load_bag(path, keep_manifest=True) == BAGS[2]
+
+
+def test_knows_which_bags_are_cached(manifest_cache):
+    assert BAGS[0].identifier in manifest_cache
+    assert (
+        BagIdentifier(space="digitised", external_identifier="b9999", version=1)
+        not in manifest_cache
+    )
+
+
+def test_saving_leaves_no_temporary_files(manifest_cache):
+    assert list(manifest_cache.root.glob("**/*.tmp")) == []
+
+
+@pytest.mark.parametrize("sharded", [False, True])
+def test_can_rebuild_database(tmpdir, manifest_cache, sharded):
+    if sharded:
+        bags_db = ShardedBagsDatabase(
+            root=tmpdir / "bags.d", metrics=MetricsRegistry(), index_files=True
+        )
+    else:
+        bags_db = BagsDatabase.from_path(
+            tmpdir / "bags.db", metrics=MetricsRegistry(), index_files=True
+        )
+
+    stored_ids = list(
+        rebuild_database(manifest_cache, bags_db, processes=2, commit_every=2)
+    )
+
+    assert sorted(stored_ids) == sorted(bag.id for bag in BAGS)
+    assert bags_db.get_known_ids() == {bag.id for bag in BAGS}
+
+    result = bags_db.query(
+        QueryContext(space="digitised", external_identifier_prefix="")
+    )
+    assert result.total_file_size == 4200
+    assert result.file_ext_tally == {".xml": 2, ".jp2": 2}
+
+    assert len(bags_db.find_files(extension=".jp2")) == 3
+
+
+def test_rebuild_without_file_index(tmpdir, manifest_cache):
+    bags_db = BagsDatabase.from_path(tmpdir / "bags.db", metrics=MetricsRegistry())
+
+    list(rebuild_database(manifest_cache, bags_db, processes=1))
+
+    assert bags_db.get_known_ids() == {bag.id for bag in BAGS}
+    assert bags_db.find_files() == []
+
+    distribution = bags_db.size_distribution(
+        QueryContext(space="born-digital", external_identifier_prefix="")
+    )
+    assert distribution["max"] == 2000
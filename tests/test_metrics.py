@@ -0,0 +1,77 @@
+import pytest
+
+from src.metrics import MetricsRegistry
+
+
+def test_counter_is_rendered_with_labels():
+    registry = MetricsRegistry()
+
+    counter = registry.counter("lookups_total", "Number of lookups")
+    counter.inc(result="hit")
+    counter.inc(result="hit")
+    counter.inc(result="miss")
+
+    assert counter.value(result="hit") == 2
+    assert counter.value(result="unknown") == 0
+
+    assert registry.render() == (
+        "# HELP lookups_total Number of lookups\n"
+        "# TYPE lookups_total counter\n"
+        'lookups_total{result="hit"} 2\n'
+        'lookups_total{result="miss"} 1\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=[0.1, 1])
+    histogram.observe(0.05, statement="count")
+    histogram.observe(0.5, statement="count")
+    histogram.observe(5, statement="count")
+
+    assert histogram.count(statement="count") == 3
+    assert histogram.count(statement="tally") == 0
+
+    assert registry.render() == (
+        "# HELP latency_seconds Latency\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{statement="count",le="0.1"} 1\n'
+        'latency_seconds_bucket{statement="count",le="1"} 2\n'
+        'latency_seconds_bucket{statement="count",le="+Inf"} 3\n'
+        'latency_seconds_sum{statement="count"} 5.55\n'
+        'latency_seconds_count{statement="count"} 3\n'
+    )
+
+
+def test_histogram_can_time_a_block():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency")
+
+    with histogram.time():
+        pass
+
+    assert histogram.count() == 1
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+
+    counter = registry.counter("requests_total", "Requests")
+    counter.inc(route='a"b\\c\nd')
+
+    assert 'requests_total{route="a\\"b\\\\c\\nd"} 1' in registry.render()
+
+
+def test_getting_the_same_metric_twice_returns_the_same_object():
+    registry = MetricsRegistry()
+
+    assert registry.counter("c", "help") is registry.counter("c", "help")
+
+
+def test_cannot_reuse_a_name_for_a_different_type_of_metric():
+    registry = MetricsRegistry()
+    registry.counter("c", "help")
+
+    with pytest.raises(TypeError, match="already registered"):
+        registry.histogram("c", "help")
@@ -1,6 +1,7 @@
 import json
 
-from src.models import BagIdentifier, Bag
+from src.models import BagIdentifier, Bag, BagSummary, to_timestamp
+from src.zip_layout import ZipLayout
 
 
 def test_bag_id():
@@ -55,3 +56,87 @@ def test_file_ext_tally_is_lowercased():
     )
 
     assert bag.file_ext_tally == {".xml": 2, ".jpg": 1, ".jp2": 1}
+
+
+def test_created_timestamp_is_derived_from_created_date():
+    bag = Bag(
+        identifier=BagIdentifier(
+            space="example", external_identifier="1234", version=1
+        ),
+        created_date="2020-01-01T01:01:01.123456Z",
+        file_count=1,
+        total_file_size=1,
+        file_ext_tally={".xml": 1},
+    )
+
+    assert bag.created_timestamp == 1577840461
+
+
+def test_can_parse_date_without_fractional_seconds():
+    assert to_timestamp("2020-01-01T01:01:01Z") == 1577840461
+
+
+def test_storage_manifest_includes_size_sketch():
+    storage_manifest = {
+        "space": "example",
+        "info": {"externalIdentifier": "1234"},
+        "version": 1,
+        "createdDate": "2020-01-01T01:01:01.000000Z",
+        "manifest": {
+            "files": [
+                {"name": "data/1.xml", "size": 100},
+                {"name": "data/2.jp2", "size": 200},
+                {"name": "data/3.jp2", "size": 3000},
+            ]
+        },
+        "tagManifest": {"files": []},
+    }
+
+    bag = Bag.from_storage_manifest(storage_manifest)
+
+    assert bag.size_sketch.count == 3
+    assert bag.size_sketch.max_size == 3000
+
+
+def test_storage_manifest_includes_zip_layout():
+    storage_manifest = {
+        "space": "example",
+        "info": {"externalIdentifier": "1234"},
+        "version": 1,
+        "createdDate": "2020-01-01T01:01:01.000000Z",
+        "manifest": {"files": [{"name": "data/1.xml", "size": 100}]},
+        "tagManifest": {"files": [{"name": "bagit.txt", "size": 20}]},
+    }
+
+    bag = Bag.from_storage_manifest(storage_manifest)
+
+    # The tag files are included in the ZIP, in the bag's directory
+    assert bag.zip_layout == ZipLayout.from_files(
+        [("example/1234/v1/data/1.xml", 100), ("example/1234/v1/bagit.txt", 20)]
+    )
+
+
+def test_bag_summary_matches_bag():
+    summary = BagSummary(
+        space="example",
+        external_identifier="1234",
+        version=2,
+        created_date="2020-01-01T01:01:01.000000Z",
+        file_count=3,
+        total_file_size=100,
+        created_timestamp=1577840461.0,
+    )
+
+    assert summary.id == "example/1234/v2"
+    assert summary.display_version == "v2"
+    assert summary.identifier == BagIdentifier(
+        space="example", external_identifier="1234", version=2
+    )
+    assert summary.to_dict() == {
+        "identifier": {"space": "example", "external_identifier": "1234", "version": 2},
+        "id": "example/1234/v2",
+        "created_date": "2020-01-01T01:01:01.000000Z",
+        "created_timestamp": 1577840461.0,
+        "file_count": 3,
+        "total_file_size": 100,
+    }
@@ -1,6 +1,6 @@
 import pytest
 
-from src.query import QueryContext
+from src.query import InvalidQuery, QueryContext
 
 
 def test_can_query_correctly_ordered_created_date():
@@ -32,3 +32,37 @@ def test_invalid_created_date_is_error():
             created_before="2001-01-01",
             page=1,
         )
+
+
+@pytest.mark.parametrize("field", ["created_after", "created_before"])
+@pytest.mark.parametrize("date_string", ["2021-01", "01/02/2021", "yesterday"])
+def test_unparseable_date_is_error(field, date_string):
+    with pytest.raises(InvalidQuery, match=f"{field} should be a date"):
+        QueryContext(
+            space="digitised", external_identifier_prefix="b1", **{field: date_string}
+        )
+
+
+def test_date_bounds_cover_whole_days():
+    query_context = QueryContext(
+        space="digitised",
+        external_identifier_prefix="b1",
+        created_after="2001-01-01",
+        created_before="2001-01-01",
+    )
+
+    assert query_context.created_after_timestamp == 978307200
+    assert query_context.created_before_timestamp == 978307200 + 24 * 60 * 60
+
+
+def test_empty_dates_are_unbounded():
+    query_context = QueryContext(space="digitised", external_identifier_prefix="b1")
+
+    assert query_context.created_after_timestamp is None
+    assert query_context.created_before_timestamp is None
+
+
+@pytest.mark.parametrize("page", [0, -1])
+def test_page_before_the_first_is_error(page):
+    with pytest.raises(InvalidQuery, match="page should be 1 or more"):
+        QueryContext(space="digitised", external_identifier_prefix="b1", page=page)
@@ -0,0 +1,181 @@
+import pytest
+
+from src.database import BagsDatabase
+from src.metrics import MetricsRegistry
+from src.models import Bag, BagIdentifier
+from src.reconcile import (
+    Disagreement,
+    IdDigest,
+    find_disagreements,
+    id_hash,
+    prefix_digests,
+)
+from src.sharding import ShardedBagsDatabase
+
+
+def create_bag(space, external_identifier, version=1):
+    return Bag(
+        identifier=BagIdentifier(
+            space=space, external_identifier=external_identifier, version=version
+        ),
+        created_date="2020-01-01T01:01:01.000000Z",
+        file_count=1,
+        total_file_size=100,
+        file_ext_tally={".xml": 1},
+    )
+
+
+BAGS = [
+    create_bag("digitised", "b1234"),
+    create_bag("digitised", "b1235"),
+    create_bag("digitised", "b1235", version=2),
+    create_bag("digitised", "b2000"),
+    create_bag("digitised", "b2"),
+    create_bag("born-digital", "PP/MON/1"),
+]
+
+
+@pytest.fixture(params=[False, True], ids=["single", "sharded"])
+def bags_db(request, tmpdir):
+    if request.param:
+        bags_db = ShardedBagsDatabase(root=tmpdir / "bags.d", metrics=MetricsRegistry())
+    else:
+        bags_db = BagsDatabase.from_path(tmpdir / "bags.db", metrics=MetricsRegistry())
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        for bag in BAGS:
+            bulk_helper.store_bag(bag)
+
+    return bags_db
+
+
+def storage_digests(bags):
+    return prefix_digests([bag.identifier for bag in bags], depth=4)
+
+
+def test_id_hash_is_32_bits():
+    hashes = {id_hash(f"digitised/b{i}/v1") for i in range(1000)}
+
+    assert len(hashes) == 1000
+    assert all(0 <= h < 2**32 for h in hashes)
+
+
+def test_digests_add_up_in_any_order():
+    bag_ids = [bag.id for bag in BAGS]
+
+    forwards = sum((IdDigest.from_id(bag_id) for bag_id in bag_ids), IdDigest())
+    backwards = sum((IdDigest.from_id(bag_id) for bag_id in bag_ids[::-1]), IdDigest())
+
+    assert forwards == backwards
+    assert forwards.count == len(BAGS)
+
+
+def test_prefix_digests_groups_by_space_and_prefix():
+    digests = storage_digests(BAGS)
+
+    assert set(digests) == {
+        ("digitised", "b123"),
+        ("digitised", "b200"),
+        ("digitised", "b2"),
+        ("born-digital", "PP/M"),
+    }
+    assert digests[("digitised", "b123")].count == 3
+
+
+def test_database_digests_match_the_storage_service(bags_db):
+    assert find_disagreements(bags_db, storage_digests(BAGS)) == []
+
+
+def test_database_digests_are_per_space(bags_db):
+    digitised_ids = [bag.id for bag in BAGS if bag.space == "digitised"]
+
+    assert bags_db.get_space_digests() == {
+        "digitised": sum(map(IdDigest.from_id, digitised_ids), IdDigest()),
+        "born-digital": IdDigest.from_id("born-digital/PP/MON/1/v1"),
+    }
+
+
+def test_finds_the_prefix_with_a_missing_bag(bags_db):
+    missing_bag = create_bag("digitised", "b1299")
+
+    (disagreement,) = find_disagreements(bags_db, storage_digests(BAGS + [missing_bag]))
+
+    assert disagreement.space == "digitised"
+    assert disagreement.prefix == "b129"
+    assert disagreement.storage_service.count == 1
+    assert disagreement.bags_database.count == 0
+
+
+def test_finds_a_bag_that_is_only_in_the_database(bags_db):
+    (disagreement,) = find_disagreements(bags_db, storage_digests(BAGS[1:]))
+
+    assert disagreement.space == "digitised"
+    assert disagreement.prefix == "b123"
+    assert disagreement.storage_service.count == 2
+    assert disagreement.bags_database.count == 3
+
+
+def test_finds_a_bag_with_a_different_version(bags_db):
+    storage_bags = [create_bag("digitised", "b2000", version=2)] + [
+        bag for bag in BAGS if bag.external_identifier != "b2000"
+    ]
+
+    # The counts are the same, but the IDs aren't.
+    (disagreement,) = find_disagreements(bags_db, storage_digests(storage_bags))
+
+    assert disagreement.prefix == "b200"
+    assert disagreement.storage_service.count == disagreement.bags_database.count
+
+
+def test_stops_at_an_identifier_shorter_than_the_depth(bags_db):
+    storage_bags = [bag for bag in BAGS if bag.external_identifier != "b2"]
+
+    assert find_disagreements(bags_db, storage_digests(storage_bags)) == [
+        Disagreement(
+            space="digitised",
+            prefix="b2",
+            storage_service=IdDigest.from_id("digitised/b2000/v1"),
+            bags_database=IdDigest.from_id("digitised/b2000/v1")
+            + IdDigest.from_id("digitised/b2/v1"),
+        )
+    ]
+
+
+def test_finds_a_space_that_is_missing_from_the_database(bags_db):
+    new_bags = [create_bag("miro", "A0001"), create_bag("miro", "B0001")]
+
+    (disagreement,) = find_disagreements(bags_db, storage_digests(BAGS + new_bags))
+
+    assert disagreement.space == "miro"
+    assert disagreement.prefix == ""
+    assert disagreement.storage_service.count == 2
+    assert disagreement.bags_database == IdDigest()
+
+
+def test_finds_a_space_that_is_only_in_the_database(bags_db):
+    storage_bags = [bag for bag in BAGS if bag.space != "born-digital"]
+
+    (disagreement,) = find_disagreements(bags_db, storage_digests(storage_bags))
+
+    assert disagreement.space == "born-digital"
+    assert disagreement.prefix == ""
+    assert disagreement.storage_service == IdDigest()
+    assert disagreement.bags_database.count == 1
+
+
+def test_fills_in_digests_for_an_existing_database(tmpdir):
+    bags_db = BagsDatabase.from_path(tmpdir / "bags.db", metrics=MetricsRegistry())
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        for bag in BAGS:
+            bulk_helper.store_bag(bag)
+
+    digests = bags_db.get_space_digests()
+
+    # Pretend this database was created before we kept digests.
+    with bags_db.database.cursor() as cursor:
+        cursor.execute("DROP TABLE space_digests")
+
+    bags_db = BagsDatabase.from_path(tmpdir / "bags.db", metrics=MetricsRegistry())
+
+    assert bags_db.get_space_digests() == digests
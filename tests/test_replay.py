@@ -0,0 +1,110 @@
+import pytest
+
+from benchmarks.replay import build_url, percentile, summarise
+
+
+@pytest.mark.parametrize(
+    "values, pct, expected",
+    [
+        ([1, 2], 50, 1),
+        ([1, 2, 3, 4, 5, 6], 50, 3),
+        (list(range(1, 11)), 50, 5),
+        (list(range(1, 11)), 95, 10),
+        (list(range(1, 101)), 99, 99),
+        ([7], 99, 7),
+        ([1, 2, 3], 0, 1),
+        ([1, 2, 3], 100, 3),
+    ],
+)
+def test_percentile_is_nearest_rank(values, pct, expected):
+    assert percentile(values, pct) == expected
+
+
+def test_percentile_of_nothing_is_none():
+    assert percentile([], 50) is None
+
+
+def test_build_url_fills_in_the_route():
+    entry = {
+        "route": "/bags/<space>/<external_identifier>/v<int:version>/files",
+        "view_args": {
+            "space": "digitised",
+            "external_identifier": "b1/2",
+            "version": 3,
+        },
+        "args": {"prefix": "b 1", "page": "2"},
+    }
+
+    assert build_url("http://localhost:3197/", entry) == (
+        "http://localhost:3197/bags/digitised/b1%2F2/v3/files?prefix=b+1&page=2"
+    )
+
+
+def test_build_url_uses_a_route_without_view_args_as_a_path():
+    assert (
+        build_url("http://localhost:3197", {"route": "/spaces/digitised"})
+        == "http://localhost:3197/spaces/digitised"
+    )
+
+
+def test_summarise_reports_each_route():
+    results = {
+        "/a": [(200, 0.3, "1"), (200, 0.1, "1"), (500, 0.2, "1")],
+        "/b": [(None, 1.0, None)],
+    }
+
+    summary = summarise(results, cache_before=None, cache_after=None, wall_time=2)
+
+    assert summary == {
+        "wall_time": 2,
+        "routes": {
+            "/a": {"requests": 3, "errors": 1, "p50": 0.2, "p95": 0.3, "p99": 0.3},
+            "/b": {"requests": 1, "errors": 1, "p50": 1.0, "p95": 1.0, "p99": 1.0},
+        },
+    }
+
+
+def test_summarise_reports_the_cache_hit_rate():
+    results = {"/a": [(200, 0.1, "1"), (200, 0.1, "1")]}
+
+    summary = summarise(
+        results,
+        cache_before={"hit": 10, "miss": 5, "worker": "1"},
+        cache_after={"hit": 13, "miss": 6, "worker": "1"},
+        wall_time=1,
+    )
+
+    assert summary["cache"] == {"hits": 3, "misses": 1, "hit_rate": 0.75}
+
+
+def test_summarise_with_no_cache_lookups():
+    summary = summarise(
+        {},
+        cache_before={"hit": 1, "miss": 1, "worker": "1"},
+        cache_after={"hit": 1, "miss": 1, "worker": "1"},
+        wall_time=1,
+    )
+
+    assert summary["cache"]["hit_rate"] is None
+
+
+@pytest.mark.parametrize(
+    "request_worker, after_worker",
+    [
+        # The requests went to another worker
+        ("2", "1"),
+        # The worker was recycled during the run
+        ("1", "2"),
+    ],
+)
+def test_summarise_refuses_a_hit_rate_across_workers(request_worker, after_worker):
+    results = {"/a": [(200, 0.1, "1"), (200, 0.1, request_worker)]}
+
+    summary = summarise(
+        results,
+        cache_before={"hit": 10, "miss": 5, "worker": "1"},
+        cache_after={"hit": 0, "miss": 1, "worker": after_worker},
+        wall_time=1,
+    )
+
+    assert summary["cache"] == {"workers": 2}
@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+from src.sampling import estimate_total
+
+
+def test_sampling_everything_is_exact():
+    assert estimate_total([1, 2, 3], population_size=3) == (6, 0)
+
+
+def test_empty_population():
+    assert estimate_total([], population_size=0) == (0, 0)
+
+
+@pytest.mark.parametrize("values", [[], [5]])
+def test_tiny_sample_has_unknown_error(values):
+    _, error = estimate_total(values, population_size=100)
+    assert error is None
+
+
+def test_error_bound_is_a_95_percent_confidence_interval():
+    rng = random.Random(0)
+
+    within_bound = 0
+    for _ in range(200):
+        population = [rng.randrange(100) for _ in range(2000)]
+        sample = rng.sample(population, 200)
+
+        estimate, error = estimate_total(sample, population_size=len(population))
+        assert 0 < error < estimate
+
+        if abs(estimate - sum(population)) <= error:
+            within_bound += 1
+
+    assert within_bound >= 180
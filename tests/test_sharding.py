@@ -0,0 +1,374 @@
+import attr
+import pytest
+
+from src.database import (
+    BagsDatabase,
+    OutdatedDatabase,
+    SqliteDatabase,
+    query_across_spaces,
+)
+from src.metrics import MetricsRegistry
+from src.models import Bag, BagIdentifier
+from src.query import InvalidQuery, QueryContext
+from src.sharding import ShardedBagsDatabase, open_bags_database
+from src.zip_layout import ZipLayout
+
+
+def create_bag(space, external_identifier, version=1, file_ext_tally=None):
+    file_ext_tally = file_ext_tally or {".xml": 1, ".jp2": 2}
+
+    return Bag(
+        identifier=BagIdentifier(
+            space=space, external_identifier=external_identifier, version=version
+        ),
+        created_date="2020-01-01T01:01:01.000000Z",
+        file_count=sum(file_ext_tally.values()),
+        total_file_size=100,
+        file_ext_tally=file_ext_tally,
+    )
+
+
+BAGS = [
+    create_bag("digitised", "b1234"),
+    create_bag("digitised", "b1235"),
+    create_bag("digitised", "b1235", version=2),
+    create_bag("born-digital", "PP/MON/1", file_ext_tally={".pdf": 4}),
+    create_bag("born-digital", "PP/MON/2", file_ext_tally={".pdf": 1, ".xml": 1}),
+    create_bag("space with/slashes", "b1"),
+]
+
+
+@pytest.fixture
+def sharded_db(tmpdir):
+    sharded_db = ShardedBagsDatabase(root=tmpdir / "bags.d", metrics=MetricsRegistry())
+
+    with sharded_db.bulk_store_bags() as bulk_helper:
+        for bag in BAGS:
+            bulk_helper.store_bag(bag)
+
+    yield sharded_db
+
+
+def test_stores_each_space_in_a_separate_file(sharded_db):
+    assert sorted(path.name for path in sharded_db.root.iterdir()) == [
+        "born-digital.db",
+        "digitised.db",
+        "space%20with%2Fslashes.db",
+    ]
+
+    assert sharded_db.spaces() == ["born-digital", "digitised", "space with/slashes"]
+
+
+def test_can_get_known_ids(sharded_db):
+    assert sharded_db.get_known_ids() == {bag.id for bag in BAGS}
+
+
+def test_can_get_spaces(sharded_db):
+    assert sharded_db.get_spaces() == {
+        "digitised": 3,
+        "born-digital": 2,
+        "space with/slashes": 1,
+    }
+
+
+def test_can_query_a_space(sharded_db):
+    result = sharded_db.query(
+        QueryContext(space="born-digital", external_identifier_prefix="")
+    )
+
+    assert result.total_count == 2
+    assert result.file_ext_tally == {".pdf": 5, ".xml": 1}
+    assert [bag.id for bag in result.bags] == [
+        "born-digital/PP/MON/1/v1",
+        "born-digital/PP/MON/2/v1",
+    ]
+
+
+def test_querying_a_missing_space_is_empty(sharded_db):
+    result = sharded_db.query(
+        QueryContext(space="missing", external_identifier_prefix="")
+    )
+
+    assert result.total_count == 0
+    assert result.bags == []
+
+    assert (
+        sharded_db.date_histogram(
+            QueryContext(space="missing", external_identifier_prefix="")
+        )
+        == []
+    )
+
+    assert sharded_db.query_page(
+        QueryContext(space="missing", external_identifier_prefix="")
+    ) == []
+
+    estimate = sharded_db.estimate_totals(
+        QueryContext(space="missing", external_identifier_prefix="")
+    )
+    assert estimate.total_count == 0
+    assert estimate.is_exact
+
+
+def test_can_run_many_queries(sharded_db):
+    query_contexts = [
+        QueryContext(space="born-digital", external_identifier_prefix=""),
+        QueryContext(space="missing", external_identifier_prefix=""),
+        QueryContext(space="digitised", external_identifier_prefix="b1235"),
+        QueryContext(space="born-digital", external_identifier_prefix="PP/MON/2"),
+    ]
+
+    assert sharded_db.query_many(query_contexts) == [
+        sharded_db.query(query_context) for query_context in query_contexts
+    ]
+
+
+def test_can_autocomplete(sharded_db):
+    assert sharded_db.autocomplete("born-digital", prefix="PP/")["total"] == 2
+    assert sharded_db.autocomplete("missing", prefix="b") == {
+        "prefix": "b",
+        "total": 0,
+        "identifiers": [],
+        "next_characters": {},
+    }
+
+
+def test_can_get_page_and_estimate(sharded_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+
+    assert sharded_db.query_page(query_context) == sharded_db.query(query_context).bags
+    assert sharded_db.estimate_totals(query_context).total_file_count == 9
+
+
+def test_can_get_size_distribution(sharded_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+
+    assert sharded_db.size_distribution(query_context)["bags_without_sizes"] == 3
+
+    assert sharded_db.size_distribution(
+        QueryContext(space="missing", external_identifier_prefix="")
+    ) == {
+        "file_count": 0,
+        "median": None,
+        "p90": None,
+        "p99": None,
+        "max": None,
+        "bags_without_sizes": 0,
+    }
+
+
+def test_can_get_zip_layout(sharded_db):
+    # None of the bags in the fixture have a layout
+    assert (
+        sharded_db.zip_layout(
+            QueryContext(space="digitised", external_identifier_prefix="")
+        )
+        is None
+    )
+
+    assert sharded_db.zip_layout(
+        QueryContext(space="missing", external_identifier_prefix="")
+    ) == ZipLayout()
+
+
+def test_empty_sharded_database_has_no_bags(tmpdir):
+    sharded_db = ShardedBagsDatabase(root=tmpdir / "bags.d", metrics=MetricsRegistry())
+
+    assert sharded_db.get_known_ids() == set()
+    assert sharded_db.get_spaces() == {}
+
+
+def test_can_get_date_histogram(sharded_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+
+    assert sharded_db.date_histogram(query_context, interval="month") == [
+        {"period": "2020-01", "bag_count": 3, "total_file_size": 300}
+    ]
+
+    with pytest.raises(ValueError, match="Unrecognised interval"):
+        sharded_db.date_histogram(
+            QueryContext(space="missing", external_identifier_prefix=""),
+            interval="year",
+        )
+
+
+def test_writing_to_one_shard_does_not_clear_the_cache_of_another(sharded_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+    sharded_db.query(query_context)
+
+    with sharded_db.bulk_store_bags() as bulk_helper:
+        bulk_helper.store_bag(create_bag("born-digital", "PP/MON/3"))
+
+    sharded_db.query(query_context)
+    assert sharded_db.shard("digitised")._make_query.cache_info().hits == 1
+
+
+def test_slow_queries_are_collected_from_every_shard(tmpdir):
+    sharded_db = ShardedBagsDatabase(
+        root=tmpdir / "bags.d", metrics=MetricsRegistry(), slow_query_threshold=0
+    )
+
+    with sharded_db.bulk_store_bags() as bulk_helper:
+        for bag in BAGS:
+            bulk_helper.store_bag(bag)
+
+    for space in ("digitised", "born-digital"):
+        sharded_db.query(QueryContext(space=space, external_identifier_prefix=""))
+
+    assert len(sharded_db.slow_queries) == 6
+
+
+@pytest.mark.parametrize("sharded", [True, False])
+def test_can_query_across_spaces(tmpdir, sharded):
+    if sharded:
+        bags_db = ShardedBagsDatabase(root=tmpdir / "bags.d", metrics=MetricsRegistry())
+    else:
+        bags_db = BagsDatabase.from_path(tmpdir / "bags.db", metrics=MetricsRegistry())
+
+    with bags_db.bulk_store_bags() as bulk_helper:
+        for bag in BAGS:
+            bulk_helper.store_bag(bag)
+
+    query_context = QueryContext(space=None, external_identifier_prefix="", page_size=2)
+
+    result = query_across_spaces(bags_db, query_context)
+
+    assert result.total_count == 6
+    assert result.total_file_count == 3 + 3 + 3 + 4 + 2 + 3
+    assert result.total_file_size == 600
+    assert result.file_ext_tally == {".xml": 5, ".jp2": 8, ".pdf": 5}
+    assert [bag.id for bag in result.bags] == [
+        "born-digital/PP/MON/1/v1",
+        "born-digital/PP/MON/2/v1",
+    ]
+
+    page2 = query_across_spaces(bags_db, attr.evolve(query_context, page=2))
+    assert [bag.id for bag in page2.bags] == [
+        "digitised/b1234/v1",
+        "digitised/b1235/v1",
+    ]
+
+    subset = query_across_spaces(
+        bags_db, query_context, spaces=["digitised", "space with/slashes"]
+    )
+    assert subset.total_count == 4
+
+
+def test_can_only_page_so_far_across_spaces(sharded_db):
+    last_page = QueryContext(
+        space=None, external_identifier_prefix="", page=40, page_size=250
+    )
+    assert query_across_spaces(sharded_db, last_page).bags == []
+
+    with pytest.raises(InvalidQuery, match="first 10000 results"):
+        query_across_spaces(sharded_db, attr.evolve(last_page, page=41))
+
+
+def test_forgets_a_shard_whose_file_is_removed_while_we_use_it(sharded_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+    shard = sharded_db.shard("digitised")
+    original_query = shard.query
+
+    # The file is removed after we've picked the shard, but before we
+    # query it -- e.g. by publish_snapshot().
+    def query(query_context):
+        shard.database.path.unlink()
+        return original_query(query_context)
+
+    shard.query = query
+
+    assert sharded_db.query(query_context).total_count == 0
+    assert sharded_db.shard("digitised") is None
+
+
+def test_reopens_a_shard_if_it_gets_a_file_not_found_error(sharded_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+    shard = sharded_db.shard("digitised")
+
+    def query(query_context):
+        raise FileNotFoundError
+
+    shard.query = query
+
+    assert sharded_db.query(query_context).total_count == 3
+    assert sharded_db.shard("digitised") is not shard
+
+
+def test_opens_a_directory_as_a_sharded_database(tmpdir):
+    (tmpdir / "bags.d").mkdir()
+
+    assert isinstance(open_bags_database(tmpdir / "bags.d"), ShardedBagsDatabase)
+    assert isinstance(open_bags_database(tmpdir / "bags.db"), BagsDatabase)
+
+
+def create_old_database(path):
+    # This is how the bags table looked before we added created_timestamp,
+    # max_file_size, the prefix buckets, and so on.
+    with SqliteDatabase(path=path).cursor() as cursor:
+        cursor.execute(
+            """CREATE TABLE bags
+            (
+                id TEXT PRIMARY KEY,
+                space TEXT,
+                external_identifier TEXT,
+                version INTEGER,
+                created_date TEXT,
+                file_count INTEGER,
+                total_file_size INTEGER
+            )"""
+        )
+        cursor.execute(
+            """INSERT INTO bags VALUES
+            ('digitised/b1/v1', 'digitised', 'b1', 1, '2020-01-01T01:01:01.000000Z', 3, 3)"""
+        )
+
+
+@pytest.mark.parametrize("sharded", [True, False])
+def test_an_old_database_must_be_migrated_before_read_only_use(tmpdir, sharded):
+    if sharded:
+        path = tmpdir / "bags.d"
+        path.mkdir()
+        create_old_database(path / "digitised.db")
+    else:
+        path = tmpdir / "bags.db"
+        create_old_database(path)
+
+    with pytest.raises(OutdatedDatabase, match="run freshen_bag_db.py to migrate it"):
+        open_bags_database(path, read_only=True).check_schema()
+
+    # Opening the database for writing brings its tables up to date, which
+    # is what freshen_bag_db.py does.
+    open_bags_database(path).check_schema()
+
+    bags_db = open_bags_database(path, read_only=True)
+    bags_db.check_schema()
+
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+    assert bags_db.query(query_context).total_count == 1
+
+
+def test_a_missing_database_cant_be_used_read_only(tmpdir):
+    bags_db = open_bags_database(tmpdir / "bags.db", read_only=True)
+
+    with pytest.raises(OutdatedDatabase, match="There is no bags database"):
+        bags_db.check_schema()
+
+    assert not (tmpdir / "bags.db").exists()
+
+
+def test_read_only_database_does_not_create_directory(tmpdir):
+    ShardedBagsDatabase(root=tmpdir / "bags.d", read_only=True)
+
+    assert not (tmpdir / "bags.d").exists()
+
+
+def test_can_iterate_over_bags_in_a_space(sharded_db):
+    query_context = QueryContext(space="digitised", external_identifier_prefix="b1235")
+
+    assert [bag.id for bag in sharded_db.iter_bags(query_context)] == [
+        "digitised/b1235/v1",
+        "digitised/b1235/v2",
+    ]
+
+    query_context = QueryContext(space="missing", external_identifier_prefix="")
+    assert list(sharded_db.iter_bags(query_context)) == []
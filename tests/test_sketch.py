@@ -0,0 +1,63 @@
+import pytest
+
+from src.sketch import SizeSketch, bucket_for_size, representative_size
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 100, 1023, 1024, 10 ** 6, 5 * 10 ** 12])
+def test_representative_size_is_close_to_size(size):
+    estimate = representative_size(bucket_for_size(size))
+
+    assert abs(estimate - size) / size <= 0.1
+
+
+def test_empty_files_have_their_own_bucket():
+    assert bucket_for_size(0) == 0
+    assert representative_size(0) == 0
+    assert bucket_for_size(1) > 0
+
+
+def test_quantiles_are_approximately_right():
+    sizes = list(range(1, 10001))
+    sketch = SizeSketch.from_sizes(sizes)
+
+    assert sketch.count == 10000
+    assert sketch.max_size == 10000
+    assert abs(sketch.quantile(0.5) - 5000) / 5000 <= 0.1
+    assert abs(sketch.quantile(0.99) - 9900) / 9900 <= 0.1
+
+
+def test_quantiles_never_exceed_the_biggest_file():
+    # 1025 is at the bottom of its bucket, so the midpoint is bigger
+    sketch = SizeSketch.from_sizes([1025, 1025, 1025])
+
+    assert representative_size(bucket_for_size(1025)) > 1025
+    assert sketch.quantile(0) == 1025
+    assert sketch.quantile(1) == 1025
+
+
+def test_quantiles_without_a_max_size():
+    assert SizeSketch(buckets={0: 1, 41: 3}).quantile(0.5) == representative_size(41)
+
+
+def test_merging_is_the_same_as_sketching_everything():
+    merged = SizeSketch.from_sizes([1, 10, 100])
+    merged.merge(SizeSketch.from_sizes([1000, 10000]))
+    merged.merge(SizeSketch())
+
+    assert merged == SizeSketch.from_sizes([1, 10, 100, 1000, 10000])
+
+
+def test_empty_sketch_has_no_quantiles():
+    assert SizeSketch().summary() == {
+        "file_count": 0,
+        "median": None,
+        "p90": None,
+        "p99": None,
+        "max": None,
+    }
+
+
+@pytest.mark.parametrize("q", [-0.1, 1.5])
+def test_quantile_must_be_between_0_and_1(q):
+    with pytest.raises(ValueError, match="Quantile must be between 0 and 1"):
+        SizeSketch.from_sizes([1]).quantile(q)
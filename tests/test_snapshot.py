@@ -0,0 +1,167 @@
+import pytest
+
+from src.database import BagsDatabase
+from src.metrics import MetricsRegistry
+from src.models import Bag, BagIdentifier
+from src.query import QueryContext
+from src.sharding import ShardedBagsDatabase
+from src.snapshot import publish_snapshot, snapshot
+
+
+def create_bag(space, external_identifier):
+    return Bag(
+        identifier=BagIdentifier(
+            space=space, external_identifier=external_identifier, version=1
+        ),
+        created_date="2020-01-01T01:01:01.000000Z",
+        file_count=1,
+        total_file_size=100,
+        file_ext_tally={".xml": 1},
+    )
+
+
+def store_bags(bags_db, *bags):
+    with bags_db.bulk_store_bags() as bulk_helper:
+        for bag in bags:
+            bulk_helper.store_bag(bag)
+
+
+def test_app_only_sees_the_snapshot_once_it_is_published(tmpdir):
+    path = tmpdir / "bags.db"
+    store_bags(BagsDatabase.from_path(path), create_bag("digitised", "b1"))
+
+    registry = MetricsRegistry()
+    app_db = BagsDatabase.from_path(path, read_only=True, metrics=registry)
+    lookups = registry.counter("bag_browser_query_cache_lookups_total", "")
+
+    query_context = QueryContext(space="digitised", external_identifier_prefix="")
+    assert app_db.query(query_context).total_count == 1
+
+    with snapshot(path) as snapshot_path:
+        snapshot_db = BagsDatabase.from_path(snapshot_path)
+
+        for i in range(2, 12):
+            store_bags(snapshot_db, create_bag("digitised", f"b{i}"))
+
+            # The app keeps using its cached results from the old database
+            assert app_db.query(query_context).total_count == 1
+
+    assert lookups.value(result="miss") == 1
+
+    assert app_db.query(query_context).total_count == 11
+    assert app_db.query(query_context).total_count == 11
+    assert lookups.value(result="miss") == 2
+
+    assert not snapshot_path.exists()
+
+
+def test_snapshot_is_discarded_if_there_is_an_error(tmpdir):
+    path = tmpdir / "bags.db"
+    store_bags(BagsDatabase.from_path(path), create_bag("digitised", "b1"))
+
+    with pytest.raises(ValueError):
+        with snapshot(path) as snapshot_path:
+            store_bags(
+                BagsDatabase.from_path(snapshot_path), create_bag("digitised", "b2")
+            )
+            raise ValueError("Something went wrong")
+
+    assert not snapshot_path.exists()
+    assert BagsDatabase.from_path(path).get_known_ids() == {"digitised/b1/v1"}
+
+
+def test_can_snapshot_a_database_that_does_not_exist_yet(tmpdir):
+    path = tmpdir / "bags.db"
+
+    with snapshot(path) as snapshot_path:
+        store_bags(BagsDatabase.from_path(snapshot_path), create_bag("digitised", "b1"))
+
+    assert BagsDatabase.from_path(path).get_known_ids() == {"digitised/b1/v1"}
+
+
+def test_can_snapshot_a_sharded_database(tmpdir):
+    path = tmpdir / "bags.d"
+    store_bags(
+        ShardedBagsDatabase.from_path(path),
+        create_bag("digitised", "b1"),
+        create_bag("born-digital", "PP/MON/1"),
+    )
+
+    # e.g. left over from an interrupted run
+    (tmpdir / "bags.d.snapshot").mkdir()
+    (tmpdir / "bags.d.snapshot" / "old.db").write_text("", encoding="utf8")
+
+    with snapshot(path) as snapshot_path:
+        store_bags(
+            ShardedBagsDatabase.from_path(snapshot_path),
+            create_bag("digitised", "b2"),
+            create_bag("miro", "A0000001"),
+        )
+
+        assert ShardedBagsDatabase.from_path(path).spaces() == [
+            "born-digital",
+            "digitised",
+        ]
+
+    assert ShardedBagsDatabase.from_path(path).get_known_ids() == {
+        "born-digital/PP/MON/1/v1",
+        "digitised/b1/v1",
+        "digitised/b2/v1",
+        "miro/A0000001/v1",
+    }
+    assert not snapshot_path.exists()
+
+
+def test_publishing_a_sharded_database_removes_old_shards(tmpdir):
+    path = tmpdir / "bags.d"
+    store_bags(
+        ShardedBagsDatabase.from_path(path),
+        create_bag("digitised", "b1"),
+        create_bag("born-digital", "PP/MON/1"),
+    )
+
+    new_path = tmpdir / "bags.d.new"
+    store_bags(ShardedBagsDatabase.from_path(new_path), create_bag("digitised", "b2"))
+
+    publish_snapshot(new_path, path)
+
+    assert ShardedBagsDatabase.from_path(path).get_known_ids() == {"digitised/b2/v1"}
+
+
+def test_app_keeps_working_when_a_published_snapshot_removes_a_shard(tmpdir):
+    path = tmpdir / "bags.d"
+    store_bags(
+        ShardedBagsDatabase.from_path(path),
+        create_bag("digitised", "b1"),
+        create_bag("born-digital", "PP/MON/1"),
+    )
+
+    app_db = ShardedBagsDatabase.from_path(path, read_only=True)
+    born_digital = QueryContext(space="born-digital", external_identifier_prefix="")
+    digitised = QueryContext(space="digitised", external_identifier_prefix="")
+    assert app_db.query(born_digital).total_count == 1
+    assert app_db.query(digitised).total_count == 1
+
+    new_path = tmpdir / "bags.d.new"
+    store_bags(
+        ShardedBagsDatabase.from_path(new_path),
+        create_bag("digitised", "b1"),
+        create_bag("digitised", "b2"),
+    )
+    publish_snapshot(new_path, path)
+
+    assert app_db.query(born_digital).total_count == 0
+    assert app_db.query(digitised).total_count == 2
+    assert app_db.get_known_ids() == {"digitised/b1/v1", "digitised/b2/v1"}
+
+
+def test_can_switch_between_a_file_and_a_sharded_database(tmpdir):
+    path = tmpdir / "bags.db"
+    store_bags(BagsDatabase.from_path(path), create_bag("digitised", "b1"))
+
+    sharded_path = tmpdir / "bags.d"
+    store_bags(ShardedBagsDatabase.from_path(sharded_path), create_bag("miro", "A1"))
+
+    publish_snapshot(sharded_path, path)
+
+    assert ShardedBagsDatabase.from_path(path).get_known_ids() == {"miro/A1/v1"}
@@ -1,11 +1,14 @@
 import contextlib
+import json
 import secrets
 
 import boto3
 from moto import mock_dynamodb2, mock_s3
 
 from src.models import Bag, BagIdentifier
+from src.reconcile import prefix_digests
 from src.storage_service import StorageService
+from src.telemetry import IngestTelemetry
 
 
 @contextlib.contextmanager
@@ -139,3 +142,114 @@ def test_can_count_bags():
 
         ss = StorageService(table_name=table_name)
         assert ss.total_bags() == 1
+
+
+def storage_manifest(external_identifier):
+    return {
+        "space": "digitised",
+        "info": {"externalIdentifier": external_identifier},
+        "version": 1,
+        "createdDate": "2020-01-01T01:01:01.000000Z",
+        "manifest": {
+            "files": [{"name": "data/1.xml", "path": "v1/data/1.xml", "size": 100}]
+        },
+        "tagManifest": {"files": []},
+    }
+
+
+@mock_dynamodb2
+@mock_s3
+def test_can_get_lots_of_bags_with_telemetry():
+    dynamodb = boto3.resource("dynamodb")
+    s3 = boto3.client("s3")
+
+    external_identifiers = [f"b{i}" for i in range(10)]
+
+    with manifests_table() as table_name, s3_bucket() as bucket_name:
+        table = dynamodb.Table(table_name)
+
+        for external_identifier in external_identifiers:
+            s3.put_object(
+                Bucket=bucket_name,
+                Key=f"{external_identifier}.json",
+                Body=json.dumps(storage_manifest(external_identifier)),
+            )
+            table.put_item(
+                Item={
+                    "id": f"digitised/{external_identifier}",
+                    "version": 1,
+                    "payload": {
+                        "typedStoreId": {
+                            "namespace": bucket_name,
+                            "path": f"{external_identifier}.json",
+                        }
+                    },
+                }
+            )
+
+        telemetry = IngestTelemetry()
+        ss = StorageService(table_name=table_name, telemetry=telemetry)
+
+        bags = list(ss.get_bags(ss.get_bag_identifiers(), workers=3))
+
+        # We can also pass in our own clients.
+        bag = ss.get_bag(
+            BagIdentifier(space="digitised", external_identifier="b0", version=1),
+            dynamodb=boto3.resource("dynamodb").meta.client,
+            s3=boto3.client("s3"),
+        )
+        assert bag in bags
+
+    assert sorted(bag.identifier.external_identifier for bag in bags) == sorted(
+        external_identifiers
+    )
+
+    snapshot = telemetry.snapshot()
+
+    assert snapshot["counters"]["manifests"] == 11
+    assert snapshot["counters"]["bytes_downloaded"] == sum(
+        len(json.dumps(storage_manifest(external_identifier)))
+        for external_identifier in external_identifiers + ["b0"]
+    )
+    assert snapshot["counters"]["retries"] == 0
+    assert snapshot["stages"]["get_item"]["calls"] == 11
+    assert snapshot["stages"]["s3_get"]["calls"] == 11
+    assert snapshot["stages"]["parse"]["calls"] == 11
+
+    # One call for the page of results, and one to find there are no more.
+    assert snapshot["stages"]["scan"]["calls"] == 2
+
+    assert 1 <= snapshot["max_queue_depth"] <= 6
+
+
+@mock_dynamodb2
+def test_can_get_prefix_digests():
+    dynamodb = boto3.resource("dynamodb")
+
+    bag_identifiers = [
+        BagIdentifier(space="digitised", external_identifier="b1234", version=1),
+        BagIdentifier(space="digitised", external_identifier="b1234", version=2),
+        BagIdentifier(space="digitised", external_identifier="b2", version=1),
+        BagIdentifier(space="born-digital", external_identifier="PP/MON/1", version=1),
+    ]
+
+    with manifests_table() as table_name:
+        table = dynamodb.Table(table_name)
+
+        for bag_identifier in bag_identifiers:
+            table.put_item(
+                Item={
+                    "id": f"{bag_identifier.space}/{bag_identifier.external_identifier}",
+                    "version": bag_identifier.version,
+                    "payload": {"typedStoreId": {"namespace": "x", "path": "y"}},
+                }
+            )
+
+        ss = StorageService(table_name=table_name)
+
+        # moto ignores Segment and returns the whole table to every segment,
+        # so we can only check the results with a single segment.
+        digests = ss.get_prefix_digests(depth=3, segments=1)
+
+    assert digests == prefix_digests(bag_identifiers, depth=3)
+    assert ss.telemetry.snapshot()["stages"]["scan"]["calls"] == 2
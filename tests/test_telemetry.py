@@ -0,0 +1,158 @@
+import io
+import json
+import types
+
+from botocore.hooks import HierarchicalEmitter
+import pytest
+
+from src.telemetry import IngestTelemetry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_times_each_stage(clock):
+    telemetry = IngestTelemetry(clock=clock)
+
+    for _ in range(3):
+        with telemetry.stage("get_item"):
+            clock.now += 2
+
+    with pytest.raises(ValueError):
+        with telemetry.stage("parse"):
+            clock.now += 1
+            raise ValueError
+
+    assert telemetry.snapshot()["stages"] == {
+        "get_item": {"calls": 3, "seconds": 6},
+        "parse": {"calls": 1, "seconds": 1},
+    }
+
+
+def test_counts_throughput(clock):
+    telemetry = IngestTelemetry(clock=clock)
+
+    telemetry.add("manifests", 10)
+    telemetry.add("bytes_downloaded", 5000)
+    telemetry.record_response({"ResponseMetadata": {"RetryAttempts": 2}})
+    telemetry.record_response({"ResponseMetadata": {}})
+    clock.now = 5
+
+    snapshot = telemetry.snapshot()
+
+    assert snapshot["counters"] == {
+        "bytes_downloaded": 5000,
+        "manifests": 10,
+        "retries": 2,
+    }
+    assert snapshot["manifests_per_second"] == 2
+    assert snapshot["bytes_per_second"] == 1000
+
+
+def test_throughput_is_zero_before_any_time_has_passed(clock):
+    telemetry = IngestTelemetry(clock=clock)
+    telemetry.add("manifests")
+
+    assert telemetry.snapshot()["manifests_per_second"] == 0
+
+
+def test_tracks_queue_depth():
+    telemetry = IngestTelemetry()
+
+    for depth in (1, 5, 2):
+        telemetry.observe_queue_depth(depth)
+
+    snapshot = telemetry.snapshot()
+    assert snapshot["queue_depth"] == 2
+    assert snapshot["max_queue_depth"] == 5
+
+
+def test_counts_throttled_requests():
+    # A stand-in for a boto3 client, without the retry handler botocore
+    # would register.
+    client = types.SimpleNamespace(
+        meta=types.SimpleNamespace(events=HierarchicalEmitter())
+    )
+
+    telemetry = IngestTelemetry()
+    assert telemetry.instrument(client) is client
+
+    for response in [
+        (None, {"Error": {"Code": "ProvisionedThroughputExceededException"}}),
+        (None, {"Error": {"Code": "ValidationException"}}),
+        (None, {}),
+        None,
+    ]:
+        client.meta.events.emit("needs-retry.dynamodb.GetItem", response=response)
+
+    assert telemetry.snapshot()["counters"] == {"throttles": 1}
+
+
+def test_instrumenting_a_client_twice_counts_throttles_once():
+    client = types.SimpleNamespace(
+        meta=types.SimpleNamespace(events=HierarchicalEmitter())
+    )
+
+    telemetry = IngestTelemetry()
+    telemetry.instrument(client)
+    telemetry.instrument(client)
+
+    client.meta.events.emit(
+        "needs-retry.s3.GetObject", response=(None, {"Error": {"Code": "SlowDown"}})
+    )
+
+    assert telemetry.snapshot()["counters"] == {"throttles": 1}
+
+
+def test_writes_json_lines_every_interval(clock):
+    output = io.StringIO()
+    telemetry = IngestTelemetry(output=output, interval=10, clock=clock)
+
+    for now in range(0, 25):
+        clock.now = now
+        telemetry.add("manifests")
+        telemetry.maybe_report()
+
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+
+    assert [line["event"] for line in lines] == ["progress", "progress"]
+    assert [line["elapsed_seconds"] for line in lines] == [10, 20]
+    assert [line["counters"]["manifests"] for line in lines] == [11, 21]
+
+
+def test_finish_writes_and_returns_a_summary(clock):
+    output = io.StringIO()
+    telemetry = IngestTelemetry(output=output, clock=clock)
+
+    with telemetry.stage("s3_get"):
+        clock.now += 4
+
+    telemetry.add("manifests", 2)
+    telemetry.add("bytes_downloaded", 2000)
+    telemetry.observe_queue_depth(3)
+
+    summary = telemetry.finish()
+
+    (line,) = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert line["event"] == "summary"
+    assert line["stages"] == {"s3_get": {"calls": 1, "seconds": 4}}
+
+    assert summary.splitlines() == [
+        "Fetched 2 manifests (2.0 kB) in 4.0s: 0.5 manifests/s, 500 Bytes/s",
+        "  s3_get             4.0s    4000.0ms/call  (1 calls)",
+        "Retries: 0, throttles: 0, max writer queue depth: 3",
+    ]
+
+
+def test_finish_without_output_only_returns_a_summary():
+    assert IngestTelemetry().finish().startswith("Fetched 0 manifests")
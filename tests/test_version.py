@@ -0,0 +1,43 @@
+import pytest
+
+from src.version import get_git_commit, write_commit_file
+
+
+@pytest.fixture(autouse=True)
+def clear_cache(monkeypatch):
+    monkeypatch.delenv("BAG_BROWSER_GIT_COMMIT", raising=False)
+    get_git_commit.cache_clear()
+    yield
+    get_git_commit.cache_clear()
+
+
+def test_reads_commit_from_file(tmpdir):
+    commit_path = tmpdir / "GIT_COMMIT"
+    commit_path.write("abc123\n")
+
+    assert get_git_commit(commit_path) == "abc123"
+
+
+def test_environment_variable_takes_precedence(tmpdir, monkeypatch):
+    commit_path = tmpdir / "GIT_COMMIT"
+    commit_path.write("abc123\n")
+
+    monkeypatch.setenv("BAG_BROWSER_GIT_COMMIT", "def456")
+
+    assert get_git_commit(commit_path) == "def456"
+
+
+def test_falls_back_to_git_if_no_file(tmpdir):
+    commit_path = tmpdir / "GIT_COMMIT"
+
+    commit = write_commit_file(commit_path)
+    assert commit_path.read().strip() == commit
+
+    commit_path.remove()
+    assert get_git_commit(commit_path) == commit
+
+
+def test_unknown_commit_if_git_is_unavailable(tmpdir, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmpdir))
+
+    assert get_git_commit(tmpdir / "GIT_COMMIT") == "unknown"
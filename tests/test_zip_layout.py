@@ -0,0 +1,64 @@
+import pytest
+from zipstreamer import ZipFile, ZipStream
+
+from src.models import BagIdentifier
+from src.zip_layout import ZipLayout, bag_directory
+
+
+def zipstreamer_size(files):
+    """
+    The size of the ZIP that zipstreamer would create for these files.
+    This doesn't read the files, so we can check sizes of huge ZIPs.
+    """
+    zs = ZipStream(
+        files=[
+            ZipFile(
+                filename=filename,
+                size=size,
+                create_fp=lambda: None,
+                datetime=None,
+                comment=None,
+            )
+            for filename, size in files
+        ]
+    )
+
+    return zs.size()
+
+
+@pytest.mark.parametrize(
+    "files",
+    [
+        [],
+        [("bagit.txt", 20)],
+        [("data/b1234.xml", 100), ("data/objects/b1234_0001.jp2", 10000)],
+        [("data/éàü.txt", 10)],
+        [("data/empty.txt", 0)],
+        # A file that needs ZIP64 records
+        [("data/video.mp4", 5 * 1024 ** 3), ("data/small.txt", 10)],
+        # Files that push the central directory past 4GB into the ZIP
+        [("data/1.mp4", 3 * 1024 ** 3), ("data/2.mp4", 3 * 1024 ** 3)],
+        # Too many files for the original ZIP format
+        [(f"data/{i}.txt", 1) for i in range(2 ** 16)],
+    ],
+)
+def test_archive_size_matches_zipstreamer(files):
+    assert ZipLayout.from_files(files).archive_size() == zipstreamer_size(files)
+
+
+def test_can_add_layouts():
+    files1 = [("digitised/b1/v1/bagit.txt", 20)]
+    files2 = [("digitised/b2/v1/data/b2.xml", 100), ("digitised/b2/v1/bagit.txt", 20)]
+
+    layout = ZipLayout.from_files(files1) + ZipLayout.from_files(files2)
+
+    assert layout == ZipLayout.from_files(files1 + files2)
+    assert layout.archive_size() == zipstreamer_size(files1 + files2)
+
+
+def test_bag_directory():
+    bag_identifier = BagIdentifier(
+        space="digitised", external_identifier="b1234", version=2
+    )
+
+    assert bag_directory(bag_identifier) == "digitised/b1234/v2/"
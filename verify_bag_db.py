@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+
+from src.database import OutdatedDatabase
+from src.reconcile import DEFAULT_DIGEST_DEPTH, find_disagreements
+from src.sharding import open_bags_database
+from src.storage_service import StorageService
+
+import humanize
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Check the bags database has the same bags as the storage service, without fetching any manifests."
+    )
+    parser.add_argument(
+        "database",
+        nargs="?",
+        default=os.environ.get("BAG_BROWSER_DATABASE", "bags.db"),
+        help="Path to the bags database (default: bags.db)",
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=DEFAULT_DIGEST_DEPTH,
+        help=f"Narrow down disagreements to identifier prefixes up to this long (default: {DEFAULT_DIGEST_DEPTH})",
+    )
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=8,
+        help="Number of parallel segments to scan DynamoDB in (default: 8)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if not os.path.exists(args.database):
+        sys.exit(f"There is no bags database at {args.database}")
+
+    # A sharded database is a directory, which open_bags_database spots.
+    # We only read the database, so we don't try to migrate it either.
+    bags_database = open_bags_database(args.database, read_only=True)
+
+    try:
+        bags_database.check_schema()
+    except OutdatedDatabase as err:
+        sys.exit(str(err))
+
+    ss = StorageService(table_name="vhs-storage-manifests")
+    storage_digests = ss.get_prefix_digests(depth=args.depth, segments=args.segments)
+
+    disagreements = find_disagreements(bags_database, storage_digests, depth=args.depth)
+
+    for d in disagreements:
+        print(
+            "%s/%s*: %s bags in the storage service, %s in the bags database"
+            % (
+                d.space,
+                d.prefix,
+                humanize.intcomma(d.storage_service.count),
+                humanize.intcomma(d.bags_database.count),
+            )
+        )
+
+    if disagreements:
+        sys.exit(1)
+
+    print("The bags database matches the storage service", file=sys.stderr)